@@ -0,0 +1,246 @@
+import importlib
+import os
+import socket
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from app.database import conexao, incrementar_versao_dados
+from app.metricas import instrumentar_agendador
+
+# --- AGENDADOR COMPARTILHADO ENTRE O WORKER E O PROCESSO WEB ---
+# Com vários processos (workers do uvicorn + python -m app.worker), cada job roda em uma única
+# instância: quem quer executar precisa pegar a trava do job na tabela jobs_travas (um "lease"
+# com prazo, que expira sozinho se o processo morrer no meio).
+
+# MASTERFY_AGENDADOR=0 desliga o agendador no processo web (os jobs ficam só com o worker)
+AGENDADOR_ATIVO = os.environ.get('MASTERFY_AGENDADOR', '1') != '0'
+
+# De quanto em quanto tempo o agendador procura execuções pedidas pela API
+INTERVALO_SOLICITACOES = float(os.environ.get('MASTERFY_JOBS_INTERVALO', 5))
+
+# Uma execução agendada é pulada se outra instância já rodou o mesmo job há menos que isso
+JANELA_DUPLICIDADE = 600
+
+# Modo intradiário (opcional): MASTERFY_INTRADIARIO=1 atualiza os preços da carteira a cada
+# MASTERFY_INTRADIARIO_MINUTOS durante o pregão da B3 (dias úteis, 10h às 17h59 de Brasília)
+INTRADIARIO_ATIVO = os.environ.get('MASTERFY_INTRADIARIO', '0') == '1'
+INTERVALO_INTRADIARIO = int(os.environ.get('MASTERFY_INTRADIARIO_MINUTOS', 15))
+
+IDENTIDADE = f"{socket.gethostname()}:{os.getpid()}"
+
+@dataclass
+class Job:
+    id: str
+    # 'modulo:funcao', importado só na hora de rodar: quem apenas consulta ou enfileira jobs (o processo
+    # web) não carrega o motor de preços, o yfinance e o pandas
+    funcao: str
+    agenda: dict = field(default_factory=dict)  # Argumentos do trigger 'cron'
+    duracao_trava: float = 3600.0               # Prazo do lease; maior que a duração normal do job
+    altera_dados: bool = False                  # Se sim, avisa os caches dos processos web ao terminar
+    janela_duplicidade: float = JANELA_DUPLICIDADE
+
+    def carregar(self):
+        modulo, nome = self.funcao.split(':')
+        return getattr(importlib.import_module(modulo), nome)
+
+
+JOBS = {
+    job.id: job for job in (
+        Job('atualizar_precos_b3', 'app.services.update_prices:atualizar_precos_b3',
+            agenda={'day_of_week': 'mon-fri', 'hour': 18, 'minute': 0}, duracao_trava=1800, altera_dados=True),
+        Job('realizar_backup_diario', 'app.services.backup_engine:realizar_backup_diario',
+            agenda={'hour': 2, 'minute': 0}, duracao_trava=7200),
+        Job('otimizar_banco', 'app.migracoes:otimizar_banco',
+            agenda={'hour': 3, 'minute': 30}, duracao_trava=1800),
+        # Depois da atualização de preços, para os relatórios terem o fechamento do dia
+        Job('exportar_colunar', 'app.services.colunar_engine:exportar_colunar',
+            agenda={'hour': 18, 'minute': 30}, duracao_trava=1800),
+        Job('importar_proventos_anunciados', 'app.services.proventos_engine:importar_anunciados',
+            agenda={'day_of_week': 'mon-fri', 'hour': 19, 'minute': 0}, duracao_trava=1800),
+    )
+}
+
+if INTRADIARIO_ATIVO:
+    JOBS['atualizar_precos_intradiario'] = Job(
+        'atualizar_precos_intradiario', 'app.services.update_prices:atualizar_precos_intradiario',
+        agenda={'day_of_week': 'mon-fri', 'hour': '10-17', 'minute': f'*/{INTERVALO_INTRADIARIO}',
+                'timezone': 'America/Sao_Paulo'},
+        duracao_trava=INTERVALO_INTRADIARIO * 60, altera_dados=True,
+        janela_duplicidade=INTERVALO_INTRADIARIO * 60 / 2,
+    )
+
+
+def _agora_iso() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _dono_trava(execucao_id: int) -> str:
+    return f"{IDENTIDADE}:{execucao_id}"
+
+
+def _reservar(db, job: Job, origem: str, execucao_id: int = None):
+    """
+    Pega a trava do job e marca a execução como 'executando'. Devolve o id da execução,
+    ou None se outra instância está com a trava (ou, em execuções agendadas, já rodou neste horário).
+    """
+    agora = time.time()
+    cursor = db.cursor()
+    cursor.execute("BEGIN IMMEDIATE")  # Serializa a disputa entre processos
+    try:
+        trava = cursor.execute("SELECT dono, expira_em FROM jobs_travas WHERE job = ?", (job.id,)).fetchone()
+        motivo = None
+        # Um lease vivo barra qualquer um, inclusive este processo (o cron e um pedido manual juntos)
+        if trava and trava['expira_em'] > agora:
+            motivo = f"em execução por {trava['dono']}"
+        elif origem == 'agendado' and cursor.execute("""
+            SELECT 1 FROM jobs_execucoes
+            WHERE job = ? AND origem = 'agendado' AND status IN ('executando', 'sucesso') AND solicitado_em >= ?
+        """, (job.id, datetime.fromtimestamp(agora - job.janela_duplicidade).isoformat(timespec='seconds'))).fetchone():
+            motivo = "já executado por outra instância neste horário"
+
+        if motivo:
+            # Pedidos da API continuam pendentes e são tentados de novo na próxima rodada
+            if execucao_id is None:
+                cursor.execute("""
+                    INSERT INTO jobs_execucoes (job, origem, status, dono, solicitado_em, detalhe)
+                    VALUES (?, ?, 'ignorado', ?, ?, ?)
+                """, (job.id, origem, IDENTIDADE, _agora_iso(), motivo))
+            db.commit()
+            return None
+
+        if execucao_id is None:
+            cursor.execute("""
+                INSERT INTO jobs_execucoes (job, origem, status, dono, solicitado_em, inicio)
+                VALUES (?, ?, 'executando', ?, ?, ?)
+            """, (job.id, origem, IDENTIDADE, _agora_iso(), _agora_iso()))
+            execucao_id = cursor.lastrowid
+        else:
+            cursor.execute(
+                "UPDATE jobs_execucoes SET status = 'executando', dono = ?, inicio = ? WHERE id = ?",
+                (IDENTIDADE, _agora_iso(), execucao_id)
+            )
+        # O dono do lease é a execução: quem termina só apaga o próprio, nunca o de uma execução que
+        # pegou a trava depois que a dele expirou
+        cursor.execute(
+            "INSERT OR REPLACE INTO jobs_travas (job, dono, expira_em) VALUES (?, ?, ?)",
+            (job.id, _dono_trava(execucao_id), agora + job.duracao_trava)
+        )
+        db.commit()
+        return execucao_id
+    except Exception:
+        db.rollback()
+        raise
+
+
+def executar_job(job_id: str, origem: str = 'agendado', execucao_id: int = None):
+    """
+    Roda um job sob a trava e registra o resultado em jobs_execucoes. Devolve o id da execução,
+    ou None se o job não rodou por causa da trava.
+    É o que o APScheduler chama; erros sobem de novo para o listener de métricas contar.
+    """
+    job = JOBS[job_id]
+    with conexao() as db:
+        execucao_id = _reservar(db, job, origem, execucao_id)
+    if execucao_id is None:
+        return None
+
+    inicio = time.perf_counter()
+    status, detalhe = 'sucesso', None
+    try:
+        retorno = job.carregar()()
+        if retorno is not None:
+            detalhe = str(retorno)[:1000]
+        return execucao_id
+    except Exception as e:
+        status, detalhe = 'erro', f"{type(e).__name__}: {e}"[:1000]
+        raise
+    finally:
+        with conexao() as db:
+            cursor = db.cursor()
+            cursor.execute(
+                "UPDATE jobs_execucoes SET status = ?, fim = ?, duracao = ?, detalhe = ? WHERE id = ?",
+                (status, _agora_iso(), round(time.perf_counter() - inicio, 3), detalhe, execucao_id)
+            )
+            cursor.execute("DELETE FROM jobs_travas WHERE job = ? AND dono = ?", (job.id, _dono_trava(execucao_id)))
+            if job.altera_dados and status == 'sucesso':
+                incrementar_versao_dados(cursor)
+            db.commit()
+
+
+def solicitar_execucao(db, job_id: str) -> dict:
+    """Enfileira uma execução manual (atendida pelo processo que estiver com o agendador ligado)."""
+    cursor = db.cursor()
+    pendente = cursor.execute(
+        "SELECT * FROM jobs_execucoes WHERE job = ? AND status = 'pendente' ORDER BY id LIMIT 1", (job_id,)
+    ).fetchone()
+    if pendente:
+        return dict(pendente)
+    cursor.execute(
+        "INSERT INTO jobs_execucoes (job, origem, status, solicitado_em) VALUES (?, 'manual', 'pendente', ?) "
+        "RETURNING *",
+        (job_id, _agora_iso())
+    )
+    execucao = dict(cursor.fetchone())
+    db.commit()
+    return execucao
+
+
+def processar_solicitacoes():
+    """Roda as execuções pedidas pela API, na ordem em que chegaram."""
+    with conexao() as db:
+        pendentes = [tuple(linha) for linha in db.execute(
+            "SELECT id, job FROM jobs_execucoes WHERE status = 'pendente' ORDER BY id"
+        )]
+    for execucao_id, job_id in pendentes:
+        if job_id not in JOBS:
+            continue
+        try:
+            executar_job(job_id, origem='manual', execucao_id=execucao_id)
+        except Exception as e:
+            print(f"❌ Execução manual {execucao_id} de {job_id} falhou: {e}")
+
+
+def listar_execucoes(db, job_id: str = None, limite: int = 50) -> list:
+    filtro, parametros = ("WHERE job = ?", [job_id]) if job_id else ("", [])
+    linhas = db.execute(
+        f"SELECT * FROM jobs_execucoes {filtro} ORDER BY id DESC LIMIT ?", (*parametros, limite)
+    ).fetchall()
+    return [dict(linha) for linha in linhas]
+
+
+def situacao_jobs(db, agendador=None) -> list:
+    """Agenda, trava atual, última execução e próxima execução (se o agendador roda neste processo)."""
+    travas = {linha['job']: dict(linha) for linha in db.execute("SELECT * FROM jobs_travas")}
+    ultimas = {linha['job']: dict(linha) for linha in db.execute("""
+        SELECT * FROM jobs_execucoes
+        WHERE id IN (SELECT MAX(id) FROM jobs_execucoes WHERE status NOT IN ('pendente', 'ignorado') GROUP BY job)
+    """)}
+    situacao = []
+    for job in JOBS.values():
+        agendado = agendador.get_job(job.id) if agendador else None
+        trava = travas.get(job.id)
+        situacao.append({
+            "job": job.id,
+            "agenda": job.agenda,
+            "executando_em": trava['dono'] if trava and trava['expira_em'] > time.time() else None,
+            "ultima_execucao": ultimas.get(job.id),
+            "proxima_execucao": agendado.next_run_time.isoformat() if agendado and agendado.next_run_time else None,
+        })
+    return situacao
+
+
+def criar_agendador(bloqueante: bool = False):
+    """Agendador com os jobs do masterfy. Bloqueante no worker; em segundo plano no processo web."""
+    # OTIMIZAÇÃO: APScheduler só é importado por quem de fato agenda (worker ou web com o agendador ligado)
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    agendador = BlockingScheduler() if bloqueante else BackgroundScheduler()
+    for job in JOBS.values():
+        # Ids fixos: viram o rótulo 'job' nas métricas de duração e resultado
+        agendador.add_job(executar_job, trigger='cron', args=(job.id,), id=job.id, **job.agenda)
+    agendador.add_job(processar_solicitacoes, trigger='interval', seconds=INTERVALO_SOLICITACOES,
+                      id='processar_solicitacoes')
+    instrumentar_agendador(agendador)
+    return agendador
@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from email.utils import formatdate
+
+# Chaves usadas pelas rotas. Detalhes de um ativo usam a tupla ('ativo', ativo_id).
+CHAVE_PORTFOLIO = 'portfolio'
+CHAVE_PROVENTOS = 'proventos_total'
+CHAVE_ATIVOS = 'ativos_lista'
+CHAVE_APURACAO = 'apuracao_ir'
+CHAVE_METAS = 'metas_alocacao'
+
+
+def chave_ativo(ativo_id: int) -> tuple:
+    return ('ativo', ativo_id)
+
+
+class CacheCarteira:
+    """
+    Cache em memória para os dados das telas de uma carteira (ver app.carteiras), invalidado pelas
+    próprias rotas de escrita e pelos jobs.
+    Cada chave tem uma versão, usada para o Last-Modified e para descartar cálculos que terminaram
+    depois de uma invalidação. O ETag sai da versão dos dados no banco (ver etag).
+    """
+
+    def __init__(self, carteira: str = ''):
+        self._trava = threading.Lock()
+        self._valores = {}
+        self._versoes = {}
+        self._modificado_em = {}
+        self._dependentes = {}  # chave -> valores derivados dela (ver obter_derivado)
+        self._iniciado_em = time.time()
+        self._carteira = carteira
+
+        # Versão dos dados gravada por outros processos (ver sincronizar_com)
+        self._ler_versao_externa = None
+        self._intervalo_versao = 1.0
+        self._versao_externa = None
+        self._proxima_verificacao = 0.0
+
+        # Métricas
+        self.acertos = 0
+        self.falhas = 0
+        self.invalidacoes = 0
+
+    def sincronizar_com(self, ler_versao, intervalo: float = 1.0):
+        """
+        Registra a função que lê a versão dos dados compartilhada entre processos: uma tupla
+        (versão do banco, versão da carteira), ver app.database.ler_versao_dados.
+        No máximo uma vez por `intervalo` segundos o cache confere a versão e, se outro processo
+        (outro worker do uvicorn, o worker de jobs) gravou algo, descarta tudo.
+        """
+        self._ler_versao_externa = ler_versao
+        self._intervalo_versao = intervalo
+        self._versao_externa = ler_versao()
+        self._proxima_verificacao = time.monotonic() + intervalo
+
+    def registrar_gravacao(self, versao_carteira: int, *chaves):
+        """
+        Invalida as chaves afetadas por uma gravação deste processo e anota a versão da carteira que
+        ela gerou, para a próxima conferência não descartar o cache inteiro por causa dela. Se outro
+        processo também gravou no meio (a versão pulou), nada muda e a conferência descarta tudo.
+        A versão só avança depois da invalidação: um ETag novo nunca sai com um valor velho.
+        """
+        self.invalidar(*chaves)
+        with self._trava:
+            if self._versao_externa is not None and self._versao_externa[1] == versao_carteira - 1:
+                self._versao_externa = (self._versao_externa[0], versao_carteira)
+
+    def conferir_versao_externa(self, forcar: bool = False) -> bool:
+        """Descarta tudo se outro processo gravou desde a última conferência. Devolve se descartou."""
+        if self._ler_versao_externa is None or (not forcar and time.monotonic() < self._proxima_verificacao):
+            return False
+        with self._trava:
+            agora = time.monotonic()
+            if not forcar and agora < self._proxima_verificacao:
+                return False  # Outra thread acabou de conferir
+            self._proxima_verificacao = agora + self._intervalo_versao
+        versao = self._ler_versao_externa()
+        with self._trava:
+            mudou = versao != self._versao_externa
+            self._versao_externa = versao
+        if mudou:
+            self.invalidar_tudo()
+        return mudou
+
+    def obter(self, chave, calcular):
+        """Devolve o valor da chave, calculando (fora da trava) apenas se ainda não estiver em cache."""
+        self.conferir_versao_externa()
+        with self._trava:
+            if chave in self._valores:
+                self.acertos += 1
+                return self._valores[chave]
+            self.falhas += 1
+            versao = self._versoes.get(chave, 0)
+
+        valor = calcular()
+
+        with self._trava:
+            # Se a chave foi invalidada durante o cálculo, o valor já nasceu velho: não guarda
+            if self._versoes.get(chave, 0) == versao:
+                self._valores[chave] = valor
+        return valor
+
+    def obter_derivado(self, chave, nome: str, calcular):
+        """
+        Valor montado a partir de outra chave (um fragmento de HTML, o JSON já serializado), guardado
+        em ('chave', nome) e descartado junto com ela. `calcular` deve ler a chave de origem pelo
+        próprio cache, para que uma invalidação no meio do cálculo também descarte o derivado.
+        """
+        derivada = (chave, nome)
+        with self._trava:
+            self._dependentes.setdefault(chave, set()).add(derivada)
+        return self.obter(derivada, calcular)
+
+    def invalidar(self, *chaves):
+        agora = time.time()
+        with self._trava:
+            for chave in chaves:
+                for afetada in (chave, *self._dependentes.pop(chave, ())):
+                    self._valores.pop(afetada, None)
+                    self._versoes[afetada] = self._versoes.get(afetada, 0) + 1
+                    self._modificado_em[afetada] = agora
+                self.invalidacoes += 1
+
+    def invalidar_tudo(self):
+        with self._trava:
+            chaves = set(self._valores) | set(self._versoes)
+        self.invalidar(*chaves)
+
+    def etag(self, chave) -> str:
+        """
+        ETag a partir das versões dos dados gravadas no banco (a do banco e a da carteira), iguais
+        em todos os processos: outro worker do uvicorn, ou o servidor depois de reiniciar, reconhece
+        o ETag que este emitiu enquanto nada for gravado.
+        """
+        self.conferir_versao_externa()
+        with self._trava:
+            if self._versao_externa is None:  # Sem sincronizar_com: a versão local da chave, só deste processo
+                return f'W/"{self._carteira}.{os.getpid():x}{int(self._iniciado_em):x}-{self._versoes.get(chave, 0)}"'
+            versao_banco, versao_carteira = self._versao_externa
+            return f'W/"{self._carteira}-{versao_banco}.{versao_carteira}"'
+
+    def ultima_modificacao(self, chave) -> str:
+        """Data da última invalidação da chave no formato HTTP (usada no cabeçalho Last-Modified)."""
+        with self._trava:
+            momento = self._modificado_em.get(chave, self._iniciado_em)
+        return formatdate(momento, usegmt=True)
+
+    def estatisticas(self) -> dict:
+        with self._trava:
+            consultas = self.acertos + self.falhas
+            return {
+                "chaves": len(self._valores),
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "taxa_acerto": round(self.acertos / consultas, 4) if consultas else 0.0,
+                "invalidacoes": self.invalidacoes,
+            }
+
@@ -0,0 +1,312 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+
+from app.cache import CacheCarteira
+from app.database import (
+    DATA_DIR, DB_PATH, ID_CARTEIRA_PRINCIPAL, TAMANHO_POOL_ESCRITA, TAMANHO_POOL_LEITURA,
+    PoolConexoes, PoolFechado, conexao, pool_escrita, pool_leitura, ler_versao_dados, fechar_versao_dados
+)
+from app.eventos import CanalEventos
+from app.migracoes import migrar
+
+# --- CARTEIRAS (várias famílias ou clientes na mesma instalação) ---
+# Cada requisição escolhe a carteira pelo cabeçalho X-Carteira, pelo parâmetro ?carteira= ou pelo
+# cookie 'carteira' (ver app.main.carteira_atual); sem nada disso, vale a 'principal'.
+# Onde os dados ficam depende de MASTERFY_CARTEIRAS:
+#   compartilhado (padrão): todas no banco principal, separadas pela coluna carteira_id
+#   arquivo: um arquivo SQLite por carteira em data/carteiras/ (a principal continua em data/masterfy.db)
+MODO_CARTEIRAS = os.environ.get('MASTERFY_CARTEIRAS', 'compartilhado')
+CARTEIRAS_DIR = os.path.join(DATA_DIR, 'carteiras')
+
+# Carteiras com cache e conexões abertas ao mesmo tempo; acima disso a usada há mais tempo é descarregada
+LIMITE_CARTEIRAS_ABERTAS = int(os.environ.get('MASTERFY_CARTEIRAS_ABERTAS', 16))
+
+NOME_PRINCIPAL = 'principal'
+_NOME_VALIDO = re.compile(r'[a-z0-9][a-z0-9_-]{0,39}')
+
+
+class CarteiraNaoEncontrada(LookupError):
+    pass
+
+
+def validar_nome(nome: str) -> str:
+    nome = (nome or '').strip().lower()
+    if not _NOME_VALIDO.fullmatch(nome):
+        raise ValueError("Nome de carteira inválido: use até 40 letras minúsculas, números, '-' ou '_'.")
+    return nome
+
+
+class Carteira:
+    """
+    Uma carteira carregada neste processo: onde estão os dados (banco e carteira_id), o cache das
+    telas e o canal de eventos dos dashboards abertos.
+    """
+
+    def __init__(self, nome: str, id_: int, db_path: str, armazenamento):
+        self.nome = nome
+        self.id = id_
+        self.db_path = db_path
+        self.cache = CacheCarteira(nome)
+        self.canal = CanalEventos()
+        self._armazenamento = armazenamento
+        self._pools = None  # (escrita, leitura) próprios, só no modo 'arquivo'
+        # Gravações de outros processos (workers do uvicorn, jobs) nesta carteira descartam o cache
+        self.cache.sincronizar_com(lambda: ler_versao_dados(db_path, id_))
+
+    @contextmanager
+    def conexao(self, somente_leitura: bool = False):
+        pool = self._armazenamento.pool(self, somente_leitura)
+        try:
+            db = pool.obter()
+        except PoolFechado:
+            # Descarregada entre pegar o pool e pedir a conexão: o armazenamento abre outro
+            pool = self._armazenamento.pool(self, somente_leitura)
+            db = pool.obter()
+        try:
+            yield db
+        finally:
+            pool.devolver(db)
+
+
+class ArmazenamentoCompartilhado:
+    """Todas as carteiras no banco principal, com os pools globais; as consultas filtram por carteira_id."""
+
+    def localizar(self, nome: str):
+        with pool_leitura().conexao() as db:
+            linha = db.execute("SELECT id FROM carteiras WHERE nome = ?", (nome,)).fetchone()
+        return (linha[0], DB_PATH) if linha else None
+
+    def criar(self, nome: str):
+        with conexao() as db:
+            cursor = db.execute("INSERT INTO carteiras (nome) VALUES (?)", (nome,))
+            db.commit()
+        return cursor.lastrowid, DB_PATH
+
+    def listar(self) -> list:
+        with pool_leitura().conexao() as db:
+            return [linha[0] for linha in db.execute("SELECT nome FROM carteiras ORDER BY id")]
+
+    def bancos(self) -> list:
+        return [DB_PATH]
+
+    def pool(self, carteira: Carteira, somente_leitura: bool) -> PoolConexoes:
+        return pool_leitura() if somente_leitura else pool_escrita()
+
+    def liberar(self, carteira: Carteira):
+        pass  # As conexões são dos pools globais
+
+
+class ArmazenamentoPorArquivo:
+    """
+    Um arquivo SQLite por carteira (cada um com a carteira 1 e o esquema completo). Os pools de cada
+    carteira abrem no primeiro uso e fecham quando ela é descarregada.
+    """
+
+    def __init__(self):
+        self._trava = threading.Lock()
+
+    def caminho(self, nome: str) -> str:
+        return DB_PATH if nome == NOME_PRINCIPAL else os.path.join(CARTEIRAS_DIR, f"{nome}.db")
+
+    def localizar(self, nome: str):
+        caminho = self.caminho(nome)
+        if not os.path.exists(caminho):
+            return None
+        # Arquivos de carteira também recebem as migrações novas (custa uma leitura se já estão em dia)
+        migrar(caminho)
+        return ID_CARTEIRA_PRINCIPAL, caminho
+
+    def criar(self, nome: str):
+        caminho = self.caminho(nome)
+        os.makedirs(CARTEIRAS_DIR, exist_ok=True)
+        migrar(caminho)
+        # O nome também fica dentro do arquivo (ajuda a identificar um backup avulso)
+        with closing(sqlite3.connect(caminho)) as db, db:
+            db.execute("UPDATE carteiras SET nome = ? WHERE id = ?", (nome, ID_CARTEIRA_PRINCIPAL))
+        return ID_CARTEIRA_PRINCIPAL, caminho
+
+    def listar(self) -> list:
+        arquivos = sorted(os.listdir(CARTEIRAS_DIR)) if os.path.isdir(CARTEIRAS_DIR) else []
+        return [NOME_PRINCIPAL, *(arquivo[:-3] for arquivo in arquivos if arquivo.endswith('.db'))]
+
+    def bancos(self) -> list:
+        return [self.caminho(nome) for nome in self.listar()]
+
+    def pool(self, carteira: Carteira, somente_leitura: bool) -> PoolConexoes:
+        if carteira.db_path == DB_PATH:
+            return pool_leitura() if somente_leitura else pool_escrita()
+        pools = carteira._pools
+        if pools is None or pools[0].fechado:
+            with self._trava:
+                if carteira._pools is None or carteira._pools[0].fechado:
+                    carteira._pools = (
+                        PoolConexoes(carteira.db_path, TAMANHO_POOL_ESCRITA),
+                        PoolConexoes(carteira.db_path, TAMANHO_POOL_LEITURA, somente_leitura=True),
+                    )
+                pools = carteira._pools
+        return pools[1] if somente_leitura else pools[0]
+
+    def liberar(self, carteira: Carteira):
+        # Conexões livres fecham agora; as que estão em uso fecham quando forem devolvidas
+        pools, carteira._pools = carteira._pools, None
+        for pool in pools or ():
+            pool.fechar()
+        if carteira.db_path != DB_PATH:
+            fechar_versao_dados(carteira.db_path)
+
+
+_armazenamento = None
+_trava = threading.Lock()
+_carregadas = OrderedDict()  # nome -> Carteira, da usada há mais tempo para a mais recente
+_descarregadas = 0
+
+
+def armazenamento():
+    global _armazenamento
+    if _armazenamento is None:
+        if MODO_CARTEIRAS not in ('compartilhado', 'arquivo'):
+            raise ValueError(f"MASTERFY_CARTEIRAS inválido: '{MODO_CARTEIRAS}' (use 'compartilhado' ou 'arquivo')")
+        _armazenamento = ArmazenamentoPorArquivo() if MODO_CARTEIRAS == 'arquivo' else ArmazenamentoCompartilhado()
+    return _armazenamento
+
+
+def _carregar(nome: str, id_: int, db_path: str) -> Carteira:
+    global _descarregadas
+    nova = Carteira(nome, id_, db_path, armazenamento())
+    with _trava:
+        carteira = _carregadas.setdefault(nome, nova)  # Outra thread pode ter carregado antes
+        _carregadas.move_to_end(nome)
+        excesso = len(_carregadas) - LIMITE_CARTEIRAS_ABERTAS
+        saem = []
+        # Nunca descarrega a principal nem carteira com dashboard conectado (perderia os eventos)
+        for candidata in list(_carregadas.values()):
+            if excesso <= 0:
+                break
+            if candidata.nome != NOME_PRINCIPAL and not candidata.canal.assinantes and candidata is not carteira:
+                del _carregadas[candidata.nome]
+                saem.append(candidata)
+                excesso -= 1
+        _descarregadas += len(saem)
+    for antiga in saem:
+        armazenamento().liberar(antiga)
+    return carteira
+
+
+def obter_carteira(nome: str = NOME_PRINCIPAL) -> Carteira:
+    """Carteira pelo nome; na primeira vez localiza os dados e a mantém carregada (LRU)."""
+    nome = validar_nome(nome)
+    with _trava:
+        carteira = _carregadas.get(nome)
+        if carteira is not None:
+            _carregadas.move_to_end(nome)
+            return carteira
+    local = armazenamento().localizar(nome)
+    if local is None:
+        raise CarteiraNaoEncontrada(nome)
+    return _carregar(nome, *local)
+
+
+def criar_carteira(nome: str) -> Carteira:
+    nome = validar_nome(nome)
+    if armazenamento().localizar(nome) is not None:
+        raise ValueError(f"A carteira {nome} já existe.")
+    try:
+        id_, db_path = armazenamento().criar(nome)
+    except sqlite3.IntegrityError:
+        raise ValueError(f"A carteira {nome} já existe.")
+    return _carregar(nome, id_, db_path)
+
+
+def listar_carteiras() -> list:
+    return armazenamento().listar()
+
+
+def carteiras_carregadas() -> list:
+    with _trava:
+        return list(_carregadas.values())
+
+
+def invalidar(db_path: str, carteira_id: int, *chaves):
+    """Descarta chaves do cache da carteira, se ela estiver carregada neste processo (usado pelos jobs)."""
+    for carteira in carteiras_carregadas():
+        if carteira.db_path == db_path and carteira.id == carteira_id:
+            carteira.cache.invalidar(*chaves)
+
+
+def bancos() -> list:
+    """Bancos com carteiras: um só no modo compartilhado, um por carteira no modo 'arquivo'."""
+    return armazenamento().bancos()
+
+
+@contextmanager
+def conexao_banco(db_path: str):
+    """
+    Conexão de escrita com um banco inteiro (todas as carteiras dele), para os jobs que percorrem
+    todos os bancos. Não carrega as carteiras, então não tira do LRU as que estão em uso pelas telas.
+    """
+    if db_path == DB_PATH:
+        with conexao() as db:
+            yield db
+        return
+    migrar(db_path)
+    pool = PoolConexoes(db_path, 1)
+    try:
+        with pool.conexao() as db:
+            yield db
+    finally:
+        pool.fechar()
+
+
+def estatisticas() -> dict:
+    with _trava:
+        carregadas = list(_carregadas)
+        descarregadas = _descarregadas
+    return {
+        "modo": MODO_CARTEIRAS,
+        "limite_carregadas": LIMITE_CARTEIRAS_ABERTAS,
+        "carregadas": carregadas,
+        "descarregadas": descarregadas,
+    }
+
+
+def estatisticas_cache() -> dict:
+    """Métricas dos caches de todas as carteiras carregadas, somadas (exportadas em /metrics)."""
+    total = {"chaves": 0, "acertos": 0, "falhas": 0, "invalidacoes": 0}
+    for carteira in carteiras_carregadas():
+        estatisticas_carteira = carteira.cache.estatisticas()
+        for campo in total:
+            total[campo] += estatisticas_carteira[campo]
+    consultas = total["acertos"] + total["falhas"]
+    total["taxa_acerto"] = round(total["acertos"] / consultas, 4) if consultas else 0.0
+    return total
+
+
+def fechar_carteiras():
+    """Encerra os dashboards conectados e fecha as conexões próprias das carteiras (desligamento)."""
+    with _trava:
+        carregadas = list(_carregadas.values())
+        _carregadas.clear()
+    for carteira in carregadas:
+        carteira.canal.fechar()
+        armazenamento().liberar(carteira)
+
+
+# Uso: python -m app.carteiras [criar NOME]
+if __name__ == '__main__':
+    migrar()
+    if len(sys.argv) >= 3 and sys.argv[1] == 'criar':
+        try:
+            carteira = criar_carteira(sys.argv[2])
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"✅ Carteira {carteira.nome} criada ({MODO_CARTEIRAS}: {carteira.db_path}).")
+    else:
+        for nome in listar_carteiras():
+            print(nome)
+    fechar_carteiras()
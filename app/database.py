@@ -1,63 +1,252 @@
 import sqlite3
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from app.metricas import ConexaoInstrumentada
 
 # Define o caminho do arquivo do banco de dados (vai ficar na pasta 'data/')
 # Isso garante que funcione independente da pasta onde você rodar o script
+# A variável MASTERFY_DATA_DIR permite apontar para outra pasta (testes, benchmarks, containers)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, '..', 'data')
+DATA_DIR = os.environ.get('MASTERFY_DATA_DIR', os.path.join(BASE_DIR, '..', 'data'))
 DB_PATH = os.path.join(DATA_DIR, 'masterfy.db')
 
-def iniciar_banco():
-    # 1. Garante que a pasta 'data' existe (cria se não existir)
-    os.makedirs(DATA_DIR, exist_ok=True)
-
-    # 2. Conecta ao SQLite (se o arquivo masterfy.db não existir, ele é criado aqui)
-    conexao = sqlite3.connect(DB_PATH)
-    cursor = conexao.cursor()
-
-    # 3. Cria a tabela de Ativos
-    # O comando "IF NOT EXISTS" é a mágica que impede erros se rodar o script duas vezes
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS ativos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ticker TEXT NOT NULL UNIQUE,
-            nome TEXT NOT NULL,
-            tipo TEXT NOT NULL,
-            indexador TEXT
-        )
-    ''')
-
-    # 4. Cria a tabela de Transações
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transacoes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ativo_id INTEGER NOT NULL,
-            data DATE NOT NULL,
-            tipo_transacao TEXT NOT NULL,
-            quantidade REAL NOT NULL,
-            preco_unitario REAL NOT NULL,
-            taxas REAL DEFAULT 0.0,
-            FOREIGN KEY (ativo_id) REFERENCES ativos (id)
-        )
-    ''')
-
-    # 5. Cria a tabela de Histórico de Preços
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS historico_precos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ativo_id INTEGER NOT NULL,
-            data DATE NOT NULL,
-            preco REAL NOT NULL,
-            UNIQUE(ativo_id, data),
-            FOREIGN KEY (ativo_id) REFERENCES ativos (id)
-        )
-    ''')
-
-    # 6. Salva as alterações e fecha a conexão
-    conexao.commit()
-    conexao.close()
-    print(f"✅ Banco de dados configurado com sucesso em: {DB_PATH}")
-
-# Isso faz com que a função só rode se executarmos este arquivo diretamente
-if __name__ == '__main__':
-    iniciar_banco()
\ No newline at end of file
+# Carteira criada pelas migrações em todo banco; é a única quando não se usa várias carteiras
+ID_CARTEIRA_PRINCIPAL = 1
+
+# Pragmas aplicados uma única vez, quando a conexão é criada pelo pool
+# (journal_mode=WAL fica gravado no próprio arquivo, então é configurado em app.migracoes.migrar)
+PRAGMAS_CONEXAO = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",      # 8 MB de cache de páginas por conexão
+    "PRAGMA mmap_size=268435456",   # Leituras via mmap de até 256 MB do arquivo
+)
+
+TAMANHO_POOL_ESCRITA = int(os.environ.get('MASTERFY_POOL_ESCRITA', 4))
+TAMANHO_POOL_LEITURA = int(os.environ.get('MASTERFY_POOL_LEITURA', 8))
+
+
+class PoolFechado(RuntimeError):
+    """O pool foi fechado (desligamento, ou carteira descarregada para liberar conexões)."""
+
+
+class PoolConexoes:
+    """
+    Pool limitado de conexões SQLite reaproveitadas entre requisições e threads.
+    As conexões são criadas sob demanda até o limite; acima dele, quem pede espera na fila.
+    """
+
+    def __init__(self, db_path: str, tamanho: int, somente_leitura: bool = False, timeout: float = 10.0):
+        self.db_path = db_path
+        self.tamanho = tamanho
+        self.somente_leitura = somente_leitura
+        self.timeout = timeout
+        self._livres = queue.LifoQueue()  # LIFO: reaproveita a conexão com o cache mais "quente"
+        self._trava = threading.Lock()
+        self._criadas = 0
+        self._fechado = False
+
+        # Métricas
+        self.checkouts = 0
+        self.esperas = 0
+        self.tempo_espera_total = 0.0
+        self.tempo_espera_max = 0.0
+
+    def _nova_conexao(self) -> sqlite3.Connection:
+        # check_same_thread=False: a dependência do FastAPI e a rota podem rodar em threads diferentes,
+        # mas o pool garante que cada conexão só é usada por quem fez o checkout
+        # ConexaoInstrumentada: tempo e linhas de cada comando entram nas métricas da requisição
+        conexao = sqlite3.connect(self.db_path, check_same_thread=False, factory=ConexaoInstrumentada)
+        conexao.row_factory = sqlite3.Row
+        for pragma in PRAGMAS_CONEXAO:
+            conexao.execute(pragma)
+        if self.somente_leitura:
+            conexao.execute("PRAGMA query_only=ON")
+        return conexao
+
+    def obter(self) -> sqlite3.Connection:
+        if self._fechado:
+            raise PoolFechado("Pool de conexões já foi fechado.")
+        try:
+            conexao = self._livres.get_nowait()
+        except queue.Empty:
+            conexao = None
+            with self._trava:
+                if self._criadas < self.tamanho:
+                    self._criadas += 1
+                    criar = True
+                else:
+                    criar = False
+            if criar:
+                try:
+                    conexao = self._nova_conexao()
+                except Exception:
+                    with self._trava:
+                        self._criadas -= 1
+                    raise
+            else:
+                inicio = time.perf_counter()
+                try:
+                    conexao = self._livres.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"Nenhuma conexão livre no pool após {self.timeout}s.")
+                espera = time.perf_counter() - inicio
+                with self._trava:
+                    self.esperas += 1
+                    self.tempo_espera_total += espera
+                    self.tempo_espera_max = max(self.tempo_espera_max, espera)
+
+        with self._trava:
+            self.checkouts += 1
+        return conexao
+
+    def devolver(self, conexao: sqlite3.Connection):
+        # Uma rota que falhou no meio pode deixar uma transação aberta
+        if conexao.in_transaction:
+            conexao.rollback()
+        if self._fechado:
+            conexao.close()
+            return
+        self._livres.put(conexao)
+
+    @contextmanager
+    def conexao(self):
+        conexao = self.obter()
+        try:
+            yield conexao
+        finally:
+            self.devolver(conexao)
+
+    @property
+    def fechado(self) -> bool:
+        return self._fechado
+
+    def metricas(self) -> dict:
+        with self._trava:
+            return {
+                "tamanho": self.tamanho,
+                "criadas": self._criadas,
+                "livres": self._livres.qsize(),
+                "em_uso": self._criadas - self._livres.qsize(),
+                "checkouts": self.checkouts,
+                "esperas": self.esperas,
+                "tempo_espera_total": round(self.tempo_espera_total, 6),
+                "tempo_espera_max": round(self.tempo_espera_max, 6),
+            }
+
+    def fechar(self):
+        self._fechado = True
+        while True:
+            try:
+                conn = self._livres.get_nowait()
+            except queue.Empty:
+                break
+            # PRAGMA optimize ao fechar (recomendação do SQLite): só reanalisa o que as consultas
+            # desta conexão mostraram estar desatualizado, quase sempre não faz nada
+            if not self.somente_leitura:
+                try:
+                    conn.execute("PRAGMA optimize")
+                except sqlite3.Error:
+                    pass
+            conn.close()
+
+
+_pools = {}
+_trava_pools = threading.Lock()
+
+
+def _obter_pool(nome: str, tamanho: int, somente_leitura: bool) -> PoolConexoes:
+    pool = _pools.get(nome)
+    if pool is None:
+        with _trava_pools:
+            pool = _pools.get(nome)
+            if pool is None:
+                pool = PoolConexoes(DB_PATH, tamanho, somente_leitura=somente_leitura)
+                _pools[nome] = pool
+    return pool
+
+
+def pool_escrita() -> PoolConexoes:
+    """Pool usado pelas rotas que gravam e pelos jobs agendados."""
+    return _obter_pool('escrita', TAMANHO_POOL_ESCRITA, somente_leitura=False)
+
+
+def pool_leitura() -> PoolConexoes:
+    """Pool somente leitura (PRAGMA query_only) para as rotas GET."""
+    return _obter_pool('leitura', TAMANHO_POOL_LEITURA, somente_leitura=True)
+
+
+@contextmanager
+def conexao():
+    """Atalho para scripts e jobs: `with conexao() as db:` usando o pool de escrita."""
+    with pool_escrita().conexao() as db:
+        yield db
+
+
+def metricas_pools() -> dict:
+    return {nome: pool.metricas() for nome, pool in _pools.items()}
+
+
+def fechar_pools():
+    with _trava_pools:
+        for pool in _pools.values():
+            pool.fechar()
+        _pools.clear()
+    with _trava_versao:
+        for conexao_versao in _conexoes_versao.values():
+            conexao_versao.close()
+        _conexoes_versao.clear()
+
+
+# Versão dos dados compartilhada entre processos (workers do uvicorn, worker de jobs, CLI): toda
+# gravação incrementa, e o cache de cada processo se descarta quando percebe a mudança.
+# Há a versão do banco ('versao_dados', para gravações que atingem várias carteiras, como os jobs)
+# e uma por carteira ('versao_dados.<id>', para as gravações das rotas de uma carteira só).
+def incrementar_versao_dados(cursor, carteira_id: int = None) -> int:
+    """Marca que os dados mudaram; roda na mesma transação da gravação. Devolve a versão nova."""
+    return cursor.execute("""
+        INSERT INTO meta (chave, valor) VALUES (?, 1)
+        ON CONFLICT(chave) DO UPDATE SET valor = valor + 1
+        RETURNING valor
+    """, (_chave_versao(carteira_id),)).fetchone()[0]
+
+
+def _chave_versao(carteira_id: int = None) -> str:
+    return 'versao_dados' if carteira_id is None else f'versao_dados.{carteira_id}'
+
+
+_conexoes_versao = {}  # Caminho do banco -> conexão usada só para ler a versão
+_trava_versao = threading.Lock()
+
+
+def ler_versao_dados(db_path: str = None, carteira_id: int = ID_CARTEIRA_PRINCIPAL) -> tuple:
+    """
+    Lê (versão do banco, versão da carteira) numa conexão própria (fora dos pools), para o cache poder
+    consultar mesmo quando a rota que pediu já está segurando uma conexão do pool.
+    """
+    db_path = db_path or DB_PATH
+    with _trava_versao:
+        conexao_versao = _conexoes_versao.get(db_path)
+        if conexao_versao is None:
+            conexao_versao = _conexoes_versao[db_path] = sqlite3.connect(db_path, check_same_thread=False)
+        try:
+            versoes = dict(conexao_versao.execute(
+                "SELECT chave, valor FROM meta WHERE chave IN (?, ?)", (_chave_versao(), _chave_versao(carteira_id))
+            ).fetchall())
+        except sqlite3.OperationalError:  # Banco ainda sem a tabela meta
+            return 0, 0
+    return versoes.get(_chave_versao(), 0), versoes.get(_chave_versao(carteira_id), 0)
+
+
+def fechar_versao_dados(db_path: str):
+    """Fecha a conexão de leitura da versão de um banco (carteira descarregada)."""
+    with _trava_versao:
+        conexao_versao = _conexoes_versao.pop(db_path, None)
+    if conexao_versao is not None:
+        conexao_versao.close()
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import threading
+from collections import deque
+
+# --- EVENTOS EM TEMPO REAL (Server-Sent Events) ---
+# As rotas de escrita e os jobs publicam pequenos deltas; cada dashboard aberto recebe pela rota
+# /eventos e atualiza só o que mudou, sem recarregar a página. Cada carteira tem o seu canal.
+
+TAMANHO_FILA = 100        # Eventos pendentes por assinante antes de ele ser considerado atrasado
+TAMANHO_HISTORICO = 256   # Últimos eventos guardados para quem reconecta (Last-Event-ID / ?desde=)
+INTERVALO_PING = 15.0     # Comentário periódico para proxies não derrubarem a conexão ociosa
+
+
+def formatar_sse(id_: int, tipo: str, dados) -> str:
+    return f"id: {id_}\nevent: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+class _Assinante:
+    def __init__(self, loop):
+        self.loop = loop
+        self.fila = asyncio.Queue(TAMANHO_FILA)
+        self.atrasado = False
+
+    def entregar(self, evento):
+        # Roda no loop do assinante (via call_soon_threadsafe)
+        try:
+            self.fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Perdeu eventos: em vez de mandar deltas com buracos, pede para a página recarregar
+            self.atrasado = True
+
+
+class CanalEventos:
+    """Distribui eventos publicados de qualquer thread para os assinantes conectados (um por aba aberta)."""
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._assinantes = set()
+        self._historico = deque(maxlen=TAMANHO_HISTORICO)
+        self._ultimo_id = 0
+        self.estado = {}  # Último estado publicado por assunto, base para calcular os deltas
+
+    @property
+    def assinantes(self) -> int:
+        return len(self._assinantes)
+
+    @property
+    def ultimo_id(self) -> int:
+        return self._ultimo_id
+
+    def _registrar(self, tipo: str, dados: dict):
+        # Chamado com a trava: numera o evento e guarda no histórico
+        self._ultimo_id += 1
+        evento = (self._ultimo_id, tipo, dados)
+        self._historico.append(evento)
+        return evento, list(self._assinantes)
+
+    def publicar(self, tipo: str, dados: dict) -> int:
+        """Thread-safe: pode ser chamado pelas rotas síncronas (threadpool) e pelos jobs."""
+        with self._trava:
+            evento, assinantes = self._registrar(tipo, dados)
+        self._distribuir(evento, assinantes)
+        return evento[0]
+
+    def publicar_delta(self, tipo: str, totais: dict, itens: dict, **extras):
+        """
+        Compara `itens` (id -> dict) com o último estado publicado deste tipo e envia só o que mudou:
+        os itens alterados ou novos, os ids que saíram e os totais. Não envia nada se não mudou nada.
+        """
+        with self._trava:
+            anterior_totais, anteriores = self.estado.get(tipo, (None, {}))
+            alterados = [item for id_, item in itens.items() if anteriores.get(id_) != item]
+            removidos = [id_ for id_ in anteriores if id_ not in itens]
+            self.estado[tipo] = (totais, itens)
+            if not alterados and not removidos and totais == anterior_totais:
+                return None
+            evento, assinantes = self._registrar(
+                tipo, {"totais": totais, "itens": alterados, "removidos": removidos, **extras}
+            )
+        self._distribuir(evento, assinantes)
+        return evento[0]
+
+    def _distribuir(self, evento, assinantes):
+        for assinante in assinantes:
+            try:
+                assinante.loop.call_soon_threadsafe(assinante.entregar, evento)
+            except RuntimeError:  # Loop já fechado (servidor desligando)
+                pass
+
+    async def fluxo(self, desde: int = None):
+        """Gerador do corpo da resposta SSE. Reenvia o que a página perdeu desde o evento `desde`."""
+        assinante = _Assinante(asyncio.get_running_loop())
+        with self._trava:
+            self._assinantes.add(assinante)
+            if desde is not None and desde < self._ultimo_id:
+                perdidos = [evento for evento in self._historico if evento[0] > desde]
+                # Se o histórico já não cobre o intervalo, não há como montar os deltas: recarrega
+                if not perdidos or perdidos[0][0] != desde + 1 or len(perdidos) > TAMANHO_FILA:
+                    assinante.atrasado = True
+                else:
+                    for evento in perdidos:
+                        assinante.fila.put_nowait(evento)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                if assinante.atrasado:
+                    yield formatar_sse(self._ultimo_id, 'recarregar', {})
+                    return
+                try:
+                    id_, tipo, dados = await asyncio.wait_for(assinante.fila.get(), INTERVALO_PING)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if tipo == 'fim':
+                    return
+                yield formatar_sse(id_, tipo, dados)
+        finally:
+            with self._trava:
+                self._assinantes.discard(assinante)
+
+    def fechar(self):
+        """Encerra as conexões abertas (desligamento do servidor)."""
+        with self._trava:
+            assinantes = list(self._assinantes)
+        for assinante in assinantes:
+            try:
+                assinante.loop.call_soon_threadsafe(assinante.entregar, (self._ultimo_id, 'fim', None))
+            except RuntimeError:
+                pass
+
@@ -1,98 +1,155 @@
+import asyncio
+import hashlib
+import io
+import json
 import os
 import sqlite3
+import tempfile
+from dataclasses import asdict
 from datetime import date
-from typing import Optional, List
+from typing import Dict, Optional, List
 
-from fastapi import FastAPI, HTTPException, Depends, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+import numpy as np
+from fastapi import FastAPI, HTTPException, Depends, Request, Form, File, UploadFile
+from fastapi.responses import (
+    HTMLResponse, RedirectResponse, FileResponse, Response, PlainTextResponse, JSONResponse, StreamingResponse
+)
+from starlette.concurrency import run_in_threadpool
+from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from apscheduler.schedulers.background import BackgroundScheduler
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
 
 # Importando os nossos motores
-from app.database import iniciar_banco
-from app.services.backup_engine import realizar_backup_diario
-from app.services.update_prices import atualizar_precos_b3
+from app import metricas
+from app.agendador import (
+    AGENDADOR_ATIVO, JOBS, criar_agendador, solicitar_execucao, listar_execucoes, situacao_jobs
+)
+from app import carteiras
+from app.cache import chave_ativo, CHAVE_PORTFOLIO, CHAVE_PROVENTOS, CHAVE_ATIVOS, CHAVE_APURACAO, CHAVE_METAS
+from app.carteiras import (
+    Carteira, CarteiraNaoEncontrada, NOME_PRINCIPAL, obter_carteira, criar_carteira,
+    listar_carteiras, carteiras_carregadas, fechar_carteiras, validar_nome
+)
+from app.database import (
+    DB_PATH, ID_CARTEIRA_PRINCIPAL, conexao, pool_escrita, pool_leitura, metricas_pools, fechar_pools,
+    incrementar_versao_dados, ler_versao_dados
+)
+from app.migracoes import migrar
+from app.services import backup_engine
+from app.services.backup_engine import criar_snapshot, BACKUP_DIR
+from app.services.colunar_engine import abrir_exportacao, situacao as situacao_colunar
+from app.services.historico_engine import ler_serie
+from app.services.extrato_engine import LIMITE_PADRAO, listar_pagina, resumo_ativo
+from app.services.import_engine import importar_csv
+from app.services.imposto_engine import apurar_meses, resumo_anual
+from app.services.performance_engine import calcular_performance, calcular_performance_colunar
+from app.services.price_engine import cache_cotacoes
+from app.services.proventos_engine import (
+    renda_por_periodo, rendimento_12m, serie_yield, projetar_renda, lancar_anunciados
+)
+from app.services.portfolio_engine import reprocessar_ativo
+from app.services.rebalanceamento_engine import carregar_vetor, carregar_metas, gravar_meta, simular
 
 # --- CONFIGURAÇÕES DO BANCO DE DADOS ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, '..', 'data')
-DB_PATH = os.path.join(DATA_DIR, 'masterfy.db')
-
-# Certifica-se de que a pasta data existe
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
-
-def get_db():
-    conexao = sqlite3.connect(DB_PATH)
-    conexao.row_factory = sqlite3.Row 
-    # OTIMIZAÇÃO: Ativa o modo WAL (Write-Ahead Logging) para concorrência
-    conexao.execute("PRAGMA journal_mode=WAL;")
-    conexao.execute("PRAGMA synchronous=NORMAL;")
-    conexao.execute("PRAGMA foreign_keys=ON;")
+
+# NOVO: Carteira da requisição: cabeçalho X-Carteira, ?carteira= ou o cookie gravado em /carteiras/{nome}/abrir
+def carteira_atual(request: Request) -> Carteira:
+    nome = (request.headers.get("x-carteira") or request.query_params.get("carteira")
+            or request.cookies.get("carteira") or NOME_PRINCIPAL)
     try:
-        yield conexao
-    finally:
-        conexao.close()
+        return obter_carteira(nome)
+    except CarteiraNaoEncontrada:
+        raise HTTPException(status_code=404, detail=f"Carteira não encontrada: {nome}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
-# --- INICIA E ATUALIZA O BANCO ---
-iniciar_banco()
+# OTIMIZAÇÃO: As conexões vêm de um pool e já chegam com os PRAGMAs aplicados
+def get_db(carteira: Carteira = Depends(carteira_atual)):
+    with carteira.conexao() as db:
+        yield db
 
-def aplicar_patch_banco():
-    """Adiciona novas colunas caso o banco seja de uma versão anterior."""
-    conexao = sqlite3.connect(DB_PATH)
-    cursor = conexao.cursor()
-    cursor.execute("PRAGMA table_info(ativos)")
-    colunas = [col[1] for col in cursor.fetchall()]
-    
-    if 'setor' not in colunas:
-        cursor.execute("ALTER TABLE ativos ADD COLUMN setor TEXT DEFAULT 'Outros'")
-    # Nova coluna para armazenar o preço de fechamento
-    if 'preco_atual' not in colunas:
-        cursor.execute("ALTER TABLE ativos ADD COLUMN preco_atual REAL DEFAULT 0.0")
-        
-    # NOVO: Tabela de Proventos
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS proventos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ativo_id INTEGER,
-            data TEXT,
-            tipo TEXT,
-            valor REAL,
-            FOREIGN KEY(ativo_id) REFERENCES ativos(id)
-        )
-    """)
-    conexao.commit()
-    conexao.close()
+# Rotas GET usam um pool separado e somente leitura, que não disputa com as gravações
+def get_db_leitura(carteira: Carteira = Depends(carteira_atual)):
+    with carteira.conexao(somente_leitura=True) as db:
+        yield db
+
+# Jobs e suas execuções ficam sempre no banco principal, qualquer que seja a carteira
+def get_db_principal():
+    with pool_escrita().conexao() as db:
+        yield db
+
+def get_db_principal_leitura():
+    with pool_leitura().conexao() as db:
+        yield db
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Executa ao ligar a aplicação
-    aplicar_patch_banco()
+    # Executa ao ligar a aplicação: cria o banco ou aplica as migrações pendentes
+    migrar()
+
+    # NOVO: Com MASTERFY_AGENDADOR=0 os jobs ficam só com o worker (python -m app.worker)
+    app.state.agendador = None
+    if AGENDADOR_ATIVO:
+        app.state.agendador = criar_agendador()
+        app.state.agendador.start()
 
-    agendador = BackgroundScheduler()
-    agendador.add_job(atualizar_precos_b3, trigger='cron', day_of_week='mon-fri', hour=18, minute=0)
-    agendador.add_job(realizar_backup_diario, trigger='cron', hour=2, minute=0)
-    agendador.start()
+    # NOVO: Repassa aos dashboards abertos as gravações feitas pelos jobs (aqui ou no worker)
+    vigia = asyncio.create_task(_vigiar_alteracoes_externas())
 
     yield # A aplicação fica rodando neste ponto
 
     # Executa ao desligar a aplicação
-    agendador.shutdown()
+    vigia.cancel()
+    fechar_carteiras()
+    if app.state.agendador:
+        app.state.agendador.shutdown()
+    fechar_pools()
 
 # --- INICIALIZANDO A API ---
 app = FastAPI(title="masterfy API", lifespan=lifespan)
+# NOVO: Latência por rota e perfil de SQL de cada requisição (expostos em /metrics)
+app.add_middleware(metricas.MiddlewareMetricas)
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, '..', 'templates'))
 
+# --- ARQUIVOS ESTÁTICOS ---
+# NOVO: CSS pré-gerado no lugar do compilador do Tailwind que rodava no navegador a cada página
+STATIC_DIR = os.path.join(BASE_DIR, '..', 'static')
+
+class ArquivosEstaticos(StaticFiles):
+    """Cache longo no navegador: a URL gerada por `estatico()` muda sempre que o conteúdo muda."""
+    def file_response(self, *args, **kwargs):
+        resposta = super().file_response(*args, **kwargs)
+        resposta.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return resposta
+
+app.mount("/static", ArquivosEstaticos(directory=STATIC_DIR), name="static")
+
+_versoes_estaticos = {}
+def estatico(nome):
+    # Hash do conteúdo calculado uma vez por processo (?v=... invalida o cache a cada deploy que mude o arquivo)
+    if nome not in _versoes_estaticos:
+        with open(os.path.join(STATIC_DIR, nome), 'rb') as arquivo:
+            _versoes_estaticos[nome] = hashlib.sha256(arquivo.read()).hexdigest()[:12]
+    return f"/static/{nome}?v={_versoes_estaticos[nome]}"
+templates.env.globals["estatico"] = estatico
+
 # --- FILTROS DO JINJA2 ---
+# OTIMIZAÇÃO: Uma única passada com str.translate troca ',' <-> '.' (antes eram três replace por célula)
+_PONTUACAO_BR = str.maketrans(',.', '.,')
 def format_moeda(valor):
-    return f"{valor:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+    return f"{valor:,.2f}".translate(_PONTUACAO_BR)
 templates.env.filters["moeda"] = format_moeda
 
 # 1. NOVO: Filtro para formatar a Data (DD/MM/YYYY)
 def format_data_br(data_str):
     if not data_str: return ""
+    # OTIMIZAÇÃO: O formato gravado pelo sistema (AAAA-MM-DD) sai por fatiamento, sem split
+    if len(data_str) == 10 and data_str[4] == '-' and data_str[7] == '-':
+        return f"{data_str[8:]}/{data_str[5:7]}/{data_str[:4]}"
     partes = data_str.split('-')
     if len(partes) == 3:
         return f"{partes[2]}/{partes[1]}/{partes[0]}"
@@ -101,6 +158,9 @@ templates.env.filters["data_br"] = format_data_br
 
 # 2. NOVO: Filtro para limpar a Quantidade (tira o .0)
 def format_qtd(valor):
+    # OTIMIZAÇÃO: Quantidades vêm do banco como float; só os outros tipos passam pela conversão
+    if type(valor) is float:
+        return int(valor) if valor.is_integer() else valor
     try:
         valor_float = float(valor)
         if valor_float.is_integer():
@@ -111,6 +171,8 @@ def format_qtd(valor):
 templates.env.filters["qtd"] = format_qtd
 
 # --- MODELOS (PYDANTIC) ---
+# Descrevem as respostas da API na documentação. Os cálculos trabalham com dicts simples, que os
+# templates leem direto e que são serializados uma vez por versão dos dados (ver obter_portfolio).
 class PosicaoAtivo(BaseModel):
     ativo_id: int
     ticker: str
@@ -132,45 +194,43 @@ class PortfolioResponse(BaseModel):
 
 # --- ROTAS DA API DE DADOS ---
 @app.get("/portfolio/", response_model=PortfolioResponse)
-def obter_portfolio(db: sqlite3.Connection = Depends(get_db)):
+def obter_portfolio(
+    request: Request,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    cache = carteira.cache
+    etag = cache.etag(CHAVE_PORTFOLIO)
+    cabecalhos = {"ETag": etag, "Last-Modified": cache.ultima_modificacao(CHAVE_PORTFOLIO), "Cache-Control": "no-cache"}
+
+    # O cliente já tem a versão atual: responde 304 sem corpo
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=cabecalhos)
+
+    # OTIMIZAÇÃO: O JSON é montado uma vez por versão da carteira, sem passar pela validação do Pydantic
+    corpo = cache.obter_derivado(CHAVE_PORTFOLIO, 'json', lambda: json.dumps(
+        cache.obter(CHAVE_PORTFOLIO, lambda: calcular_portfolio(db, carteira.id)), ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8'))
+    return Response(corpo, media_type="application/json", headers=cabecalhos)
+
+def calcular_portfolio(db: sqlite3.Connection, carteira_id: int = ID_CARTEIRA_PRINCIPAL) -> dict:
     cursor = db.cursor()
     
-    # Busca transações e o preco_atual salvo no banco
+    # OTIMIZAÇÃO: Lê as posições já consolidadas (uma linha por ativo) em vez de somar todas as transações
     cursor.execute("""
-        SELECT a.id, a.ticker, a.nome, a.tipo, a.setor, a.preco_atual,
-               t.data, t.tipo_transacao, t.quantidade, t.preco_unitario
-        FROM transacoes t
-        JOIN ativos a ON t.ativo_id = a.id
-    """)
-    transacoes = cursor.fetchall()
-    
-    posicoes = {}
-    for t in transacoes:
-        ativo_id = t['id']
-        if ativo_id not in posicoes:
-            posicoes[ativo_id] = {
-                "ativo_id": ativo_id, "ticker": t['ticker'], "nome": t['nome'], 
-                "tipo": t['tipo'], "setor": t['setor'], "preco_atual_banco": t['preco_atual'],
-                "quantidade_total": 0.0, "valor_investido": 0.0, "valor_atual": 0.0
-            }
-        
-        if t['tipo_transacao'] == 'COMPRA':
-            posicoes[ativo_id]["quantidade_total"] += t['quantidade']
-            posicoes[ativo_id]["valor_investido"] += (t['quantidade'] * t['preco_unitario'])
-        elif t['tipo_transacao'] == 'VENDA':
-            posicoes[ativo_id]["quantidade_total"] -= t['quantidade']
-            posicoes[ativo_id]["valor_investido"] -= (t['quantidade'] * t['preco_unitario'])
+        SELECT a.id AS ativo_id, a.ticker, a.nome, a.tipo, a.setor, a.preco_atual AS preco_atual_banco,
+               p.quantidade AS quantidade_total, p.valor_investido, p.preco_medio
+        FROM posicoes p
+        JOIN ativos a ON p.ativo_id = a.id
+        WHERE a.carteira_id = ? AND p.quantidade > 0
+    """, (carteira_id,))
+    posicoes = [dict(linha) for linha in cursor.fetchall()]
 
     posicoes_intermediarias = []
     total_investido = 0.0
     total_atual = 0.0
     
-    for pos in posicoes.values():
-        if pos["quantidade_total"] <= 0:
-            continue
-            
-        pos["preco_medio"] = pos["valor_investido"] / pos["quantidade_total"]
-        
+    for pos in posicoes:
         # OTIMIZAÇÃO: Lê do banco ao invés de buscar na internet
         preco_hoje = pos["preco_atual_banco"]
         
@@ -197,175 +257,791 @@ def obter_portfolio(db: sqlite3.Connection = Depends(get_db)):
         pos["valor_investido"] = round(pos["valor_investido"], 2)
         pos["lucro_prejuizo"] = round(pos["lucro_prejuizo"], 2)
         
-        # Removemos a chave temporária para o Pydantic não reclamar
+        # Removemos a chave temporária (o registro sai no mesmo formato do PosicaoAtivo)
         del pos["preco_atual_banco"]
         
-        posicoes_finais.append(PosicaoAtivo(**pos))
+        posicoes_finais.append(pos)
         
-    return PortfolioResponse(
-        valor_total_investido=round(total_investido, 2),
-        valor_total_atual=round(total_atual, 2),
-        lucro_prejuizo_total=round(total_atual - total_investido, 2),
-        posicoes=posicoes_finais
+    # OTIMIZAÇÃO: Dicts simples em vez de objetos Pydantic, que só seriam lidos de volta pelo template
+    return {
+        "valor_total_investido": round(total_investido, 2),
+        "valor_total_atual": round(total_atual, 2),
+        "lucro_prejuizo_total": round(total_atual - total_investido, 2),
+        "posicoes": posicoes_finais,
+    }
+
+@app.get("/cotacoes/{ticker}")
+def obter_cotacao(ticker: str):
+    """Cotação com cache (TTL): pedidos simultâneos do mesmo ticker viram uma única busca no provedor."""
+    cotacao = cache_cotacoes().obter([ticker]).get(ticker.upper())
+    if cotacao is None:
+        raise HTTPException(status_code=404, detail="Cotação indisponível para este ticker")
+    return {"ticker": ticker.upper(), **asdict(cotacao)}
+
+@app.get("/portfolio/performance")
+def obter_performance(
+    janela_volatilidade: int = 21,
+    fonte: str = "banco",
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    if janela_volatilidade < 2:
+        raise HTTPException(status_code=422, detail="A janela de volatilidade deve ter pelo menos 2 dias")
+    if fonte == "banco":
+        return calcular_performance(db, janela_volatilidade=janela_volatilidade, carteira_id=carteira.id)
+    if fonte != "colunar":
+        raise HTTPException(status_code=422, detail="Fonte inválida: use 'banco' ou 'colunar'")
+    # NOVO: Lê a exportação colunar (arquivos em mmap) em vez do SQLite; os dados são os da última exportação
+    exportacao = abrir_exportacao(carteira.db_path)
+    if exportacao is None:
+        raise HTTPException(status_code=404, detail="Ainda não há exportação colunar (job exportar_colunar)")
+    resultado = calcular_performance_colunar(
+        exportacao, janela_volatilidade=janela_volatilidade, carteira_id=carteira.id
+    )
+    return {**resultado, "exportado_em": exportacao.exportado_em}
+
+@app.get("/impostos/{ano}")
+def obter_apuracao_ir(
+    ano: int,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    """Resultado realizado por mês e classe de ativo, isenção, prejuízo a compensar e imposto estimado."""
+    # A apuração de todos os meses só é refeita depois de alguma transação nova, editada ou removida
+    return resumo_anual(carteira.cache.obter(CHAVE_APURACAO, lambda: apurar_meses(db, carteira.id)), ano)
+
+# --- ANÁLISE DE PROVENTOS ---
+@app.get("/proventos/renda")
+def obter_renda_proventos(
+    periodo: str = "mes",
+    grupo: str = "ativo",
+    inicio: Optional[date] = None,
+    fim: Optional[date] = None,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    """Renda recebida por mês ou ano, agrupada por ativo, setor ou tipo de provento."""
+    try:
+        return renda_por_periodo(
+            db, carteira.id, periodo, grupo,
+            inicio.isoformat() if inicio else None, fim.isoformat() if fim else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.get("/proventos/rendimento")
+def obter_rendimento_proventos(
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    """Dividend yield e yield on cost dos últimos 12 meses, por ativo e da carteira."""
+    return rendimento_12m(db, carteira.id)
+
+@app.get("/proventos/projecao")
+def obter_projecao_proventos(
+    meses: int = 12,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    if not 1 <= meses <= 60:
+        raise HTTPException(status_code=422, detail="A projeção vai de 1 a 60 meses")
+    return projetar_renda(db, carteira.id, meses)
+
+@app.get("/ativos/{ativo_id}/yield")
+def obter_serie_yield(
+    ativo_id: int,
+    anos: int = 5,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    """Dividend yield de 12 meses ao fim de cada mês (depende dos proventos anunciados importados)."""
+    ativo = db.execute(
+        "SELECT ticker FROM ativos WHERE id = ? AND carteira_id = ?", (ativo_id, carteira.id)
+    ).fetchone()
+    if not ativo:
+        raise HTTPException(status_code=404, detail="Ativo não encontrado")
+    return serie_yield(db, ativo_id, ativo['ticker'], max(1, min(anos, 20)))
+
+@app.post("/proventos/anunciados/lancar")
+def lancar_proventos_anunciados(
+    request: Request,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db)
+):
+    """Lança na carteira os proventos anunciados já pagos (cada anúncio entra uma vez só)."""
+    ativos = lancar_anunciados(db, carteira.id)
+    if ativos:
+        _confirmar(db, carteira, CHAVE_PROVENTOS, *map(chave_ativo, set(ativos)))
+        _avisar_dashboards(db, carteira, 'provento')
+    return _responder(request, "/", {"lancados": len(ativos)}, db, carteira=carteira)
+
+# --- METAS DE ALOCAÇÃO E REBALANCEAMENTO ---
+class CenarioRebalanceamento(BaseModel):
+    aporte: float
+    nivel: Optional[str] = None
+    choques: Dict[str, float] = {}
+    lote: int = 1
+
+class SimulacoesRebalanceamento(BaseModel):
+    cenarios: List[CenarioRebalanceamento]
+
+LIMITE_CENARIOS = 1000
+
+def _simular(db: sqlite3.Connection, carteira: Carteira, cenarios: list) -> list:
+    # OTIMIZAÇÃO: Posições e preços ficam num vetor NumPy em cache até a próxima gravação na carteira;
+    # cada cenário só refaz a aritmética sobre ele
+    vetor = carteira.cache.obter_derivado(CHAVE_PORTFOLIO, 'rebalanceamento', lambda: carregar_vetor(db, carteira.id))
+    metas = carteira.cache.obter(CHAVE_METAS, lambda: carregar_metas(db, carteira.id))
+    try:
+        return [simular(vetor, metas, c.aporte, c.nivel, c.choques, c.lote) for c in cenarios]
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.get("/metas")
+def listar_metas(
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    return carteira.cache.obter(CHAVE_METAS, lambda: carregar_metas(db, carteira.id))
+
+@app.post("/web/metas/")
+def gravar_meta_web(
+    request: Request,
+    nivel: str = Form(...),
+    chave: str = Form(...),
+    percentual: float = Form(...),
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db)
+):
+    """Cria ou atualiza a meta de um ativo (ticker), setor ou tipo, em percentual da carteira."""
+    try:
+        meta_id = gravar_meta(db, carteira.id, nivel, chave, percentual)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    _confirmar(db, carteira, CHAVE_METAS)
+    return _responder(request, "/", {"meta_id": meta_id})
+
+@app.post("/web/metas/{meta_id}/deletar")
+def deletar_meta_web(
+    request: Request,
+    meta_id: int,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db)
+):
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM metas_alocacao WHERE id = ? AND carteira_id = ?", (meta_id, carteira.id))
+    removido = bool(cursor.rowcount)
+    if removido:
+        _confirmar(db, carteira, CHAVE_METAS)
+    return _responder(request, "/", {"meta_id": meta_id, "removido": removido})
+
+@app.get("/rebalanceamento")
+def obter_rebalanceamento(
+    aporte: float,
+    nivel: Optional[str] = None,
+    lote: int = 1,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    """Compras em lotes inteiros que mais aproximam a carteira das metas usando só o aporte."""
+    return _simular(db, carteira, [CenarioRebalanceamento(aporte=aporte, nivel=nivel, lote=lote)])[0]
+
+@app.post("/rebalanceamento/simular")
+def simular_rebalanceamento(
+    simulacoes: SimulacoesRebalanceamento,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    """Vários cenários de uma vez (valores de aporte, choques de preço por ticker, setor ou tipo)."""
+    if len(simulacoes.cenarios) > LIMITE_CENARIOS:
+        raise HTTPException(status_code=422, detail=f"No máximo {LIMITE_CENARIOS} cenários por chamada")
+    return {"cenarios": _simular(db, carteira, simulacoes.cenarios)}
+
+@app.get("/ativos/{ativo_id}/historico")
+def obter_historico(
+    ativo_id: int,
+    inicio: Optional[date] = None,
+    fim: Optional[date] = None,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    cursor = db.cursor()
+    cursor.execute("SELECT ticker FROM ativos WHERE id = ? AND carteira_id = ?", (ativo_id, carteira.id))
+    ativo = cursor.fetchone()
+    if not ativo:
+        raise HTTPException(status_code=404, detail="Ativo não encontrado")
+
+    datas, precos = ler_serie(
+        db, ativo_id,
+        inicio.isoformat() if inicio else None,
+        fim.isoformat() if fim else None
+    )
+    # Formato colunar: duas listas paralelas em vez de uma lista de objetos por dia
+    return {
+        "ativo_id": ativo_id,
+        "ticker": ativo['ticker'],
+        "datas": np.datetime_as_string(datas).tolist(),
+        "precos": precos.tolist(),
+    }
+
+# --- EVENTOS AO VIVO (SSE) ---
+# Intervalo com que o processo web confere se os jobs gravaram algo (preços atualizados, por exemplo)
+INTERVALO_VIGIA_EVENTOS = float(os.environ.get('MASTERFY_EVENTOS_INTERVALO', 2))
+
+def _total_proventos(db: sqlite3.Connection, carteira: Carteira) -> float:
+    return carteira.cache.obter(CHAVE_PROVENTOS, lambda: db.execute(
+        "SELECT SUM(valor) FROM proventos WHERE carteira_id = ?", (carteira.id,)
+    ).fetchone()[0] or 0.0)
+
+def _estado_dashboard(db: sqlite3.Connection, carteira: Carteira):
+    """Totais dos cards e posições (por ativo_id) como aparecem no dashboard. Sai do cache quando possível."""
+    portfolio = carteira.cache.obter(CHAVE_PORTFOLIO, lambda: calcular_portfolio(db, carteira.id))
+    totais = {
+        "valor_total_investido": portfolio["valor_total_investido"],
+        "valor_total_atual": portfolio["valor_total_atual"],
+        "lucro_prejuizo_total": portfolio["lucro_prejuizo_total"],
+        "total_proventos": round(_total_proventos(db, carteira), 2),
+    }
+    return totais, {pos["ativo_id"]: pos for pos in portfolio["posicoes"]}
+
+def _confirmar(db: sqlite3.Connection, carteira: Carteira, *chaves):
+    """
+    Commit de uma gravação na carteira. A versão dos dados da carteira sobe na mesma transação, então
+    os outros processos (workers do uvicorn, worker de jobs) descartam o cache dela e avisam os seus
+    dashboards; este processo só invalida as `chaves` afetadas.
+    """
+    versao = incrementar_versao_dados(db.cursor(), carteira.id)
+    db.commit()
+    carteira.cache.registrar_gravacao(versao, *chaves)
+
+def _avisar_dashboards(db: sqlite3.Connection, carteira: Carteira, origem: str):
+    """Publica para os dashboards abertos só as posições e totais que mudaram depois de uma gravação."""
+    if not carteira.canal.assinantes:
+        # Ninguém ouvindo: não recalcula nada, só marca que houve mudança. Uma página carregada
+        # antes desta gravação que se conectar depois recebe este evento e se recarrega.
+        carteira.canal.publicar('recarregar', {"origem": origem})
+        return
+    totais, posicoes = _estado_dashboard(db, carteira)
+    carteira.canal.publicar_delta('portfolio', totais, posicoes, origem=origem)
+
+def _avisar_dashboards_externo(carteira: Carteira):
+    # Garante que o cache já descartou os valores antigos antes de montar o delta
+    carteira.cache.conferir_versao_externa(forcar=True)
+    with carteira.conexao(somente_leitura=True) as db:
+        _avisar_dashboards(db, carteira, 'externo')
+
+async def _vigiar_alteracoes_externas():
+    vistas = {}  # Carteira -> última (versão do banco, versão da carteira) vista
+    while True:
+        await asyncio.sleep(INTERVALO_VIGIA_EVENTOS)
+        try:
+            # Só as carteiras com algum dashboard conectado
+            for carteira in carteiras_carregadas():
+                if not carteira.canal.assinantes:
+                    vistas.pop(carteira, None)
+                    continue
+                atual = await run_in_threadpool(ler_versao_dados, carteira.db_path, carteira.id)
+                if vistas.setdefault(carteira, atual) == atual:
+                    continue
+                vistas[carteira] = atual
+                await run_in_threadpool(_avisar_dashboards_externo, carteira)
+        except Exception as e:
+            print(f"⚠️ Falha ao avisar os dashboards sobre alterações externas: {e}")
+
+def _quer_json(request: Request) -> bool:
+    return "application/json" in request.headers.get("accept", "")
+
+def _responder(request: Request, url: str, dados: dict, db: sqlite3.Connection = None,
+               ativo_id: int = None, carteira: Carteira = None):
+    """
+    Formulários comuns continuam recebendo o redirecionamento 303. Quem pede JSON (o fetch do dashboard)
+    recebe o resultado da gravação com a posição do ativo e os totais, para atualizar a tela sem recarregar.
+    """
+    if not _quer_json(request):
+        return RedirectResponse(url=url, status_code=303)
+    if db is not None:
+        totais, posicoes = _estado_dashboard(db, carteira)
+        dados = {**dados, "totais": totais, "posicao": posicoes.get(ativo_id)}
+    return JSONResponse(dados)
+
+@app.get("/eventos")
+async def eventos_dashboard(
+    request: Request, desde: Optional[int] = None, carteira: Carteira = Depends(carteira_atual)
+):
+    # Na reconexão automática o navegador manda o id do último evento recebido
+    ultimo_recebido = request.headers.get("last-event-id", "")
+    if ultimo_recebido.isdigit():
+        desde = int(ultimo_recebido)
+    return StreamingResponse(
+        carteira.canal.fluxo(desde), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 # --- ROTAS WEB (FRONTEND) ---
 @app.get("/", response_class=HTMLResponse)
-def dashboard_web(request: Request, db: sqlite3.Connection = Depends(get_db)):
-    portfolio_data = obter_portfolio(db)
+def dashboard_web(
+    request: Request,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    cache = carteira.cache
+    # Lido antes dos dados: eventos publicados durante a montagem da página são reenviados pelo /eventos
+    ultimo_evento = carteira.canal.ultimo_id
+
+    # OTIMIZAÇÃO: As três consultas só rodam de novo depois de uma gravação ou da atualização de preços
+    portfolio_data = cache.obter(CHAVE_PORTFOLIO, lambda: calcular_portfolio(db, carteira.id))
+    
+    # OTIMIZAÇÃO: As linhas da tabela de posições são renderizadas uma vez por versão da carteira
+    linhas_posicoes = cache.obter_derivado(CHAVE_PORTFOLIO, 'html_linhas', lambda: Markup(
+        templates.get_template("_posicoes.html").render(
+            posicoes=cache.obter(CHAVE_PORTFOLIO, lambda: calcular_portfolio(db, carteira.id))["posicoes"]
+        )
+    ))
     
-    cursor = db.cursor()
     # Busca os ativos para o formulário
-    cursor.execute("SELECT id, ticker FROM ativos ORDER BY ticker")
-    ativos = [dict(row) for row in cursor.fetchall()]
+    ativos = cache.obter(CHAVE_ATIVOS, lambda: [
+        dict(row) for row in db.execute(
+            "SELECT id, ticker, nome FROM ativos WHERE carteira_id = ? ORDER BY ticker", (carteira.id,)
+        )
+    ])
     
     # NOVO: Calcula a soma total de todos os proventos da carteira
-    cursor.execute("SELECT SUM(valor) FROM proventos")
-    resultado = cursor.fetchone()[0]
-    total_proventos = resultado if resultado else 0.0
+    total_proventos = _total_proventos(db, carteira)
     
     return templates.TemplateResponse(
         "index.html", 
         {
             "request": request, 
             "portfolio": portfolio_data, 
+            "linhas_posicoes": linhas_posicoes,
             "ativos": ativos,
-            "total_proventos": total_proventos # Passamos o valor para o HTML
+            "total_proventos": total_proventos, # Passamos o valor para o HTML
+            "ultimo_evento": ultimo_evento,
+            "carteira": carteira.nome,
+            "carteiras": listar_carteiras()
         }
     )
 
 @app.post("/web/ativos/")
 def registrar_ativo_web(
+    request: Request,
     ticker: str = Form(...),
     nome: str = Form(...),
     tipo: str = Form(...),
     setor: str = Form("Outros"),
+    carteira: Carteira = Depends(carteira_atual),
     db: sqlite3.Connection = Depends(get_db)
 ):
     cursor = db.cursor()
     try:
         cursor.execute(
-            "INSERT INTO ativos (ticker, nome, tipo, setor, preco_atual) VALUES (?, ?, ?, ?, 0.0)",
-            (ticker.upper(), nome, tipo.upper(), setor)
+            "INSERT INTO ativos (carteira_id, ticker, nome, tipo, setor, preco_atual) VALUES (?, ?, ?, ?, ?, 0.0)",
+            (carteira.id, ticker.upper(), nome, tipo.upper(), setor)
         )
-        db.commit()
+        # Também descarta um possível "não encontrado" guardado para este id
+        _confirmar(db, carteira, CHAVE_ATIVOS, chave_ativo(cursor.lastrowid))
+        # Ativo novo ainda não tem posição: os dashboards só acrescentam a opção nos formulários
+        carteira.canal.publicar('ativo', {"ativo_id": cursor.lastrowid, "ticker": ticker.upper(), "nome": nome})
     except sqlite3.IntegrityError:
-        pass
-    return RedirectResponse(url="/", status_code=303)
+        if _quer_json(request):
+            raise HTTPException(status_code=409, detail=f"O ativo {ticker.upper()} já está cadastrado")
+        return RedirectResponse(url="/", status_code=303)
+    return _responder(request, "/", {"ativo_id": cursor.lastrowid, "ticker": ticker.upper(), "nome": nome})
 
 @app.post("/web/transacoes/")
 def registrar_transacao_web(
+    request: Request,
     ativo_id: int = Form(...),
     data: str = Form(...),
     tipo_transacao: str = Form(...),
     quantidade: float = Form(...),
     preco_unitario: float = Form(...),
+    taxas: float = Form(0.0),
+    carteira: Carteira = Depends(carteira_atual),
     db: sqlite3.Connection = Depends(get_db)
 ):
+    data, tipo_transacao = _validar_data(data), _validar_tipo_transacao(tipo_transacao)
+    _exigir_ativo(db, carteira, ativo_id)
     cursor = db.cursor()
-    cursor.execute(
-        "INSERT INTO transacoes (ativo_id, data, tipo_transacao, quantidade, preco_unitario) VALUES (?, ?, ?, ?, ?)",
-        (ativo_id, data, tipo_transacao.upper(), quantidade, preco_unitario)
-    )
-    db.commit()
-    return RedirectResponse(url="/", status_code=303)
+    with _restricoes_como_422():
+        cursor.execute(
+            "INSERT INTO transacoes (carteira_id, ativo_id, data, tipo_transacao, quantidade, preco_unitario, taxas) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (carteira.id, ativo_id, data, tipo_transacao, quantidade, preco_unitario, taxas)
+        )
+    transacao_id = cursor.lastrowid
+    # Refaz a posição e a apuração do ativo a partir do mês da transação (pode ser retroativa)
+    reprocessar_ativo(cursor, ativo_id, data)
+    _confirmar(db, carteira, CHAVE_PORTFOLIO, CHAVE_APURACAO, chave_ativo(ativo_id))
+    _avisar_dashboards(db, carteira, 'transacao')
+    return _responder(request, "/", {"transacao_id": transacao_id}, db, ativo_id, carteira)
 
 @app.get("/ativo/{ativo_id}", response_class=HTMLResponse)
-def detalhes_ativo(request: Request, ativo_id: int, db: sqlite3.Connection = Depends(get_db)):
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM ativos WHERE id = ?", (ativo_id,))
-    ativo = cursor.fetchone()
-    if not ativo:
+def detalhes_ativo(
+    request: Request,
+    ativo_id: int,
+    cursor_transacoes: Optional[str] = None,
+    cursor_proventos: Optional[str] = None,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    # A primeira página (o caso comum) fica em cache; as páginas seguintes são lidas por chave
+    dados = carteira.cache.obter(chave_ativo(ativo_id), lambda: _carregar_detalhes_ativo(db, ativo_id, carteira.id))
+    if not dados:
         raise HTTPException(status_code=404, detail="Ativo não encontrado")
-    
-    cursor.execute("SELECT * FROM transacoes WHERE ativo_id = ? ORDER BY data DESC", (ativo_id,))
-    transacoes = [dict(linha) for linha in cursor.fetchall()]
-    
-    # NOVO: Busca os proventos e soma o total
-    cursor.execute("SELECT * FROM proventos WHERE ativo_id = ? ORDER BY data DESC", (ativo_id,))
-    proventos = [dict(linha) for linha in cursor.fetchall()]
-    total_proventos = sum(p['valor'] for p in proventos)
+
+    try:
+        transacoes = listar_pagina(db, 'transacoes', ativo_id, cursor_transacoes) if cursor_transacoes \
+            else dados["transacoes"]
+        proventos = listar_pagina(db, 'proventos', ativo_id, cursor_proventos) if cursor_proventos \
+            else dados["proventos"]
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     
     return templates.TemplateResponse(
         "ativo.html", 
         {
-            "request": request, "ativo": dict(ativo), 
-            "transacoes": transacoes, "proventos": proventos, 
-            "total_proventos": total_proventos
+            "request": request, "ativo": dados["ativo"], "resumo": dados["resumo"],
+            "transacoes": transacoes["itens"], "proximo_transacoes": transacoes["proximo_cursor"],
+            "proventos": proventos["itens"], "proximo_proventos": proventos["proximo_cursor"],
+            "cursor_transacoes": cursor_transacoes, "cursor_proventos": cursor_proventos,
+            "total_proventos": dados["resumo"]["total_proventos"]
         }
     )
 
+def _carregar_detalhes_ativo(db: sqlite3.Connection, ativo_id: int, carteira_id: int = ID_CARTEIRA_PRINCIPAL):
+    ativo = db.execute("SELECT * FROM ativos WHERE id = ? AND carteira_id = ?", (ativo_id, carteira_id)).fetchone()
+    if not ativo:
+        return None
+    
+    # OTIMIZAÇÃO: Só a primeira página de cada lista; contagens e somas vêm prontas do SQL
+    return {
+        "ativo": dict(ativo),
+        "resumo": resumo_ativo(db, ativo_id),
+        "transacoes": listar_pagina(db, 'transacoes', ativo_id),
+        "proventos": listar_pagina(db, 'proventos', ativo_id),
+    }
+
+TIPOS_TRANSACAO = ('COMPRA', 'VENDA')
+
+def _validar_data(data: str) -> str:
+    """422 (em vez do 500 do CHECK da tabela) para data inválida; devolve a data no formato AAAA-MM-DD."""
+    try:
+        return date.fromisoformat(data.strip()).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Data inválida: '{data}' (use AAAA-MM-DD)")
+
+def _validar_tipo_transacao(tipo_transacao: str) -> str:
+    tipo_transacao = tipo_transacao.strip().upper()
+    if tipo_transacao not in TIPOS_TRANSACAO:
+        raise HTTPException(status_code=422, detail=f"Tipo de transação inválido: '{tipo_transacao}' (use COMPRA ou VENDA)")
+    return tipo_transacao
+
+@contextmanager
+def _restricoes_como_422():
+    """Um CHECK do banco que escapou da validação (a conexão volta ao pool com rollback) vira 422, não 500."""
+    try:
+        yield
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(status_code=422, detail=f"Dados inválidos: {e}")
+
+def _exigir_ativo(db: sqlite3.Connection, carteira: Carteira, ativo_id: int):
+    """404 para ativo inexistente ou de outra carteira (no banco compartilhado os ids são de todas)."""
+    if not db.execute("SELECT 1 FROM ativos WHERE id = ? AND carteira_id = ?", (ativo_id, carteira.id)).fetchone():
+        raise HTTPException(status_code=404, detail="Ativo não encontrado")
+
+def _pagina_json(db: sqlite3.Connection, carteira: Carteira, tabela: str, ativo_id: int,
+                 cursor: Optional[str], limite: int):
+    _exigir_ativo(db, carteira, ativo_id)
+    try:
+        return listar_pagina(db, tabela, ativo_id, cursor, limite)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.get("/ativos/{ativo_id}/transacoes")
+def listar_transacoes(
+    ativo_id: int,
+    cursor: Optional[str] = None,
+    limite: int = LIMITE_PADRAO,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    return _pagina_json(db, carteira, 'transacoes', ativo_id, cursor, limite)
+
+@app.get("/ativos/{ativo_id}/proventos")
+def listar_proventos(
+    ativo_id: int,
+    cursor: Optional[str] = None,
+    limite: int = LIMITE_PADRAO,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    return _pagina_json(db, carteira, 'proventos', ativo_id, cursor, limite)
+
+@app.get("/ativos/{ativo_id}/resumo")
+def obter_resumo_ativo(
+    ativo_id: int,
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db_leitura)
+):
+    dados = carteira.cache.obter(chave_ativo(ativo_id), lambda: _carregar_detalhes_ativo(db, ativo_id, carteira.id))
+    if not dados:
+        raise HTTPException(status_code=404, detail="Ativo não encontrado")
+    return dados["resumo"]
+
 @app.post("/web/transacoes/{transacao_id}/deletar")
 def deletar_transacao_web(
+    request: Request,
     transacao_id: int, 
     ativo_id: int = Form(...), 
+    carteira: Carteira = Depends(carteira_atual),
     db: sqlite3.Connection = Depends(get_db)
 ):
     cursor = db.cursor()
-    cursor.execute("DELETE FROM transacoes WHERE id = ?", (transacao_id,))
-    db.commit()
-    return RedirectResponse(url=f"/ativo/{ativo_id}", status_code=303)
+    cursor.execute(
+        "DELETE FROM transacoes WHERE id = ? AND carteira_id = ? RETURNING ativo_id, data", (transacao_id, carteira.id)
+    )
+    antiga = cursor.fetchone()
+    if antiga:
+        # Só os meses a partir da transação removida mudam
+        reprocessar_ativo(cursor, antiga['ativo_id'], antiga['data'])
+        _confirmar(db, carteira, CHAVE_PORTFOLIO, CHAVE_APURACAO, chave_ativo(antiga['ativo_id']))
+        _avisar_dashboards(db, carteira, 'transacao')
+    return _responder(
+        request, f"/ativo/{ativo_id}", {"transacao_id": transacao_id, "removida": bool(antiga)}, db, ativo_id, carteira
+    )
 
 @app.post("/web/transacoes/{transacao_id}/editar")
 def editar_transacao_web(
+    request: Request,
     transacao_id: int,
     ativo_id: int = Form(...),
     data: str = Form(...),
     tipo_transacao: str = Form(...),
     quantidade: float = Form(...),
     preco_unitario: float = Form(...),
+    taxas: float = Form(0.0),
+    carteira: Carteira = Depends(carteira_atual),
     db: sqlite3.Connection = Depends(get_db)
 ):
+    data, tipo_transacao = _validar_data(data), _validar_tipo_transacao(tipo_transacao)
     cursor = db.cursor()
-    cursor.execute(
-        "UPDATE transacoes SET data = ?, tipo_transacao = ?, quantidade = ?, preco_unitario = ? WHERE id = ?",
-        (data, tipo_transacao, quantidade, preco_unitario, transacao_id)
-    )
-    db.commit()
-    return RedirectResponse(url=f"/ativo/{ativo_id}", status_code=303)
+    cursor.execute("SELECT ativo_id, data FROM transacoes WHERE id = ? AND carteira_id = ?", (transacao_id, carteira.id))
+    antiga = cursor.fetchone()
+    if not antiga:
+        raise HTTPException(status_code=404, detail="Transação não encontrada")
+
+    with _restricoes_como_422():
+        cursor.execute(
+            "UPDATE transacoes SET data = ?, tipo_transacao = ?, quantidade = ?, preco_unitario = ?, taxas = ? "
+            "WHERE id = ?",
+            (data, tipo_transacao, quantidade, preco_unitario, taxas, transacao_id)
+        )
+    # Reprocessa a partir da mais antiga entre a data antiga e a nova, na mesma transação do UPDATE
+    reprocessar_ativo(cursor, antiga['ativo_id'], min(antiga['data'], data))
+    _confirmar(db, carteira, CHAVE_PORTFOLIO, CHAVE_APURACAO, chave_ativo(antiga['ativo_id']))
+    _avisar_dashboards(db, carteira, 'transacao')
+    return _responder(request, f"/ativo/{ativo_id}", {"transacao_id": transacao_id}, db, antiga['ativo_id'], carteira)
     
 @app.post("/web/ativos/{ativo_id}/editar")
 def editar_ativo_web(
+    request: Request,
     ativo_id: int,
     setor: str = Form(...),
+    carteira: Carteira = Depends(carteira_atual),
     db: sqlite3.Connection = Depends(get_db)
 ):
     cursor = db.cursor()
-    cursor.execute("UPDATE ativos SET setor = ? WHERE id = ?", (setor, ativo_id))
-    db.commit()
-    return RedirectResponse(url=f"/ativo/{ativo_id}", status_code=303)
+    cursor.execute("UPDATE ativos SET setor = ? WHERE id = ? AND carteira_id = ?", (setor, ativo_id, carteira.id))
+    _confirmar(db, carteira, CHAVE_PORTFOLIO, chave_ativo(ativo_id))
+    _avisar_dashboards(db, carteira, 'ativo')
+    return _responder(request, f"/ativo/{ativo_id}", {"ativo_id": ativo_id, "setor": setor}, db, ativo_id, carteira)
+
+# --- IMPORTAÇÃO EM LOTE ---
+def _importar_upload(db: sqlite3.Connection, carteira: Carteira, arquivo: UploadFile, destino: str, formato: str):
+    # Lê o upload como texto em streaming, sem carregar o arquivo inteiro na memória
+    texto = io.TextIOWrapper(arquivo.file, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        resumo = importar_csv(
+            db, texto, destino=destino, formato=formato, carteira_id=carteira.id, cache=carteira.cache
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    finally:
+        texto.detach()
+    _avisar_dashboards(db, carteira, 'importacao')
+    return asdict(resumo)
+
+@app.post("/import/transacoes")
+def importar_transacoes(
+    arquivo: UploadFile = File(...),
+    formato: str = Form("auto"),
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db)
+):
+    """CSV próprio (data, ticker, tipo_transacao, quantidade, preco_unitario[, taxas]) ou extrato de negociação da B3."""
+    return _importar_upload(db, carteira, arquivo, 'transacoes', formato)
+
+@app.post("/import/proventos")
+def importar_proventos(
+    arquivo: UploadFile = File(...),
+    formato: str = Form("auto"),
+    carteira: Carteira = Depends(carteira_atual),
+    db: sqlite3.Connection = Depends(get_db)
+):
+    """CSV próprio (data, ticker, tipo, valor) ou extrato de movimentação da B3."""
+    return _importar_upload(db, carteira, arquivo, 'proventos', formato)
+
+@app.get("/db/metricas")
+def obter_metricas_banco():
+    """Checkouts e tempo de espera de cada pool de conexões."""
+    return metricas_pools()
+
+@app.get("/cache/metricas")
+def obter_metricas_cache():
+    """Acertos, falhas e invalidações dos caches das telas (somados entre as carteiras carregadas)."""
+    return carteiras.estatisticas_cache()
+
+# --- CARTEIRAS ---
+@app.get("/carteiras")
+def obter_carteiras(carteira: Carteira = Depends(carteira_atual)):
+    """Carteiras existentes, a escolhida nesta requisição e quais estão carregadas neste processo."""
+    return {"atual": carteira.nome, "carteiras": listar_carteiras(), **carteiras.estatisticas()}
+
+@app.post("/carteiras", status_code=201)
+def criar_carteira_web(request: Request, nome: str = Form(...)):
+    try:
+        nome = validar_nome(nome)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        carteira = criar_carteira(nome)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not _quer_json(request):
+        return RedirectResponse(url=f"/carteiras/{carteira.nome}/abrir", status_code=303)
+    return JSONResponse({"carteira": carteira.nome}, status_code=201)
+
+@app.get("/carteiras/{nome}/abrir")
+def abrir_carteira(nome: str):
+    """Passa a usar a carteira no navegador (cookie) e volta para o dashboard."""
+    try:
+        carteira = obter_carteira(nome)
+    except (CarteiraNaoEncontrada, ValueError):
+        raise HTTPException(status_code=404, detail=f"Carteira não encontrada: {nome}")
+    resposta = RedirectResponse(url="/", status_code=303)
+    resposta.set_cookie("carteira", carteira.nome, max_age=365 * 24 * 3600, samesite="lax")
+    return resposta
+
+# --- EXPORTAÇÃO COLUNAR ---
+@app.get("/exportacao/colunar")
+def obter_exportacao_colunar(carteira: Carteira = Depends(carteira_atual)):
+    """Quando o banco da carteira foi exportado por último, e quantas linhas e segmentos tem cada tabela."""
+    return situacao_colunar(carteira.db_path)
+
+@app.post("/exportacao/colunar", status_code=202)
+def solicitar_exportacao_colunar(db: sqlite3.Connection = Depends(get_db_principal)):
+    """Pede uma exportação agora; quem roda é o processo com o agendador (como /jobs/{job_id}/executar)."""
+    return solicitar_execucao(db, 'exportar_colunar')
+
+# --- JOBS AGENDADOS ---
+@app.get("/jobs")
+def obter_jobs(request: Request, db: sqlite3.Connection = Depends(get_db_principal_leitura)):
+    """Situação de cada job: agenda, quem está executando, última e próxima execução."""
+    agendador = getattr(request.app.state, 'agendador', None)
+    return {
+        "agendador_neste_processo": agendador is not None,
+        "jobs": situacao_jobs(db, agendador),
+    }
+
+@app.get("/jobs/execucoes")
+def obter_execucoes_jobs(
+    job: Optional[str] = None,
+    limite: int = 50,
+    db: sqlite3.Connection = Depends(get_db_principal_leitura)
+):
+    return listar_execucoes(db, job, max(1, min(limite, 500)))
+
+@app.post("/jobs/{job_id}/executar", status_code=202)
+def executar_job_manual(job_id: str, db: sqlite3.Connection = Depends(get_db_principal)):
+    """Pede uma execução fora de hora; quem roda é o processo com o agendador ligado (worker)."""
+    if job_id not in JOBS:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return solicitar_execucao(db, job_id)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def obter_metricas_prometheus():
+    """Rotas, SQL, jobs, pools, cache e último backup no formato de exposição do Prometheus."""
+    texto = metricas.exportar(
+        pools=metricas_pools(), cache=carteiras.estatisticas_cache(), backup=backup_engine.ultimas_metricas,
+        cotacoes=cache_cotacoes().estatisticas()
+    )
+    return PlainTextResponse(texto, media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/backup/download")
-def baixar_backup_manual():
+def baixar_backup_manual(carteira: Carteira = Depends(carteira_atual)):
     data_hoje = date.today().strftime('%Y-%m-%d')
     nome_arquivo = f"masterfy_exportacao_{data_hoje}.db"
-    if os.path.exists(DB_PATH):
-        return FileResponse(path=DB_PATH, media_type='application/octet-stream', filename=nome_arquivo)
-    raise HTTPException(status_code=404, detail="Banco de dados não encontrado.")
+    if carteira.db_path != DB_PATH:
+        nome_arquivo = f"masterfy_{carteira.nome}_{data_hoje}.db"
+    elif carteira.nome != NOME_PRINCIPAL:
+        # No banco compartilhado o arquivo tem todas as carteiras: só a principal pode baixá-lo
+        raise HTTPException(status_code=403, detail="O download do banco compartilhado é exclusivo da carteira principal.")
+    if not os.path.exists(carteira.db_path):
+        raise HTTPException(status_code=404, detail="Banco de dados não encontrado.")
+
+    # Envia uma cópia consistente (API de backup do SQLite), nunca o arquivo vivo no meio de uma gravação
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    descritor, snapshot = tempfile.mkstemp(prefix='download_', suffix='.db', dir=BACKUP_DIR)
+    os.close(descritor)
+    try:
+        criar_snapshot(snapshot, conectar=carteira.conexao)
+    except Exception:
+        os.remove(snapshot)
+        raise
+    return FileResponse(
+        path=snapshot, media_type='application/octet-stream', filename=nome_arquivo,
+        background=BackgroundTask(os.remove, snapshot)
+    )
     
 @app.post("/web/proventos/")
 def registrar_provento_web(
+    request: Request,
     ativo_id: int = Form(...),
     data: str = Form(...),
     tipo: str = Form(...),
     valor: float = Form(...),
+    carteira: Carteira = Depends(carteira_atual),
     db: sqlite3.Connection = Depends(get_db)
 ):
+    data = _validar_data(data)
+    _exigir_ativo(db, carteira, ativo_id)
     cursor = db.cursor()
-    cursor.execute(
-        "INSERT INTO proventos (ativo_id, data, tipo, valor) VALUES (?, ?, ?, ?)",
-        (ativo_id, data, tipo, valor)
-    )
-    db.commit()
-    return RedirectResponse(url=f"/ativo/{ativo_id}", status_code=303)
+    with _restricoes_como_422():
+        cursor.execute(
+            "INSERT INTO proventos (carteira_id, ativo_id, data, tipo, valor) VALUES (?, ?, ?, ?, ?)",
+            (carteira.id, ativo_id, data, tipo, valor)
+        )
+    _confirmar(db, carteira, CHAVE_PROVENTOS, chave_ativo(ativo_id))
+    _avisar_dashboards(db, carteira, 'provento')
+    return _responder(request, f"/ativo/{ativo_id}", {"provento_id": cursor.lastrowid}, db, ativo_id, carteira)
 
 @app.post("/web/proventos/{provento_id}/deletar")
 def deletar_provento_web(
+    request: Request,
     provento_id: int, 
     ativo_id: int = Form(...), 
+    carteira: Carteira = Depends(carteira_atual),
     db: sqlite3.Connection = Depends(get_db)
 ):
     cursor = db.cursor()
-    cursor.execute("DELETE FROM proventos WHERE id = ?", (provento_id,))
-    db.commit()
-    return RedirectResponse(url=f"/ativo/{ativo_id}", status_code=303)
+    cursor.execute(
+        "DELETE FROM proventos WHERE id = ? AND carteira_id = ? RETURNING ativo_id", (provento_id, carteira.id)
+    )
+    removido = cursor.fetchone()
+    if removido:
+        _confirmar(db, carteira, CHAVE_PROVENTOS, chave_ativo(removido['ativo_id']))
+        _avisar_dashboards(db, carteira, 'provento')
+    return _responder(
+        request, f"/ativo/{ativo_id}", {"provento_id": provento_id, "removido": bool(removido)}, db, ativo_id, carteira
+    )
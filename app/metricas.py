@@ -0,0 +1,345 @@
+import contextvars
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from operator import itemgetter
+
+# --- INSTRUMENTAÇÃO: latência das rotas, consultas SQL por requisição e jobs agendados ---
+# Tudo fica em memória no próprio processo e sai em formato Prometheus na rota /metrics.
+
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_JOBS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+# Log de consultas lentas (opcional): MASTERFY_SQL_LENTA_MS=200 imprime as consultas acima de 200 ms
+LIMITE_CONSULTA_LENTA = float(os.environ.get('MASTERFY_SQL_LENTA_MS', 0)) / 1000
+
+# Uma requisição com mais consultas que isso continua contada, mas sem o detalhe de cada uma
+MAX_CONSULTAS_POR_PERFIL = 5000
+
+
+class Histograma:
+    """Histograma cumulativo no modelo do Prometheus, com uma série por combinação de rótulos."""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: tuple, buckets: tuple = BUCKETS_LATENCIA):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.buckets = buckets
+        self._series = {}
+        self._trava = threading.Lock()
+
+    def observar(self, valor: float, *rotulos):
+        indice = bisect_left(self.buckets, valor)
+        with self._trava:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                # [contagem por bucket (o último é o +Inf), soma, total]
+                serie = self._series[rotulos] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exportar(self) -> list:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._trava:
+            series = [(rotulos, list(contagens), soma, total) for rotulos, (contagens, soma, total) in self._series.items()]
+        for rotulos, contagens, soma, total in series:
+            base = _rotulos(self.rotulos, rotulos)
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + ('+Inf',), contagens):
+                acumulado += contagem
+                linhas.append(f'{self.nome}_bucket{{{base}{"," if base else ""}le="{limite}"}} {acumulado}')
+            sufixo = f"{{{base}}}" if base else ''
+            linhas.append(f"{self.nome}_sum{sufixo} {soma:.6f}")
+            linhas.append(f"{self.nome}_count{sufixo} {total}")
+        return linhas
+
+
+class Contador:
+    def __init__(self, nome: str, ajuda: str, rotulos: tuple):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self._series = {}
+        self._trava = threading.Lock()
+
+    def incrementar(self, valor: float = 1, *rotulos):
+        with self._trava:
+            self._series[rotulos] = self._series.get(rotulos, 0) + valor
+
+    def exportar(self) -> list:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        with self._trava:
+            series = list(self._series.items())
+        linhas.extend(f"{self.nome}{{{_rotulos(self.rotulos, rotulos)}}} {_numero(valor)}" for rotulos, valor in series)
+        return linhas
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _numero(valor) -> str:
+    return str(valor) if isinstance(valor, int) else repr(float(valor))
+
+
+def _rotulos(nomes: tuple, valores: tuple) -> str:
+    return ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores))
+
+
+def _medidor(nome: str, ajuda: str, valores: dict, rotulo: str = None) -> list:
+    """Gauge calculado na hora da coleta. `valores` é {valor_do_rotulo: numero} ou {None: numero}."""
+    linhas = [f"# HELP {nome} {ajuda}", f"# TYPE {nome} gauge"]
+    for chave, valor in valores.items():
+        if valor is None:
+            continue
+        sufixo = f'{{{rotulo}="{_escapar(chave)}"}}' if rotulo else ''
+        linhas.append(f"{nome}{sufixo} {_numero(valor)}")
+    return linhas
+
+
+# --- MÉTRICAS REGISTRADAS ---
+http_duracao = Histograma(
+    'masterfy_http_duracao_segundos', "Latência das requisições por rota", ('metodo', 'rota'))
+http_requisicoes = Contador(
+    'masterfy_http_requisicoes_total', "Requisições atendidas por rota e status", ('metodo', 'rota', 'status'))
+sql_duracao = Histograma(
+    'masterfy_sql_duracao_segundos', "Tempo de cada comando SQL (execução e leitura das linhas)", ('operacao',))
+sql_consultas = Contador(
+    'masterfy_sql_consultas_total', "Comandos SQL executados por rota", ('rota',))
+sql_linhas = Contador(
+    'masterfy_sql_linhas_total', "Linhas lidas ou alteradas pelos comandos SQL por rota", ('rota',))
+sql_segundos = Contador(
+    'masterfy_sql_segundos_total', "Tempo gasto no SQLite por rota", ('rota',))
+job_duracao = Histograma(
+    'masterfy_job_duracao_segundos', "Duração dos jobs agendados", ('job',), BUCKETS_JOBS)
+job_execucoes = Contador(
+    'masterfy_job_execucoes_total', "Execuções dos jobs agendados por resultado", ('job', 'resultado'))
+
+_ultima_execucao_job = {}
+_inicio_job = {}
+_trava_jobs = threading.Lock()
+
+
+# --- PERFIL DE SQL POR REQUISIÇÃO ---
+# A middleware abre um perfil e o guarda num contextvar; as rotas síncronas rodam no threadpool
+# com uma cópia do contexto, então os cursores do pool enxergam o perfil da requisição certa.
+_perfil_atual = contextvars.ContextVar('masterfy_perfil_sql', default=None)
+
+
+class PerfilSQL:
+    __slots__ = ('consultas', 'registros')
+
+    def __init__(self):
+        self.consultas = 0
+        self.registros = []
+
+    def registrar(self, sql: str, tempo: float, linhas: int) -> list:
+        """
+        Cria o registro [sql, tempo, linhas, *contadores] do comando. O cursor soma nele o tempo
+        e as linhas dos fetch*; linhas lidas por iteração ficam nos contadores.
+        """
+        self.consultas += 1
+        registro = [sql, tempo, linhas]
+        if len(self.registros) < MAX_CONSULTAS_POR_PERFIL:
+            self.registros.append(registro)
+        return registro
+
+    def finalizar(self, rota: str):
+        tempo_total = 0.0
+        linhas_total = 0
+        for sql, tempo, linhas, *contadores in self.registros:
+            for contador in contadores:
+                linhas += next(contador)
+            tempo_total += tempo
+            linhas_total += linhas
+            sql_duracao.observar(tempo, _operacao(sql))
+            if LIMITE_CONSULTA_LENTA and tempo >= LIMITE_CONSULTA_LENTA:
+                print(f"🐢 Consulta lenta ({tempo * 1000:.1f} ms, {linhas} linha(s)) em {rota}: {' '.join(sql.split())[:500]}")
+        sql_consultas.incrementar(self.consultas, rota)
+        sql_linhas.incrementar(linhas_total, rota)
+        sql_segundos.incrementar(tempo_total, rota)
+
+
+def _operacao(sql: str) -> str:
+    palavra = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    return palavra if palavra in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'PRAGMA') else 'OUTRO'
+
+
+class CursorInstrumentado(sqlite3.Cursor):
+    """
+    Cursor que mede o tempo e as linhas de cada comando quando há um perfil ativo.
+    Sem perfil (scripts, jobs), o custo é uma leitura de contextvar por execute.
+    O tempo cobre o execute e os fetch*; ao iterar o cursor, só o execute (que já inclui
+    ordenações e agregações) entra no tempo, para não pagar um relógio por linha.
+    """
+    _registro = None
+
+    def execute(self, sql, parametros=()):
+        perfil = _perfil_atual.get()
+        if perfil is None:
+            self._registro = None
+            return super().execute(sql, parametros)
+        inicio = time.perf_counter()
+        super().execute(sql, parametros)
+        # rowcount só vale para INSERT/UPDATE/DELETE; nos SELECTs as linhas são contadas na leitura
+        self._registro = perfil.registrar(sql, time.perf_counter() - inicio, max(self.rowcount, 0))
+        return self
+
+    def executemany(self, sql, sequencia):
+        perfil = _perfil_atual.get()
+        if perfil is None:
+            self._registro = None
+            return super().executemany(sql, sequencia)
+        inicio = time.perf_counter()
+        super().executemany(sql, sequencia)
+        self._registro = perfil.registrar(sql, time.perf_counter() - inicio, max(self.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        registro = self._registro
+        if registro is None:
+            return super().fetchone()
+        inicio = time.perf_counter()
+        linha = super().fetchone()
+        registro[1] += time.perf_counter() - inicio
+        registro[2] += linha is not None
+        return linha
+
+    def fetchmany(self, size=None):
+        registro = self._registro
+        if registro is None:
+            return super().fetchmany(size or self.arraysize)
+        inicio = time.perf_counter()
+        linhas = super().fetchmany(size or self.arraysize)
+        registro[1] += time.perf_counter() - inicio
+        registro[2] += len(linhas)
+        return linhas
+
+    def fetchall(self):
+        registro = self._registro
+        if registro is None:
+            return super().fetchall()
+        inicio = time.perf_counter()
+        linhas = super().fetchall()
+        registro[1] += time.perf_counter() - inicio
+        registro[2] += len(linhas)
+        return linhas
+
+    def __iter__(self):
+        registro = self._registro
+        if registro is None:
+            return self
+        # Iteração (for, np.fromiter) conta as linhas só com objetos em C: um __next__ em Python
+        # custaria mais que a própria leitura. O contador é lido no fim da requisição.
+        contador = itertools.count()
+        registro.append(contador)
+        return map(itemgetter(0), zip(iter(super().__next__, None), contador))
+
+
+class ConexaoInstrumentada(sqlite3.Connection):
+    """Conexão do pool: db.execute() e db.cursor() passam a devolver CursorInstrumentado."""
+
+    def cursor(self, factory=CursorInstrumentado):
+        return super().cursor(factory)
+
+    # O execute da Connection em C cria um Cursor comum, sem passar por self.cursor()
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, sequencia):
+        return self.cursor().executemany(sql, sequencia)
+
+
+# --- MIDDLEWARE HTTP ---
+class MiddlewareMetricas:
+    """Middleware ASGI: mede a latência por rota (o molde do caminho, ex. /ativo/{ativo_id}) e o SQL de cada requisição."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def enviar(mensagem):
+            if mensagem['type'] == 'http.response.start':
+                status[0] = mensagem['status']
+            await send(mensagem)
+
+        perfil = PerfilSQL()
+        token = _perfil_atual.set(perfil)
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracao = time.perf_counter() - inicio
+            _perfil_atual.reset(token)
+            # Caminhos que não casaram com nenhuma rota viram um rótulo só, para não explodir as séries
+            rota = scope.get('route')
+            caminho = rota.path if rota is not None else 'desconhecida'
+            http_duracao.observar(duracao, scope['method'], caminho)
+            http_requisicoes.incrementar(1, scope['method'], caminho, status[0])
+            perfil.finalizar(caminho)
+
+
+# --- JOBS DO APSCHEDULER ---
+def instrumentar_agendador(agendador):
+    """Registra listeners que medem duração e resultado de cada job (use ids fixos no add_job)."""
+    from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
+
+    def ouvir(evento):
+        agora = time.time()
+        if evento.code == EVENT_JOB_SUBMITTED:
+            with _trava_jobs:
+                _inicio_job[evento.job_id] = agora
+            return
+        if evento.code == EVENT_JOB_MISSED:
+            job_execucoes.incrementar(1, evento.job_id, 'perdido')
+            return
+
+        with _trava_jobs:
+            inicio = _inicio_job.pop(evento.job_id, None)
+            _ultima_execucao_job[evento.job_id] = agora
+        resultado = 'erro' if evento.code == EVENT_JOB_ERROR else 'sucesso'
+        job_execucoes.incrementar(1, evento.job_id, resultado)
+        if inicio is not None:
+            job_duracao.observar(agora - inicio, evento.job_id)
+
+    agendador.add_listener(ouvir, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+
+# --- EXPORTAÇÃO ---
+def exportar(pools: dict = None, cache: dict = None, backup: dict = None, cotacoes: dict = None) -> str:
+    """Texto no formato de exposição do Prometheus (text/plain; version=0.0.4)."""
+    linhas = []
+    for metrica in (http_duracao, http_requisicoes, sql_duracao, sql_consultas, sql_linhas, sql_segundos,
+                    job_duracao, job_execucoes):
+        linhas.extend(metrica.exportar())
+
+    with _trava_jobs:
+        ultimas = dict(_ultima_execucao_job)
+    linhas.extend(_medidor('masterfy_job_ultima_execucao_timestamp',
+                           "Momento (epoch) da última execução de cada job", ultimas, 'job'))
+
+    # Uma métrica por campo, com uma série por pool (escrita/leitura)
+    campos = {}
+    for nome, valores in (pools or {}).items():
+        for campo, valor in valores.items():
+            campos.setdefault(campo, {})[nome] = valor
+    for campo, por_pool in campos.items():
+        linhas.extend(_medidor(f'masterfy_pool_{campo}', f"Pool de conexões: {campo}", por_pool, 'pool'))
+    if cache:
+        for campo, valor in cache.items():
+            linhas.extend(_medidor(f'masterfy_cache_{campo}', f"Cache das telas: {campo}", {None: valor}))
+    for campo, valor in (cotacoes or {}).items():
+        linhas.extend(_medidor(f'masterfy_cotacoes_{campo}', f"Cache de cotações: {campo}", {None: valor}))
+    if backup:
+        linhas.extend(_medidor('masterfy_backup_fase_segundos', "Duração de cada fase do último backup",
+                               backup, 'fase'))
+    return '\n'.join(linhas) + '\n'
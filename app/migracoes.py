@@ -0,0 +1,413 @@
+import os
+import sqlite3
+import sys
+import time
+
+from app.database import DB_PATH, conexao
+from app.services.portfolio_engine import preencher_posicoes
+
+# --- MIGRAÇÕES DO ESQUEMA ---
+# Cada migração roda uma única vez, em ordem, e a versão aplicada fica no próprio arquivo
+# (PRAGMA user_version). Com o banco em dia, subir a aplicação custa uma leitura de cabeçalho.
+# Migrações já publicadas não mudam: alteração nova no esquema é sempre uma migração nova no fim da lista.
+# As primeiras usam IF NOT EXISTS / conferem colunas porque bancos antigos (versão 0) já podem
+# ter parte do esquema, criado pelo antigo iniciar_banco + aplicar_patch_banco.
+
+# Data gravada como AAAA-MM-DD (ordena como texto e é o que date() devolve); aceita também DD/MM/AAAA
+# e datas com horário, que viram só o dia. Nas restrições, date(data, '+0 days') normaliza dias
+# inexistentes (2024-02-30 vira 2024-03-01), então só uma data de calendário válida é igual a si mesma
+def _data_iso(coluna: str) -> str:
+    return f"""CASE
+        WHEN {coluna} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*' THEN substr({coluna}, 1, 10)
+        WHEN {coluna} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*'
+            THEN substr({coluna}, 7, 4) || '-' || substr({coluna}, 4, 2) || '-' || substr({coluna}, 1, 2)
+        ELSE {coluna} END"""
+
+
+def _colunas(db, tabela: str) -> set:
+    return {linha[1] for linha in db.execute(f"PRAGMA table_info({tabela})")}
+
+
+def _m1_esquema_inicial(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS ativos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticker TEXT NOT NULL UNIQUE,
+            nome TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            indexador TEXT
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS transacoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ativo_id INTEGER NOT NULL,
+            data DATE NOT NULL,
+            tipo_transacao TEXT NOT NULL,
+            quantidade REAL NOT NULL,
+            preco_unitario REAL NOT NULL,
+            taxas REAL DEFAULT 0.0,
+            FOREIGN KEY (ativo_id) REFERENCES ativos (id)
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS historico_precos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ativo_id INTEGER NOT NULL,
+            data DATE NOT NULL,
+            preco REAL NOT NULL,
+            UNIQUE(ativo_id, data),
+            FOREIGN KEY (ativo_id) REFERENCES ativos (id)
+        )
+    """)
+
+
+def _m2_setor_preco_proventos(db):
+    colunas = _colunas(db, 'ativos')
+    if 'setor' not in colunas:
+        db.execute("ALTER TABLE ativos ADD COLUMN setor TEXT DEFAULT 'Outros'")
+    # Preço de fechamento gravado pelo job de atualização
+    if 'preco_atual' not in colunas:
+        db.execute("ALTER TABLE ativos ADD COLUMN preco_atual REAL DEFAULT 0.0")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS proventos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ativo_id INTEGER,
+            data TEXT,
+            tipo TEXT,
+            valor REAL,
+            FOREIGN KEY(ativo_id) REFERENCES ativos(id)
+        )
+    """)
+
+
+def _m3_indices_por_ativo(db):
+    # Cobertura para as séries históricas por intervalo (não toca na tabela)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_historico_ativo_data_preco ON historico_precos (ativo_id, data, preco)")
+    # Extrato paginado e reprocessamento de posições por ativo, em ordem de data
+    db.execute("CREATE INDEX IF NOT EXISTS idx_transacoes_ativo_data ON transacoes (ativo_id, data)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_proventos_ativo_data ON proventos (ativo_id, data)")
+
+
+def _m4_jobs_e_meta(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS jobs_travas (
+            job TEXT PRIMARY KEY,
+            dono TEXT NOT NULL,
+            expira_em REAL NOT NULL
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS jobs_execucoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            origem TEXT NOT NULL,
+            status TEXT NOT NULL,
+            dono TEXT,
+            solicitado_em TEXT NOT NULL,
+            inicio TEXT,
+            fim TEXT,
+            duracao REAL,
+            detalhe TEXT
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_execucoes_job ON jobs_execucoes (job, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_execucoes_status ON jobs_execucoes (status, id)")
+    # Versão dos dados compartilhada entre processos (ver app.database.ler_versao_dados)
+    db.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor INTEGER NOT NULL)")
+
+
+def _m5_posicoes_e_apuracao(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS posicoes (
+            ativo_id INTEGER PRIMARY KEY,
+            quantidade REAL NOT NULL DEFAULT 0.0,
+            valor_investido REAL NOT NULL DEFAULT 0.0,
+            preco_medio REAL NOT NULL DEFAULT 0.0,
+            FOREIGN KEY (ativo_id) REFERENCES ativos (id)
+        )
+    """)
+    # Um registro por ativo e mês com negociação: posição no fim do mês e resultado realizado nas vendas
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS apuracao_mensal (
+            ativo_id INTEGER NOT NULL,
+            mes TEXT NOT NULL,
+            quantidade REAL NOT NULL,
+            custo REAL NOT NULL,
+            vendas REAL NOT NULL DEFAULT 0.0,
+            custo_vendas REAL NOT NULL DEFAULT 0.0,
+            taxas_vendas REAL NOT NULL DEFAULT 0.0,
+            resultado REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (ativo_id, mes)
+        ) WITHOUT ROWID
+    """)
+    # O conteúdo é (re)calculado na migração 6, depois de normalizar as datas
+
+
+def _recriar_tabela(db, tabela: str, criar: str, colunas: str, valores: str, valida: str):
+    """
+    Troca a tabela por uma nova com restrições (o SQLite não adiciona CHECK em tabela existente).
+    Linhas que não passariam nas restrições vão para '<tabela>_invalidas' para revisão manual.
+    """
+    db.execute(f"UPDATE {tabela} SET {valores}")
+    db.execute(f"CREATE TABLE IF NOT EXISTS {tabela}_invalidas AS SELECT * FROM {tabela} WHERE 0")
+    invalidas = db.execute(f"INSERT INTO {tabela}_invalidas SELECT * FROM {tabela} WHERE NOT ({valida})").rowcount
+    db.execute(criar.format(tabela=f"{tabela}_nova"))
+    db.execute(f"INSERT INTO {tabela}_nova ({colunas}) SELECT {colunas} FROM {tabela} WHERE {valida}")
+    db.execute(f"DROP TABLE {tabela}")
+    db.execute(f"ALTER TABLE {tabela}_nova RENAME TO {tabela}")
+    if invalidas:
+        print(f"⚠️ {invalidas} linha(s) de {tabela} fora do formato foram movidas para {tabela}_invalidas.")
+    else:
+        db.execute(f"DROP TABLE {tabela}_invalidas")
+
+
+def _m6_restricoes_e_datas(db):
+    _recriar_tabela(
+        db, 'transacoes',
+        criar="""
+            CREATE TABLE {tabela} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ativo_id INTEGER NOT NULL,
+                data TEXT NOT NULL CHECK (date(data, '+0 days') IS data),
+                tipo_transacao TEXT NOT NULL CHECK (tipo_transacao IN ('COMPRA', 'VENDA')),
+                quantidade REAL NOT NULL,
+                preco_unitario REAL NOT NULL,
+                taxas REAL NOT NULL DEFAULT 0.0,
+                FOREIGN KEY (ativo_id) REFERENCES ativos (id)
+            )
+        """,
+        colunas="id, ativo_id, data, tipo_transacao, quantidade, preco_unitario, taxas",
+        valores=f"data = {_data_iso('data')}, tipo_transacao = UPPER(TRIM(tipo_transacao)), "
+                "taxas = COALESCE(taxas, 0.0)",
+        valida="date(data, '+0 days') IS data AND tipo_transacao IN ('COMPRA', 'VENDA')",
+    )
+    _recriar_tabela(
+        db, 'proventos',
+        criar="""
+            CREATE TABLE {tabela} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ativo_id INTEGER NOT NULL,
+                data TEXT NOT NULL CHECK (date(data, '+0 days') IS data),
+                tipo TEXT,
+                valor REAL NOT NULL,
+                FOREIGN KEY (ativo_id) REFERENCES ativos (id)
+            )
+        """,
+        colunas="id, ativo_id, data, tipo, valor",
+        valores=f"data = {_data_iso('data')}",
+        valida="ativo_id IS NOT NULL AND valor IS NOT NULL AND date(data, '+0 days') IS data",
+    )
+    # Os índices somem junto com a tabela antiga
+    db.execute("CREATE INDEX idx_transacoes_ativo_data ON transacoes (ativo_id, data)")
+    db.execute("CREATE INDEX idx_proventos_ativo_data ON proventos (ativo_id, data)")
+    # Datas e tipos normalizados podem mudar meses e preços médios
+    preencher_posicoes(db)
+
+
+def _m7_indices_por_data(db):
+    # Consultas da carteira inteira a partir de uma data (performance, proventos do período)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_historico_data ON historico_precos (data, ativo_id, preco)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_proventos_data ON proventos (data, valor)")
+
+
+def _m8_carteiras(db):
+    # Várias carteiras (famílias, clientes) no mesmo banco; a 1 recebe tudo o que já existia
+    db.execute("""
+        CREATE TABLE carteiras (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL UNIQUE,
+            criada_em TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+    """)
+    db.execute("INSERT INTO carteiras (id, nome) VALUES (1, 'principal')")
+
+    # O ticker passa a ser único dentro da carteira, não no banco inteiro
+    db.execute("""
+        CREATE TABLE ativos_nova (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            carteira_id INTEGER NOT NULL DEFAULT 1,
+            ticker TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            indexador TEXT,
+            setor TEXT DEFAULT 'Outros',
+            preco_atual REAL DEFAULT 0.0,
+            UNIQUE (carteira_id, ticker),
+            FOREIGN KEY (carteira_id) REFERENCES carteiras (id)
+        )
+    """)
+    db.execute("""
+        INSERT INTO ativos_nova (id, ticker, nome, tipo, indexador, setor, preco_atual)
+        SELECT id, ticker, nome, tipo, indexador, setor, preco_atual FROM ativos
+    """)
+    db.execute("DROP TABLE ativos")
+    db.execute("ALTER TABLE ativos_nova RENAME TO ativos")
+
+    # Transações e proventos levam a carteira junto (igual à do ativo) para as consultas da
+    # carteira inteira não precisarem passar pelos ativos
+    for tabela in ('transacoes', 'proventos'):
+        db.execute(f"ALTER TABLE {tabela} ADD COLUMN carteira_id INTEGER NOT NULL DEFAULT 1 REFERENCES carteiras (id)")
+    db.execute("CREATE INDEX idx_transacoes_carteira ON transacoes (carteira_id, ativo_id, data)")
+    # Os índices por data da migração 7 misturavam as carteiras: passam a começar pela carteira
+    db.execute("DROP INDEX IF EXISTS idx_proventos_data")
+    db.execute("CREATE INDEX idx_proventos_carteira_data ON proventos (carteira_id, data, valor)")
+    # Histórico de preços é por ativo (que já é de uma carteira): lido pelo índice (ativo_id, data, preco)
+    db.execute("DROP INDEX IF EXISTS idx_historico_data")
+
+
+def _m9_proventos_anunciados(db):
+    # Proventos anunciados pelas empresas (valor por cota, vindos do provedor de preços): dados de
+    # mercado por ticker, usados no dividend yield, no yield on cost e na projeção de renda
+    db.execute("""
+        CREATE TABLE proventos_anunciados (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticker TEXT NOT NULL,
+            data_ex TEXT NOT NULL CHECK (date(data_ex, '+0 days') IS data_ex),
+            data_pagamento TEXT CHECK (data_pagamento IS NULL OR date(data_pagamento, '+0 days') IS data_pagamento),
+            tipo TEXT NOT NULL,
+            valor_por_cota REAL NOT NULL,
+            atualizado_em TEXT NOT NULL DEFAULT (datetime('now')),
+            UNIQUE (ticker, data_ex, tipo)
+        )
+    """)
+    # Proventos lançados a partir de um anúncio guardam a origem: o mesmo anúncio nunca entra duas vezes
+    db.execute("ALTER TABLE proventos ADD COLUMN anuncio_id INTEGER REFERENCES proventos_anunciados (id)")
+    db.execute("""
+        CREATE UNIQUE INDEX idx_proventos_anuncio ON proventos (ativo_id, anuncio_id) WHERE anuncio_id IS NOT NULL
+    """)
+    # As análises de renda agrupam por mês, ativo e tipo: o índice da carteira passa a cobri-las
+    db.execute("DROP INDEX IF EXISTS idx_proventos_carteira_data")
+    db.execute("CREATE INDEX idx_proventos_carteira_data ON proventos (carteira_id, data, ativo_id, tipo, valor)")
+
+
+def _m10_metas_alocacao(db):
+    # Percentual alvo da carteira por ativo (ticker), setor ou tipo, usado no rebalanceamento
+    db.execute("""
+        CREATE TABLE metas_alocacao (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            carteira_id INTEGER NOT NULL DEFAULT 1,
+            nivel TEXT NOT NULL CHECK (nivel IN ('ativo', 'setor', 'tipo')),
+            chave TEXT NOT NULL,
+            percentual REAL NOT NULL CHECK (percentual > 0 AND percentual <= 100),
+            UNIQUE (carteira_id, nivel, chave),
+            FOREIGN KEY (carteira_id) REFERENCES carteiras (id)
+        )
+    """)
+
+
+def _m11_alteracoes_colunares(db):
+    # Ids editados ou removidos nas tabelas exportadas (ver colunar_engine): a exportação só relê os
+    # segmentos que têm algum deles. Só contam ids até a marca d'água da exportação (meta
+    # 'colunar.<tabela>'): linhas acima dela ainda vão ser exportadas, e sem exportação nada é anotado.
+    # Migrações que recriarem estas tabelas precisam recriar os gatilhos.
+    db.execute("""
+        CREATE TABLE colunar_alteracoes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabela TEXT NOT NULL,
+            linha_id INTEGER NOT NULL
+        )
+    """)
+    for tabela in ('transacoes', 'proventos', 'historico_precos'):
+        for evento in ('UPDATE', 'DELETE'):
+            db.execute(f"""
+                CREATE TRIGGER colunar_{tabela}_{evento.lower()} AFTER {evento} ON {tabela}
+                WHEN OLD.id <= (SELECT valor FROM meta WHERE chave = 'colunar.{tabela}')
+                BEGIN
+                    INSERT INTO colunar_alteracoes (tabela, linha_id) VALUES ('{tabela}', OLD.id);
+                END
+            """)
+
+
+MIGRACOES = (
+    (1, "esquema inicial (ativos, transações, histórico de preços)", _m1_esquema_inicial),
+    (2, "setor e preço atual dos ativos, tabela de proventos", _m2_setor_preco_proventos),
+    (3, "índices por ativo e data", _m3_indices_por_ativo),
+    (4, "tabelas dos jobs e versão dos dados", _m4_jobs_e_meta),
+    (5, "posições materializadas e apuração mensal", _m5_posicoes_e_apuracao),
+    (6, "CHECK em tipo_transacao e datas ISO em transações e proventos", _m6_restricoes_e_datas),
+    (7, "índices por data para consultas da carteira inteira", _m7_indices_por_data),
+    (8, "várias carteiras: tabela carteiras e carteira_id em ativos, transações e proventos", _m8_carteiras),
+    (9, "proventos anunciados e índice de renda por carteira", _m9_proventos_anunciados),
+    (10, "metas de alocação por ativo, setor e tipo", _m10_metas_alocacao),
+    (11, "registro de linhas alteradas para a exportação colunar incremental", _m11_alteracoes_colunares),
+)
+VERSAO_ESQUEMA = MIGRACOES[-1][0]
+
+
+# Linhas examinadas por índice no ANALYZE (amostra suficiente para o planejador)
+LIMITE_ANALISE = 1000
+
+
+def versao_banco(db) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrar(db_path: str = None) -> int:
+    """
+    Aplica as migrações pendentes, cada uma na sua transação junto com a nova user_version.
+    Vários processos podem chamar ao mesmo tempo: BEGIN IMMEDIATE serializa e quem chega depois
+    encontra a versão já atualizada. Devolve quantas migrações este processo aplicou.
+    """
+    db_path = db_path or DB_PATH
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    # isolation_level=None: as transações são controladas aqui (o sqlite3 não abre nenhuma sozinho)
+    db = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    try:
+        if versao_banco(db) >= VERSAO_ESQUEMA:
+            return 0
+        # OTIMIZAÇÃO: O modo WAL fica gravado no arquivo, basta ativar uma vez
+        db.execute("PRAGMA journal_mode=WAL")
+
+        aplicadas = 0
+        for numero, descricao, aplicar in MIGRACOES:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if versao_banco(db) >= numero:
+                    db.execute("COMMIT")
+                    continue
+                aplicar(db)
+                db.execute(f"PRAGMA user_version = {numero}")
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            aplicadas += 1
+            print(f"🔧 Migração {numero} aplicada: {descricao}")
+
+        if aplicadas:
+            # Estatísticas novas para o planejador de consultas enxergar os índices criados
+            db.execute(f"PRAGMA analysis_limit={LIMITE_ANALISE}")
+            db.execute("ANALYZE")
+            print(f"✅ Banco de dados na versão {VERSAO_ESQUEMA} em: {db_path}")
+        return aplicadas
+    finally:
+        db.close()
+
+
+def otimizar_banco() -> str:
+    """
+    Job diário: atualiza as estatísticas do planejador conforme os dados crescem.
+    analysis_limit limita o ANALYZE a uma amostra por índice, então o custo não cresce com o banco.
+    """
+    inicio = time.perf_counter()
+    with conexao() as db:
+        db.execute(f"PRAGMA analysis_limit={LIMITE_ANALISE}")
+        db.execute("ANALYZE")
+        db.execute("PRAGMA optimize")
+    return f"ANALYZE em {time.perf_counter() - inicio:.2f}s"
+
+
+# Uso: python -m app.migracoes [--status]
+if __name__ == '__main__':
+    if '--status' in sys.argv:
+        if not os.path.exists(DB_PATH):
+            print(f"Banco ainda não criado em {DB_PATH}.")
+            sys.exit(0)
+        with sqlite3.connect(DB_PATH) as db:
+            versao = versao_banco(db)
+        for numero, descricao, _ in MIGRACOES:
+            print(f"{'✅' if numero <= versao else '⏳'} {numero}: {descricao}")
+    else:
+        if not migrar():
+            print(f"✅ Banco de dados já está na versão {VERSAO_ESQUEMA}.")
@@ -1,40 +1,338 @@
 import os
 import sqlite3
-from datetime import datetime
+import sys
+import gzip
 import glob
+import json
+import shutil
+import struct
+import hashlib
+import tempfile
+import time
+from datetime import datetime
 
-# Define os caminhos das pastas
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, '..', '..', 'data')
-DB_PATH = os.path.join(DATA_DIR, 'masterfy.db')
+from app import carteiras
+from app.database import DATA_DIR, DB_PATH, conexao
+
+# Define os caminhos das pastas. Cada banco tem a sua pasta, com cadeia de backups e retenção próprias:
+# o principal fica em data/backups/ e, no modo 'arquivo', cada carteira em data/backups/carteiras/<nome>/
 BACKUP_DIR = os.path.join(DATA_DIR, 'backups')
 
-def realizar_backup_diario():
-    """Cria uma cópia do banco de dados e mantém apenas os últimos 7 dias."""
-    # Cria a pasta de backups se ela não existir
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
-    
-    # Gera o nome do arquivo com a data e hora atual
-    data_atual = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_path = os.path.join(BACKUP_DIR, f'masterfy_backup_{data_atual}.db')
-    
+# Cópia online em passos: PAGINAS_POR_PASSO páginas por vez, com uma pausa entre os passos
+# para que as gravações da aplicação não fiquem bloqueadas durante a cópia inteira
+PAGINAS_POR_PASSO = 256
+PAUSA_ENTRE_PASSOS = 0.005
+
+# Um backup completo por semana (ou quando a cadeia fica longa); incrementais nos outros dias
+DIA_BACKUP_COMPLETO = 6          # domingo
+MAX_INCREMENTAIS_POR_CADEIA = 6
+PONTOS_DE_RESTAURACAO = 7        # mantém pelo menos os 7 backups mais recentes
+
+TAMANHO_DIGEST = 8
+REGISTRO_PAGINA = struct.Struct('>I')
+
+# Métricas do último backup realizado, por fase (em segundos)
+ultimas_metricas = {}
+
+
+def _agora() -> float:
+    return time.perf_counter()
+
+
+def criar_snapshot(destino: str, paginas: int = PAGINAS_POR_PASSO, pausa: float = PAUSA_ENTRE_PASSOS,
+                   conectar=conexao):
+    """
+    Cópia consistente do banco para `destino` usando a API de backup do SQLite em passos.
+    `conectar` abre a conexão de origem (padrão: banco principal; ou `Carteira.conexao` de outro arquivo).
+    """
+    dest = sqlite3.connect(destino)
     try:
-        # Copia o arquivo usando a API nativa do SQLite
-        source = sqlite3.connect(DB_PATH)
-        dest = sqlite3.connect(backup_path)
-        with source, dest:
-            source.backup(dest)
-        source.close()
+        with conectar() as source:
+            source.backup(dest, pages=paginas, sleep=pausa)
+        dest.execute("PRAGMA journal_mode=DELETE")  # O arquivo copiado não depende de -wal/-shm
+    finally:
         dest.close()
-        print(f"✅ Backup realizado: {backup_path}")
-        
-        # Limpa backups antigos (mantém apenas os 7 mais recentes)
-        backups = sorted(glob.glob(os.path.join(BACKUP_DIR, '*.db')))
-        if len(backups) > 7:
-            for b in backups[:-7]: # Pega todos exceto os 7 últimos
-                os.remove(b)
-                print(f"🗑️ Backup antigo removido: {b}")
-                
-    except Exception as e:
-        print(f"❌ Erro ao realizar backup: {e}")
+
+
+def _ler_paginas(caminho: str):
+    """Tamanho da página e digest curto de cada página do arquivo SQLite."""
+    with open(caminho, 'rb') as arquivo:
+        cabecalho = arquivo.read(100)
+        tamanho = struct.unpack('>H', cabecalho[16:18])[0]
+        tamanho = 65536 if tamanho == 1 else tamanho
+        arquivo.seek(0)
+        digests = bytearray()
+        sha = hashlib.sha256()
+        while True:
+            pagina = arquivo.read(tamanho)
+            if not pagina:
+                break
+            sha.update(pagina)
+            digests += hashlib.blake2b(pagina, digest_size=TAMANHO_DIGEST).digest()
+    return tamanho, bytes(digests), sha.hexdigest()
+
+
+def _sha256_arquivo(caminho: str) -> str:
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(1 << 20), b''):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def pasta_backup(db_path: str = None) -> str:
+    """data/backups para o banco principal, data/backups/carteiras/<nome> para os arquivos de carteira."""
+    if db_path is None or db_path == DB_PATH:
+        return BACKUP_DIR
+    return os.path.join(BACKUP_DIR, os.path.splitext(os.path.relpath(db_path, DATA_DIR))[0])
+
+
+def _manifestos(pasta: str) -> list:
+    """Todos os manifestos de backup da pasta, do mais antigo para o mais recente."""
+    manifestos = []
+    for caminho in glob.glob(os.path.join(pasta, '*.json')):
+        with open(caminho) as arquivo:
+            manifestos.append(json.load(arquivo))
+    return sorted(manifestos, key=lambda m: m['nome'])
+
+
+def _caminho(pasta: str, nome_arquivo: str) -> str:
+    return os.path.join(pasta, nome_arquivo)
+
+
+def _gravar_manifesto(pasta: str, manifesto: dict, digests: bytes):
+    with open(_caminho(pasta, manifesto['nome'] + '.dig'), 'wb') as arquivo:
+        arquivo.write(digests)
+    # O manifesto é gravado por último: backup sem manifesto é ignorado (ficou pela metade)
+    temporario = _caminho(pasta, manifesto['nome'] + '.json.tmp')
+    with open(temporario, 'w') as arquivo:
+        json.dump(manifesto, arquivo, indent=2)
+    os.replace(temporario, _caminho(pasta, manifesto['nome'] + '.json'))
+
+
+def realizar_backup(completo: bool = None, db_path: str = None) -> dict:
+    """
+    Gera um backup comprimido e com checksum do banco `db_path` (padrão: o principal). Incremental:
+    grava só as páginas que mudaram desde o backup anterior da cadeia. Retorna o manifesto (com as
+    métricas de cada fase).
+    """
+    db_path = db_path or DB_PATH
+    pasta = pasta_backup(db_path)
+    os.makedirs(pasta, exist_ok=True)
+    metricas = {}
+    inicio_total = _agora()
+    nome = f"{os.path.splitext(os.path.basename(db_path))[0]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+    anteriores = _manifestos(pasta)
+    anterior = anteriores[-1] if anteriores else None
+    if completo is None:
+        tamanho_cadeia = sum(1 for m in anteriores if anterior and m['cadeia'] == anterior['cadeia'])
+        completo = (
+            anterior is None
+            or datetime.now().weekday() == DIA_BACKUP_COMPLETO
+            or tamanho_cadeia > MAX_INCREMENTAIS_POR_CADEIA
+        )
+
+    with tempfile.TemporaryDirectory(dir=pasta) as pasta_tmp:
+        snapshot = os.path.join(pasta_tmp, 'snapshot.db')
+
+        inicio = _agora()
+        criar_snapshot(snapshot, conectar=lambda: carteiras.conexao_banco(db_path))
+        metricas['copia'] = _agora() - inicio
+
+        inicio = _agora()
+        tamanho_pagina, digests, sha256 = _ler_paginas(snapshot)
+        total_paginas = len(digests) // TAMANHO_DIGEST
+        metricas['checksum'] = _agora() - inicio
+
+        if not completo:
+            with open(_caminho(pasta, anterior['nome'] + '.dig'), 'rb') as arquivo:
+                digests_anteriores = arquivo.read()
+            if anterior['tamanho_pagina'] != tamanho_pagina:
+                completo = True  # Mudou o page_size (VACUUM): não dá para comparar página a página
+
+        inicio = _agora()
+        arquivo_backup = nome + ('.db.gz' if completo else '.pag.gz')
+        caminho_backup = _caminho(pasta, arquivo_backup)
+        if completo:
+            with open(snapshot, 'rb') as origem, gzip.open(caminho_backup, 'wb', compresslevel=6) as destino:
+                shutil.copyfileobj(origem, destino, 1 << 20)
+            alteradas = total_paginas
+        else:
+            alteradas = 0
+            with open(snapshot, 'rb') as origem, gzip.open(caminho_backup, 'wb', compresslevel=6) as destino:
+                for numero in range(total_paginas):
+                    fatia = slice(numero * TAMANHO_DIGEST, (numero + 1) * TAMANHO_DIGEST)
+                    if digests[fatia] != digests_anteriores[fatia]:
+                        origem.seek(numero * tamanho_pagina)
+                        destino.write(REGISTRO_PAGINA.pack(numero))
+                        destino.write(origem.read(tamanho_pagina))
+                        alteradas += 1
+        metricas['compressao'] = _agora() - inicio
+
+    manifesto = {
+        "nome": nome,
+        "tipo": "completo" if completo else "incremental",
+        "cadeia": nome if completo else anterior['cadeia'],
+        "base": None if completo else anterior['nome'],
+        "arquivo": arquivo_backup,
+        "criado_em": datetime.now().isoformat(timespec='seconds'),
+        "tamanho_pagina": tamanho_pagina,
+        "paginas": total_paginas,
+        "paginas_gravadas": alteradas,
+        "sha256_banco": sha256,
+        "sha256_arquivo": _sha256_arquivo(caminho_backup),
+        "bytes_banco": total_paginas * tamanho_pagina,
+        "bytes_arquivo": os.path.getsize(caminho_backup),
+    }
+    metricas['total'] = _agora() - inicio_total
+    manifesto["metricas"] = {fase: round(segundos, 4) for fase, segundos in metricas.items()}
+    _gravar_manifesto(pasta, manifesto, digests)
+
+    ultimas_metricas.clear()
+    ultimas_metricas.update(manifesto["metricas"])
+    return manifesto
+
+
+def limpar_backups_antigos(db_path: str = None):
+    """Apaga cadeias inteiras que não são necessárias para os últimos PONTOS_DE_RESTAURACAO backups do banco."""
+    pasta = pasta_backup(db_path)
+    manifestos = _manifestos(pasta)
+    if len(manifestos) <= PONTOS_DE_RESTAURACAO:
+        return
+    cadeias_necessarias = {m['cadeia'] for m in manifestos[-PONTOS_DE_RESTAURACAO:]}
+    for m in manifestos:
+        if m['cadeia'] not in cadeias_necessarias:
+            for sufixo in ('.json', '.dig'):
+                os.remove(_caminho(pasta, m['nome'] + sufixo))
+            os.remove(_caminho(pasta, m['arquivo']))
+            print(f"🗑️ Backup antigo removido: {m['nome']}")
+    # Backups do formato antigo (cópias .db inteiras)
+    for antigo in glob.glob(os.path.join(BACKUP_DIR, 'masterfy_backup_*.db')):
+        os.remove(antigo)
+
+
+def realizar_backup_diario():
+    """
+    Backup agendado de cada banco (um só no modo compartilhado, um por carteira no modo 'arquivo'):
+    completo aos domingos, incremental nos outros dias; mantém 7 pontos de restauração por banco.
+    Um banco com erro não impede o backup dos outros, mas o erro sobe no fim: a execução do job
+    fica registrada como 'erro' (e conta nas métricas) em vez de 'sucesso'.
+    """
+    falhas = []
+    for db_path in carteiras.bancos():
+        try:
+            manifesto = realizar_backup(db_path=db_path)
+            print(f"✅ Backup {manifesto['tipo']} realizado: {manifesto['arquivo']} "
+                  f"({manifesto['paginas_gravadas']}/{manifesto['paginas']} páginas, {manifesto['bytes_arquivo']} bytes, "
+                  f"{manifesto['metricas']['total']:.2f}s)")
+            limpar_backups_antigos(db_path)
+        except Exception as e:
+            print(f"❌ Erro ao realizar backup de {os.path.basename(db_path)}: {e}")
+            falhas.append(e)
+    if len(falhas) == 1:
+        raise falhas[0]
+    if falhas:
+        raise RuntimeError(f"{len(falhas)} backups falharam: " + "; ".join(f"{type(e).__name__}: {e}" for e in falhas))
+
+
+def restaurar_backup(nome: str, destino: str, db_path: str = None) -> dict:
+    """
+    Reconstrói o backup `nome` do banco `db_path` (completo + incrementais da cadeia) em `destino`,
+    conferindo o checksum de cada arquivo, o sha256 final e o integrity_check do SQLite.
+    """
+    pasta = pasta_backup(db_path)
+    metricas = {}
+    inicio_total = _agora()
+    manifestos = {m['nome']: m for m in _manifestos(pasta)}
+    if nome not in manifestos:
+        raise ValueError(f"Backup não encontrado: {nome}")
+
+    # Monta a cadeia do completo até o backup pedido
+    cadeia = []
+    atual = manifestos[nome]
+    while atual:
+        cadeia.append(atual)
+        atual = manifestos.get(atual['base']) if atual['base'] else None
+    cadeia.reverse()
+    if cadeia[0]['tipo'] != 'completo':
+        raise ValueError(f"Cadeia de {nome} está incompleta: falta o backup completo.")
+
+    inicio = _agora()
+    for m in cadeia:
+        if _sha256_arquivo(_caminho(pasta, m['arquivo'])) != m['sha256_arquivo']:
+            raise ValueError(f"Checksum inválido no arquivo {m['arquivo']}.")
+    metricas['verificacao_arquivos'] = _agora() - inicio
+
+    os.makedirs(os.path.dirname(os.path.abspath(destino)), exist_ok=True)
+    temporario = destino + '.restaurando'
+    inicio = _agora()
+    with gzip.open(_caminho(pasta, cadeia[0]['arquivo']), 'rb') as origem, open(temporario, 'wb') as saida:
+        shutil.copyfileobj(origem, saida, 1 << 20)
+
+    with open(temporario, 'r+b') as saida:
+        for m in cadeia[1:]:
+            tamanho = m['tamanho_pagina']
+            with gzip.open(_caminho(pasta, m['arquivo']), 'rb') as origem:
+                while True:
+                    registro = origem.read(REGISTRO_PAGINA.size)
+                    if not registro:
+                        break
+                    (numero,) = REGISTRO_PAGINA.unpack(registro)
+                    saida.seek(numero * tamanho)
+                    saida.write(origem.read(tamanho))
+            saida.truncate(m['paginas'] * tamanho)
+    metricas['reconstrucao'] = _agora() - inicio
+
+    inicio = _agora()
+    if _sha256_arquivo(temporario) != manifestos[nome]['sha256_banco']:
+        os.remove(temporario)
+        raise ValueError("O banco reconstruído não confere com o checksum do backup.")
+    teste = sqlite3.connect(temporario)
+    resultado = teste.execute("PRAGMA integrity_check").fetchone()[0]
+    teste.close()
+    if resultado != 'ok':
+        os.remove(temporario)
+        raise ValueError(f"integrity_check falhou: {resultado}")
+    metricas['verificacao_banco'] = _agora() - inicio
+
+    # Remove -wal/-shm antigos do destino para o SQLite não reaplicar páginas de outro banco
+    for sufixo in ('-wal', '-shm'):
+        if os.path.exists(destino + sufixo):
+            os.remove(destino + sufixo)
+    os.replace(temporario, destino)
+    metricas['total'] = _agora() - inicio_total
+    return {fase: round(segundos, 4) for fase, segundos in metricas.items()}
+
+
+def listar_backups(db_path: str = None) -> list:
+    return [
+        {chave: m[chave] for chave in ('nome', 'tipo', 'cadeia', 'criado_em', 'paginas_gravadas', 'bytes_arquivo', 'metricas')}
+        for m in _manifestos(pasta_backup(db_path))
+    ]
+
+
+# Uso: python -m app.services.backup_engine [completo|incremental|listar|restaurar NOME [--destino ARQUIVO]] [--carteira NOME]
+if __name__ == '__main__':
+    comando = sys.argv[1] if len(sys.argv) > 1 else 'auto'
+    # listar e restaurar atuam no banco de uma carteira (padrão: o principal); o backup cobre todos os bancos
+    db_path = carteiras.obter_carteira(sys.argv[sys.argv.index('--carteira') + 1]).db_path \
+        if '--carteira' in sys.argv else DB_PATH
+    if comando == 'listar':
+        for b in listar_backups(db_path):
+            print(f"{b['nome']}  {b['tipo']:<11}  {b['bytes_arquivo']:>12} bytes  ({b['paginas_gravadas']} páginas)")
+    elif comando == 'restaurar':
+        if len(sys.argv) < 3:
+            print("Uso: python -m app.services.backup_engine restaurar NOME [--destino ARQUIVO] [--carteira NOME]")
+            sys.exit(2)
+        # Por segurança, o padrão é restaurar ao lado do banco; use --destino para substituir (com o app parado)
+        destino = sys.argv[sys.argv.index('--destino') + 1] if '--destino' in sys.argv \
+            else os.path.join(DATA_DIR, f"{os.path.splitext(os.path.basename(db_path))[0]}_restaurado.db")
+        metricas = restaurar_backup(sys.argv[2], destino, db_path)
+        print(f"✅ Backup {sys.argv[2]} restaurado e verificado em {destino} ({metricas})")
+    else:
+        completo = {'completo': True, 'incremental': False}.get(comando)
+        for banco in carteiras.bancos():
+            manifesto = realizar_backup(completo=completo, db_path=banco)
+            print(f"✅ Backup {manifesto['tipo']}: {manifesto['arquivo']} {manifesto['metricas']}")
+            limpar_backups_antigos(banco)
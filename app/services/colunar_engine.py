@@ -0,0 +1,347 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from app import carteiras
+from app.database import DATA_DIR, DB_PATH
+
+# --- EXPORTAÇÃO COLUNAR (relatórios pesados fora do banco da aplicação) ---
+# Cada banco (o principal e, no modo 'arquivo', um por carteira) ganha uma pasta em data/colunar/
+# com arquivos .npy por tabela e um manifesto.json. Os relatórios abrem os .npy com mmap: nada é
+# copiado para a memória nem passa pelo SQLite.
+#
+# A exportação é incremental. Cada tabela é uma lista de segmentos, cada um cobrindo uma faixa de
+# ids: linhas novas (acima da marca d'água) viram um segmento novo. Edições e remoções de linhas já
+# exportadas são anotadas por gatilhos em colunar_alteracoes (migração 11), e só os segmentos com
+# algum id anotado são relidos; um deles só é regravado se a assinatura (hash dos bytes exportados,
+# então cobre todas as colunas) mudou. Nada do que não mudou é lido de novo.
+# Os arquivos de segmento nunca são alterados depois de escritos; o manifesto é trocado por último.
+COLUNAR_DIR = os.path.join(DATA_DIR, 'colunar')
+FORMATO = 3  # 3: alterações anotadas por gatilhos (manifestos anteriores são exportados de novo)
+
+# Uma edição antiga regrava o segmento inteiro: segmentos têm no máximo LINHAS_POR_SEGMENTO linhas.
+# Acima de LIMITE_SEGMENTOS os segmentos pequenos vizinhos são juntados (menos arquivos por leitura).
+LINHAS_POR_SEGMENTO = 1 << 20
+LIMITE_SEGMENTOS = 16
+
+# As datas saem do SQLite como dias desde 1970-01-01, prontas para virar datetime64[D]
+SQL_DIA = "CAST(julianday({}) - 2440587.5 AS INTEGER)"
+
+TABELAS = {
+    'transacoes': {
+        'dtype': np.dtype([
+            ('id', 'i8'), ('carteira_id', 'i8'), ('ativo_id', 'i8'), ('data', 'i8'), ('sinal', 'i1'),
+            ('quantidade', 'f8'), ('preco', 'f8'), ('taxas', 'f8')
+        ]),
+        'colunas': f"""id, carteira_id, ativo_id, {SQL_DIA.format('data')},
+                       CASE tipo_transacao WHEN 'COMPRA' THEN 1 WHEN 'VENDA' THEN -1 ELSE 0 END,
+                       quantidade, preco_unitario, taxas""",
+    },
+    'proventos': {
+        'dtype': np.dtype([
+            ('id', 'i8'), ('carteira_id', 'i8'), ('ativo_id', 'i8'), ('data', 'i8'), ('tipo', 'U16'), ('valor', 'f8')
+        ]),
+        'colunas': f"id, carteira_id, ativo_id, {SQL_DIA.format('data')}, COALESCE(tipo, ''), valor",
+    },
+    'historico_precos': {
+        'dtype': np.dtype([('id', 'i8'), ('ativo_id', 'i8'), ('data', 'i8'), ('preco', 'f8')]),
+        'colunas': f"id, ativo_id, {SQL_DIA.format('data')}, preco",
+    },
+}
+
+# Posições são uma linha por ativo: regravadas inteiras a cada exportação
+DTYPE_POSICOES = np.dtype([
+    ('ativo_id', 'i8'), ('carteira_id', 'i8'), ('ticker', 'U12'), ('quantidade', 'f8'),
+    ('valor_investido', 'f8'), ('preco_medio', 'f8'), ('preco_atual', 'f8')
+])
+SQL_POSICOES = """
+    SELECT p.ativo_id, a.carteira_id, a.ticker, p.quantidade, p.valor_investido, p.preco_medio,
+           COALESCE(a.preco_atual, 0.0)
+    FROM posicoes p
+    JOIN ativos a ON a.id = p.ativo_id
+    ORDER BY p.ativo_id
+"""
+
+DTYPES = {**{tabela: definicao['dtype'] for tabela, definicao in TABELAS.items()}, 'posicoes': DTYPE_POSICOES}
+
+
+def pasta_exportacao(db_path: str = None) -> str:
+    """data/colunar/masterfy para o banco principal, data/colunar/carteiras/<nome> para os arquivos de carteira."""
+    relativo = os.path.relpath(db_path or DB_PATH, DATA_DIR)
+    return os.path.join(COLUNAR_DIR, os.path.splitext(relativo)[0])
+
+
+def _ler(db: sqlite3.Connection, sql: str, dtype: np.dtype, parametros=()):
+    """Lê o resultado da consulta direto para um array estruturado, sem criar dicts por linha."""
+    cursor = db.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, parametros)
+    return np.fromiter(cursor, dtype=dtype)
+
+
+def _assinatura(dados: np.ndarray) -> str:
+    """Hash das linhas como são gravadas no segmento: qualquer coluna exportada que mude muda a assinatura."""
+    return hashlib.blake2b(np.ascontiguousarray(dados).view(np.uint8), digest_size=16).hexdigest()
+
+
+def _ler_faixa(db: sqlite3.Connection, tabela: str, de_id: int, ate_id: int):
+    definicao = TABELAS[tabela]
+    sql = f"SELECT {definicao['colunas']} FROM {tabela} WHERE id BETWEEN ? AND ? ORDER BY id"
+    return _ler(db, sql, definicao['dtype'], (de_id, ate_id))
+
+
+def _gravar_segmento(pasta: str, manifesto: dict, tabela: str, dados: np.ndarray) -> str:
+    """Grava o array em um arquivo novo (nome nunca reaproveitado) e devolve o nome."""
+    manifesto['proximo_segmento'] += 1
+    arquivo = f"{tabela}.{manifesto['proximo_segmento']:06d}.npy"
+    temporario = os.path.join(pasta, arquivo + '.tmp')
+    with open(temporario, 'wb') as saida:
+        np.save(saida, dados)
+    os.replace(temporario, os.path.join(pasta, arquivo))
+    return arquivo
+
+
+def _novo_segmento(pasta: str, manifesto: dict, tabela: str, dados: np.ndarray,
+                   de_id: int, ate_id: int = None) -> dict:
+    ate_id = int(dados['id'][-1]) if ate_id is None else ate_id
+    return {
+        'arquivo': _gravar_segmento(pasta, manifesto, tabela, dados), 'de_id': de_id, 'ate_id': ate_id,
+        'linhas': int(dados.size), 'assinatura': _assinatura(dados),
+    }
+
+
+def _carregar_manifesto(pasta: str) -> dict:
+    caminho = os.path.join(pasta, 'manifesto.json')
+    if os.path.exists(caminho):
+        with open(caminho, encoding='utf-8') as entrada:
+            manifesto = json.load(entrada)
+        if manifesto.get('formato') == FORMATO:
+            return manifesto
+    return {'formato': FORMATO, 'proximo_segmento': 0, 'tabelas': {}}
+
+
+def _exportar_tabela(db: sqlite3.Connection, pasta: str, manifesto: dict, tabela: str,
+                     alterados: np.ndarray, marca: int) -> dict:
+    """
+    Atualiza os segmentos de uma tabela e devolve quantas linhas foram (re)gravadas.
+    `alterados`: ids anotados como editados ou removidos (ordenados); `marca`: maior id a exportar.
+    """
+    estado = manifesto['tabelas'].setdefault(tabela, {'ate_id': 0, 'segmentos': []})
+    relidas = regravadas = novas = 0
+
+    # 1. Segmentos já exportados: só relê os que têm algum id alterado, e só regrava se o conteúdo mudou
+    segmentos = []
+    for segmento in estado['segmentos']:
+        primeiro = np.searchsorted(alterados, segmento['de_id'])
+        if primeiro < alterados.size and alterados[primeiro] <= segmento['ate_id']:
+            dados = _ler_faixa(db, tabela, segmento['de_id'], segmento['ate_id'])
+            relidas += dados.size
+            assinatura = _assinatura(dados)
+            if assinatura != segmento['assinatura']:
+                regravadas += dados.size
+                segmento = {**segmento, 'assinatura': assinatura, 'linhas': int(dados.size),
+                            'arquivo': _gravar_segmento(pasta, manifesto, tabela, dados) if dados.size else None}
+        if segmento['linhas']:
+            segmentos.append(segmento)
+
+    # 2. Linhas novas até a marca (ids são AUTOINCREMENT: nunca reaparecem abaixo dela)
+    dados = _ler_faixa(db, tabela, estado['ate_id'] + 1, marca)
+    novas = dados.size
+    for inicio in range(0, dados.size, LINHAS_POR_SEGMENTO):
+        parte = dados[inicio:inicio + LINHAS_POR_SEGMENTO]
+        segmentos.append(_novo_segmento(pasta, manifesto, tabela, parte, estado['ate_id'] + 1))
+        estado['ate_id'] = segmentos[-1]['ate_id']
+    estado['ate_id'] = max(estado['ate_id'], marca)
+
+    # 3. Muitos segmentos: junta os vizinhos pequenos enquanto couberem em um
+    if len(segmentos) > LIMITE_SEGMENTOS:
+        grupos = []
+        for segmento in segmentos:
+            if grupos and sum(s['linhas'] for s in grupos[-1]) + segmento['linhas'] <= LINHAS_POR_SEGMENTO:
+                grupos[-1].append(segmento)
+            else:
+                grupos.append([segmento])
+        segmentos = [grupo[0] if len(grupo) == 1 else _novo_segmento(
+            pasta, manifesto, tabela,
+            np.concatenate([np.load(os.path.join(pasta, s['arquivo']), mmap_mode='r') for s in grupo]),
+            grupo[0]['de_id'], grupo[-1]['ate_id']
+        ) for grupo in grupos]
+
+    estado['segmentos'] = segmentos
+    estado['linhas'] = sum(s['linhas'] for s in segmentos)
+    return {'novas': int(novas), 'relidas': int(relidas), 'regravadas': int(regravadas), 'linhas': estado['linhas']}
+
+
+def exportar_banco(db_path: str = None) -> dict:
+    """Exporta (incrementalmente) as tabelas de um banco para a sua pasta colunar. Devolve o manifesto."""
+    db_path = db_path or DB_PATH
+    pasta = pasta_exportacao(db_path)
+    os.makedirs(pasta, exist_ok=True)
+    manifesto = _carregar_manifesto(pasta)
+    inicio = time.perf_counter()
+
+    with carteiras.conexao_banco(db_path) as db:
+        # Marca d'água antes de ler: daqui em diante os gatilhos anotam edições em qualquer id até ela
+        db.execute("BEGIN IMMEDIATE")
+        marcas = {}
+        for tabela in TABELAS:
+            marcas[tabela] = db.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabela}").fetchone()[0]
+            db.execute("""
+                INSERT INTO meta (chave, valor) VALUES (?, ?)
+                ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor
+            """, (f'colunar.{tabela}', marcas[tabela]))
+        db.commit()
+
+        # Uma única transação de leitura: todas as tabelas saem do mesmo instante do banco
+        db.execute("BEGIN")
+        try:
+            ultima = db.execute("SELECT COALESCE(MAX(seq), 0) FROM colunar_alteracoes").fetchone()[0]
+            resumo = {}
+            for tabela in TABELAS:
+                alterados = np.fromiter((linha[0] for linha in db.execute(
+                    "SELECT DISTINCT linha_id FROM colunar_alteracoes WHERE tabela = ? AND seq <= ? ORDER BY linha_id",
+                    (tabela, ultima)
+                )), dtype='i8')
+                resumo[tabela] = _exportar_tabela(db, pasta, manifesto, tabela, alterados, marcas[tabela])
+            posicoes = _ler(db, SQL_POSICOES, DTYPE_POSICOES)
+        finally:
+            db.rollback()
+
+    manifesto['tabelas']['posicoes'] = {'linhas': int(posicoes.size), 'segmentos': [{
+        'arquivo': _gravar_segmento(pasta, manifesto, 'posicoes', posicoes), 'linhas': int(posicoes.size),
+    }]}
+    resumo['posicoes'] = {'linhas': int(posicoes.size)}
+    manifesto['exportado_em'] = datetime.now().isoformat(timespec='seconds')
+    manifesto['duracao'] = round(time.perf_counter() - inicio, 3)
+    manifesto['ultima_exportacao'] = resumo
+
+    temporario = os.path.join(pasta, 'manifesto.json.tmp')
+    with open(temporario, 'w', encoding='utf-8') as saida:
+        json.dump(manifesto, saida, ensure_ascii=False, indent=2)
+    os.replace(temporario, os.path.join(pasta, 'manifesto.json'))
+
+    # As anotações lidas já estão no manifesto; as que chegaram durante a exportação ficam para a próxima
+    with carteiras.conexao_banco(db_path) as db:
+        db.execute("DELETE FROM colunar_alteracoes WHERE seq <= ?", (ultima,))
+        db.commit()
+
+    # Segmentos substituídos só somem depois do manifesto novo (leituras já abertas continuam valendo)
+    em_uso = {s['arquivo'] for estado in manifesto['tabelas'].values() for s in estado['segmentos']}
+    for arquivo in os.listdir(pasta):
+        if arquivo.endswith('.npy') and arquivo not in em_uso:
+            os.remove(os.path.join(pasta, arquivo))
+    return manifesto
+
+
+def exportar_colunar():
+    """Job agendado: exporta todos os bancos (um só no modo compartilhado, um por carteira no modo 'arquivo')."""
+    resumos = {}
+    for db_path in carteiras.bancos():
+        manifesto = exportar_banco(db_path)
+        novas = sum(t['novas'] + t['regravadas'] for t in manifesto['ultima_exportacao'].values() if 'novas' in t)
+        resumos[os.path.basename(db_path)] = novas
+        print(f"📦 Exportação colunar de {os.path.basename(db_path)}: {novas} linha(s) gravada(s) "
+              f"em {manifesto['duracao']:.2f}s")
+    return resumos
+
+
+# --- LEITURA ---
+class Exportacao:
+    """Uma versão do manifesto de um banco, com os segmentos abertos em mmap (somente leitura)."""
+
+    def __init__(self, pasta: str, manifesto: dict):
+        self.pasta = pasta
+        self.manifesto = manifesto
+        self.exportado_em = manifesto.get('exportado_em')
+        self._segmentos = {}
+        self._tabelas = {}
+
+    def segmentos(self, tabela: str) -> list:
+        if tabela not in self._segmentos:
+            self._segmentos[tabela] = [
+                np.load(os.path.join(self.pasta, s['arquivo']), mmap_mode='r')
+                for s in self.manifesto['tabelas'].get(tabela, {}).get('segmentos', [])
+            ]
+        return self._segmentos[tabela]
+
+    def tabela(self, tabela: str) -> np.ndarray:
+        """
+        A tabela inteira: o próprio mmap quando há um segmento só, senão os segmentos concatenados
+        uma única vez por exportação (a Exportacao fica em cache até o manifesto mudar).
+        """
+        if tabela not in self._tabelas:
+            segmentos = self.segmentos(tabela)
+            if not segmentos:
+                self._tabelas[tabela] = np.empty(0, dtype=DTYPES[tabela])
+            else:
+                self._tabelas[tabela] = segmentos[0] if len(segmentos) == 1 else np.concatenate(segmentos)
+        return self._tabelas[tabela]
+
+    def selecionar(self, tabela: str, filtro) -> np.ndarray:
+        """
+        Só as linhas em que `filtro(segmento)` (uma máscara booleana) é verdadeiro: o filtro roda
+        direto em cada mmap e só as linhas escolhidas são copiadas, sem montar a tabela inteira.
+        """
+        partes = [segmento[filtro(segmento)] for segmento in self.segmentos(tabela)]
+        if not partes:
+            return np.empty(0, dtype=DTYPES[tabela])
+        return partes[0] if len(partes) == 1 else np.concatenate(partes)
+
+
+_abertas = {}  # pasta -> (mtime do manifesto, Exportacao)
+_trava = threading.Lock()
+
+
+def abrir_exportacao(db_path: str = None):
+    """Última exportação do banco, ou None se ele ainda não foi exportado."""
+    pasta = pasta_exportacao(db_path)
+    caminho = os.path.join(pasta, 'manifesto.json')
+    for _ in range(2):
+        try:
+            versao = os.stat(caminho).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with _trava:
+            aberta = _abertas.get(pasta)
+        if aberta and aberta[0] == versao:
+            return aberta[1]
+        exportacao = Exportacao(pasta, _carregar_manifesto(pasta))
+        try:
+            for tabela in DTYPES:
+                exportacao.segmentos(tabela)
+        except FileNotFoundError:
+            continue  # Uma exportação trocou o manifesto no meio da abertura: lê o novo
+        with _trava:
+            _abertas[pasta] = (versao, exportacao)
+        return exportacao
+    return None
+
+
+def situacao(db_path: str = None) -> dict:
+    """Resumo da última exportação do banco (para a API)."""
+    exportacao = abrir_exportacao(db_path)
+    if exportacao is None:
+        return {"exportado_em": None, "tabelas": {}}
+    manifesto = exportacao.manifesto
+    return {
+        "exportado_em": manifesto['exportado_em'],
+        "duracao": manifesto['duracao'],
+        "tabelas": {
+            tabela: {"linhas": estado['linhas'], "segmentos": len(estado['segmentos'])}
+            for tabela, estado in manifesto['tabelas'].items()
+        },
+        "ultima_exportacao": manifesto['ultima_exportacao'],
+    }
+
+
+# Uso: python -m app.services.colunar_engine   (exporta todos os bancos agora)
+if __name__ == '__main__':
+    from app.migracoes import migrar
+    migrar()
+    exportar_colunar()
@@ -0,0 +1,68 @@
+import sqlite3
+
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = 500
+
+COLUNAS = {
+    'transacoes': "id, ativo_id, data, tipo_transacao, quantidade, preco_unitario, taxas",
+    'proventos': "id, ativo_id, data, tipo, valor",
+}
+
+
+def codificar_cursor(data: str, id_: int) -> str:
+    return f"{data}_{id_}"
+
+
+def decodificar_cursor(cursor: str) -> tuple:
+    """Converte o cursor 'AAAA-MM-DD_id' de volta em (data, id). Gera ValueError se for inválido."""
+    data, _, id_ = (cursor or '').rpartition('_')
+    if not data:
+        raise ValueError(f"Cursor de paginação inválido: '{cursor}'")
+    return data, int(id_)
+
+
+def listar_pagina(db: sqlite3.Connection, tabela: str, ativo_id: int,
+                  cursor: str = None, limite: int = LIMITE_PADRAO) -> dict:
+    """
+    Página de transações ou proventos de um ativo, da mais recente para a mais antiga.
+    Paginação por chave (data, id): cada página custa o mesmo, não importa a profundidade.
+    """
+    limite = max(1, min(limite, LIMITE_MAXIMO))
+    parametros = [ativo_id]
+    filtro = ""
+    if cursor:
+        filtro = "AND (data, id) < (?, ?)"
+        parametros.extend(decodificar_cursor(cursor))
+    parametros.append(limite + 1)  # Uma linha a mais indica se existe próxima página
+
+    linhas = db.execute(f"""
+        SELECT {COLUNAS[tabela]} FROM {tabela}
+        WHERE ativo_id = ? {filtro}
+        ORDER BY data DESC, id DESC
+        LIMIT ?
+    """, parametros).fetchall()
+
+    itens = [dict(linha) for linha in linhas[:limite]]
+    proximo = codificar_cursor(itens[-1]['data'], itens[-1]['id']) if len(linhas) > limite else None
+    return {"itens": itens, "proximo_cursor": proximo}
+
+
+def resumo_ativo(db: sqlite3.Connection, ativo_id: int) -> dict:
+    """Totais do ativo calculados direto no SQLite (usando os índices por ativo)."""
+    total_transacoes, primeira, ultima = db.execute(
+        "SELECT COUNT(*), MIN(data), MAX(data) FROM transacoes WHERE ativo_id = ?", (ativo_id,)
+    ).fetchone()
+    total_proventos, soma_proventos = db.execute(
+        "SELECT COUNT(*), TOTAL(valor) FROM proventos WHERE ativo_id = ?", (ativo_id,)
+    ).fetchone()
+    resultado_realizado = db.execute(
+        "SELECT TOTAL(resultado) FROM apuracao_mensal WHERE ativo_id = ?", (ativo_id,)
+    ).fetchone()[0]
+    return {
+        "total_transacoes": total_transacoes,
+        "primeira_negociacao": primeira,
+        "ultima_negociacao": ultima,
+        "total_lancamentos_proventos": total_proventos,
+        "total_proventos": soma_proventos,
+        "resultado_realizado": round(resultado_realizado, 2),
+    }
@@ -0,0 +1,90 @@
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import numpy as np
+
+from app import carteiras
+from app.database import incrementar_versao_dados
+from app.services.price_engine import ProvedorYahoo
+
+# Grava (ou corrige) o fechamento do dia; a chave UNIQUE(ativo_id, data) evita duplicados
+SQL_UPSERT_HISTORICO = """
+    INSERT INTO historico_precos (ativo_id, data, preco) VALUES (?, ?, ?)
+    ON CONFLICT(ativo_id, data) DO UPDATE SET preco = excluded.preco
+"""
+
+DTYPE_SERIE = np.dtype([('data', 'U10'), ('preco', 'f8')])
+
+
+def gravar_historico(cursor, linhas):
+    """Grava em lote linhas (ativo_id, data_iso, preco) em historico_precos."""
+    cursor.executemany(SQL_UPSERT_HISTORICO, linhas)
+
+
+def ler_serie(db: sqlite3.Connection, ativo_id: int, inicio: str = None, fim: str = None):
+    """
+    Lê os fechamentos de um ativo como duas colunas NumPy: datas (datetime64[D]) e preços (float64).
+    O filtro por intervalo usa o índice (ativo_id, data, preco) sem acessar a tabela.
+    """
+    cursor = db.execute(
+        """
+        SELECT data, preco FROM historico_precos
+        WHERE ativo_id = ? AND data >= ? AND data <= ?
+        ORDER BY data
+        """,
+        (ativo_id, inicio or '0000-00-00', fim or '9999-99-99')
+    )
+    serie = np.fromiter((tuple(linha) for linha in cursor), dtype=DTYPE_SERIE)
+    return serie['data'].astype('datetime64[D]'), serie['preco']
+
+
+def carregar_historico(anos: int = 5, provedor=None, tamanho_lote: int = 20) -> int:
+    """Carga inicial (backfill) de vários anos de fechamentos para todos os ativos. Retorna as linhas gravadas."""
+    provedor = provedor or ProvedorYahoo(timeout=30)
+    fim = date.today()
+    inicio = fim - timedelta(days=365 * anos)
+    inicio_carga = time.perf_counter()
+
+    # Um ticker pode estar em várias carteiras (e bancos): a série é buscada uma vez e gravada em todas
+    destinos = defaultdict(list)  # ticker -> [(db_path, ativo_id)]
+    for db_path in carteiras.bancos():
+        with carteiras.conexao_banco(db_path) as db:
+            for ativo_id, ticker in db.execute("SELECT id, ticker FROM ativos"):
+                destinos[ticker.upper()].append((db_path, ativo_id))
+    tickers = list(destinos)
+
+    total = 0
+    for i in range(0, len(tickers), tamanho_lote):
+        lote = tickers[i:i + tamanho_lote]
+        try:
+            historico = provedor.buscar_historico(lote, inicio, fim)
+        except Exception as e:
+            print(f"❌ Erro ao buscar histórico de {', '.join(lote)}: {e}")
+            continue
+
+        linhas = defaultdict(list)  # db_path -> linhas
+        for ticker, serie in historico.items():
+            for db_path, ativo_id in destinos[ticker.upper()]:
+                linhas[db_path].extend((ativo_id, data, preco) for data, preco in serie)
+        for db_path, linhas_banco in linhas.items():
+            with carteiras.conexao_banco(db_path) as db:
+                cursor = db.cursor()
+                gravar_historico(cursor, linhas_banco)
+                # Na mesma transação: os caches (deste e dos outros processos) percebem o histórico novo
+                incrementar_versao_dados(cursor)
+                db.commit()  # Um commit por lote mantém a transação curta para os outros leitores
+            total += len(linhas_banco)
+        print(f"✅ Histórico gravado para {len(historico)}/{len(lote)} ticker(s) do lote "
+              f"({sum(len(l) for l in linhas.values())} fechamentos).")
+
+    print(f"Carga de histórico concluída: {total} fechamentos em {time.perf_counter() - inicio_carga:.2f}s")
+    return total
+
+
+# Uso: python -m app.services.historico_engine [--anos N]
+if __name__ == '__main__':
+    anos = int(sys.argv[sys.argv.index('--anos') + 1]) if '--anos' in sys.argv else 5
+    carregar_historico(anos=anos)
@@ -0,0 +1,302 @@
+import csv
+import re
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import date
+
+from app.cache import CacheCarteira, chave_ativo, CHAVE_PORTFOLIO, CHAVE_PROVENTOS, CHAVE_ATIVOS, CHAVE_APURACAO
+from app.database import ID_CARTEIRA_PRINCIPAL, incrementar_versao_dados
+from app.services.portfolio_engine import recalcular_posicoes
+
+TAMANHO_LOTE = 5000
+MAX_ERROS_DETALHADOS = 1000
+
+# Movimentações do extrato da B3 que viram proventos (o resto do extrato é ignorado)
+TIPOS_PROVENTO_B3 = {
+    'dividendo': 'Dividendo',
+    'juros sobre capital próprio': 'JCP',
+    'rendimento': 'Rendimento FII',
+    'restituição de capital': 'Restituição',
+}
+
+# Formatos reconhecidos pelo cabeçalho do arquivo, por destino
+FORMATOS = {
+    'transacoes': ('padrao', 'b3_negociacao'),
+    'proventos': ('padrao', 'b3_movimentacao'),
+}
+
+
+class ErroLinha(ValueError):
+    """Linha do arquivo que não pôde ser convertida; vira um item no relatório de erros."""
+
+
+@dataclass
+class ResumoImportacao:
+    destino: str
+    formato: str = ''
+    linhas_lidas: int = 0
+    inseridas: int = 0
+    ignoradas: int = 0
+    ativos_criados: list = field(default_factory=list)
+    total_erros: int = 0
+    erros: list = field(default_factory=list)
+    tempo_total: float = 0.0
+
+    def registrar_erro(self, linha: int, mensagem: str):
+        self.total_erros += 1
+        # Guarda só os primeiros erros para a memória não crescer com arquivos muito ruins
+        if len(self.erros) < MAX_ERROS_DETALHADOS:
+            self.erros.append({"linha": linha, "erro": mensagem})
+
+    def __str__(self):
+        return (f"{self.inseridas} linha(s) importada(s) de {self.linhas_lidas} ({self.formato}), "
+                f"{self.ignoradas} ignorada(s), {self.total_erros} erro(s), "
+                f"{len(self.ativos_criados)} ativo(s) criado(s) em {self.tempo_total:.2f}s")
+
+
+# --- CONVERSÕES ---
+
+# Pontos só separando grupos de três dígitos (sem zero à esquerda): 1.000, 12.345.678
+_MILHAR_BR = re.compile(r'^-?[1-9]\d{0,2}(\.\d{3})+$')
+
+
+def _numero(texto: str, decimal_br: bool = False) -> float:
+    """
+    Número com vírgula decimal (1.234,56) em qualquer formato. Sem vírgula, os extratos da B3
+    (`decimal_br`) usam o ponto só como milhar (1.000); no formato padrão o ponto é decimal (10.5),
+    e um único grupo de três dígitos depois do ponto (1.500: 1,5 ou mil e quinhentos?) é recusado.
+    """
+    texto = (texto or '').replace('R$', '').replace(' ', '').strip()
+    if not texto or texto == '-':
+        raise ErroLinha("número vazio")
+    if ',' in texto or (decimal_br and _MILHAR_BR.match(texto)):
+        texto = texto.replace('.', '').replace(',', '.')
+    elif _MILHAR_BR.match(texto):
+        if texto.count('.') == 1:
+            raise ErroLinha(f"número ambíguo: '{texto}' (escreva {texto.replace('.', '')} para milhar "
+                            f"ou {texto.replace('.', ',')} para decimal)")
+        texto = texto.replace('.', '')
+    try:
+        return float(texto)
+    except ValueError:
+        raise ErroLinha(f"número inválido: '{texto}'")
+
+
+def _data(texto: str) -> str:
+    texto = (texto or '').strip()
+    partes = texto.split('/')
+    if len(partes) == 3:  # DD/MM/YYYY
+        texto = f"{partes[2]}-{partes[1]}-{partes[0]}"
+    try:
+        return date.fromisoformat(texto).isoformat()
+    except ValueError:
+        raise ErroLinha(f"data inválida: '{texto}'")
+
+
+def _ticker(texto: str) -> str:
+    # "PETR4 - PETROLEO BRASILEIRO" -> "PETR4"; "PETR4F" (mercado fracionário) -> "PETR4"
+    ticker = (texto or '').split(' - ')[0].strip().upper()
+    if len(ticker) >= 6 and ticker.endswith('F') and ticker[-2].isdigit():
+        ticker = ticker[:-1]
+    if not ticker:
+        raise ErroLinha("ticker vazio")
+    return ticker
+
+
+def _tipo_por_ticker(ticker: str) -> tuple:
+    """Palpite de tipo e setor para ativos criados pela importação (podem ser corrigidos na tela)."""
+    if ticker.endswith('11'):
+        return 'FII', 'Imobiliário'
+    if ticker[-2:] in ('32', '33', '34', '35'):
+        return 'BDR', 'Outros'
+    return 'ACAO', 'Outros'
+
+
+def _normalizar_cabecalho(cabecalho: list) -> list:
+    return [c.strip().lstrip('\ufeff').lower() for c in cabecalho]
+
+
+def detectar_formato(cabecalho: list, destino: str) -> str:
+    colunas = set(_normalizar_cabecalho(cabecalho))
+    if destino == 'transacoes':
+        if {'data do negócio', 'código de negociação'} <= colunas:
+            return 'b3_negociacao'
+        if {'data', 'ticker', 'tipo_transacao', 'quantidade', 'preco_unitario'} <= colunas:
+            return 'padrao'
+    else:
+        if {'data', 'movimentação', 'produto'} <= colunas:
+            return 'b3_movimentacao'
+        if {'data', 'ticker', 'tipo', 'valor'} <= colunas:
+            return 'padrao'
+    raise ValueError(f"Cabeçalho não reconhecido para importar {destino}: {', '.join(cabecalho)}")
+
+
+# --- CONVERSORES DE LINHA: devolvem (ticker, nome, tupla_para_insert) ou None para ignorar ---
+
+def _linha_transacao_padrao(linha: dict):
+    tipo = linha['tipo_transacao'].strip().upper()
+    if tipo not in ('COMPRA', 'VENDA'):
+        raise ErroLinha(f"tipo_transacao inválido: '{tipo}'")
+    taxas = _numero(linha['taxas']) if (linha.get('taxas') or '').strip() else 0.0
+    ticker = _ticker(linha['ticker'])
+    return ticker, ticker, (_data(linha['data']), tipo, _numero(linha['quantidade']),
+                            _numero(linha['preco_unitario']), taxas)
+
+
+def _linha_transacao_b3(linha: dict):
+    tipo = linha['tipo de movimentação'].strip().upper()
+    if tipo not in ('COMPRA', 'VENDA'):
+        return None
+    ticker = _ticker(linha['código de negociação'])
+    return ticker, ticker, (_data(linha['data do negócio']), tipo, _numero(linha['quantidade'], decimal_br=True),
+                            _numero(linha['preço'], decimal_br=True), 0.0)
+
+
+def _linha_provento_padrao(linha: dict):
+    ticker = _ticker(linha['ticker'])
+    return ticker, ticker, (_data(linha['data']), linha['tipo'].strip(), _numero(linha['valor']))
+
+
+def _linha_provento_b3(linha: dict):
+    tipo = TIPOS_PROVENTO_B3.get(linha['movimentação'].strip().lower())
+    if tipo is None or linha.get('entrada/saída', 'Credito').strip().lower().startswith('d'):
+        return None
+    produto = linha['produto']
+    ticker = _ticker(produto)
+    nome = produto.split(' - ', 1)[1].strip() if ' - ' in produto else ticker
+    return ticker, nome, (_data(linha['data']), tipo, _numero(linha['valor da operação'], decimal_br=True))
+
+
+CONVERSORES = {
+    ('transacoes', 'padrao'): _linha_transacao_padrao,
+    ('transacoes', 'b3_negociacao'): _linha_transacao_b3,
+    ('proventos', 'padrao'): _linha_provento_padrao,
+    ('proventos', 'b3_movimentacao'): _linha_provento_b3,
+}
+
+SQL_INSERT = {
+    'transacoes': "INSERT INTO transacoes (carteira_id, ativo_id, data, tipo_transacao, quantidade, preco_unitario, "
+                  "taxas) VALUES (?, ?, ?, ?, ?, ?, ?)",
+    'proventos': "INSERT INTO proventos (carteira_id, ativo_id, data, tipo, valor) VALUES (?, ?, ?, ?, ?)",
+}
+
+
+class _ResolvedorAtivos:
+    """Mapa ticker -> ativo_id da carteira carregado uma vez; tickers novos são criados na mesma transação."""
+
+    def __init__(self, cursor, resumo: ResumoImportacao, carteira_id: int):
+        self.cursor = cursor
+        self.resumo = resumo
+        self.carteira_id = carteira_id
+        cursor.execute("SELECT id, ticker FROM ativos WHERE carteira_id = ?", (carteira_id,))
+        self.ids = {ticker.upper(): ativo_id for ativo_id, ticker in cursor.fetchall()}
+
+    def resolver(self, ticker: str, nome: str) -> int:
+        ativo_id = self.ids.get(ticker)
+        if ativo_id is None:
+            tipo, setor = _tipo_por_ticker(ticker)
+            self.cursor.execute(
+                "INSERT INTO ativos (carteira_id, ticker, nome, tipo, setor, preco_atual) VALUES (?, ?, ?, ?, ?, 0.0)",
+                (self.carteira_id, ticker, nome, tipo, setor)
+            )
+            ativo_id = self.cursor.lastrowid
+            self.ids[ticker] = ativo_id
+            self.resumo.ativos_criados.append(ticker)
+        return ativo_id
+
+
+def importar_csv(db: sqlite3.Connection, arquivo, destino: str = 'transacoes', formato: str = 'auto',
+                 carteira_id: int = ID_CARTEIRA_PRINCIPAL, cache: CacheCarteira = None) -> ResumoImportacao:
+    """
+    Importa um CSV (arquivo de texto aberto) lendo em blocos de TAMANHO_LOTE linhas.
+    Tudo roda em uma única transação; linhas com problema entram no relatório de erros e são puladas.
+    `cache` é o cache da carteira, se houver um neste processo, de onde saem as chaves afetadas.
+    """
+    if destino not in FORMATOS:
+        raise ValueError(f"Destino de importação inválido: {destino}")
+    inicio = time.perf_counter()
+    resumo = ResumoImportacao(destino=destino)
+
+    # Detecta o separador (',' ou ';') pela primeira linha
+    primeira = arquivo.readline()
+    if not primeira.strip():
+        raise ValueError("Arquivo vazio.")
+    separador = ';' if primeira.count(';') > primeira.count(',') else ','
+    cabecalho = next(csv.reader([primeira], delimiter=separador))
+    resumo.formato = detectar_formato(cabecalho, destino) if formato == 'auto' else formato
+    if resumo.formato not in FORMATOS[destino]:
+        raise ValueError(f"Formato inválido para {destino}: {resumo.formato}")
+    converter = CONVERSORES[(destino, resumo.formato)]
+    colunas = _normalizar_cabecalho(cabecalho)
+
+    cursor = db.cursor()
+    ativos = _ResolvedorAtivos(cursor, resumo, carteira_id)
+    ativos_afetados = {}  # ativo_id -> data mais antiga importada (de onde reprocessar)
+    lote = []
+
+    try:
+        for numero, valores in enumerate(csv.reader(arquivo, delimiter=separador), start=2):
+            if not any(v.strip() for v in valores):
+                continue
+            resumo.linhas_lidas += 1
+            try:
+                convertido = converter(dict(zip(colunas, valores)))
+            except (ErroLinha, KeyError, AttributeError) as e:
+                resumo.registrar_erro(numero, str(e) if isinstance(e, ErroLinha) else f"coluna ausente: {e}")
+                continue
+            if convertido is None:
+                resumo.ignoradas += 1
+                continue
+
+            ticker, nome, dados = convertido
+            ativo_id = ativos.resolver(ticker, nome)
+            if ativo_id not in ativos_afetados or dados[0] < ativos_afetados[ativo_id]:
+                ativos_afetados[ativo_id] = dados[0]
+            lote.append((carteira_id, ativo_id, *dados))
+
+            if len(lote) >= TAMANHO_LOTE:
+                cursor.executemany(SQL_INSERT[destino], lote)
+                resumo.inseridas += len(lote)
+                lote.clear()
+
+        if lote:
+            cursor.executemany(SQL_INSERT[destino], lote)
+            resumo.inseridas += len(lote)
+
+        if destino == 'transacoes':
+            recalcular_posicoes(cursor, ativos_afetados)
+        # Os outros processos (workers do uvicorn, CLI) descartam o cache da carteira ao ver a versão mudar
+        versao = incrementar_versao_dados(cursor, carteira_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    if cache is not None:
+        chaves = [chave_ativo(ativo_id) for ativo_id in ativos_afetados]
+        chaves.extend((CHAVE_PORTFOLIO, CHAVE_APURACAO) if destino == 'transacoes' else (CHAVE_PROVENTOS,))
+        if resumo.ativos_criados:
+            chaves.append(CHAVE_ATIVOS)
+        cache.registrar_gravacao(versao, *chaves)
+
+    resumo.tempo_total = time.perf_counter() - inicio
+    return resumo
+
+
+# Uso: python -m app.services.import_engine {transacoes|proventos} ARQUIVO.csv [--formato FORMATO] [--carteira NOME]
+if __name__ == '__main__':
+    from app.carteiras import obter_carteira, NOME_PRINCIPAL
+
+    if len(sys.argv) < 3 or sys.argv[1] not in FORMATOS:
+        print("Uso: python -m app.services.import_engine {transacoes|proventos} ARQUIVO.csv "
+              "[--formato FORMATO] [--carteira NOME]")
+        sys.exit(2)
+    formato = sys.argv[sys.argv.index('--formato') + 1] if '--formato' in sys.argv else 'auto'
+    carteira = obter_carteira(sys.argv[sys.argv.index('--carteira') + 1] if '--carteira' in sys.argv else NOME_PRINCIPAL)
+    with open(sys.argv[2], encoding='utf-8-sig', errors='replace', newline='') as arquivo, carteira.conexao() as db:
+        resumo = importar_csv(db, arquivo, destino=sys.argv[1], formato=formato, carteira_id=carteira.id)
+    for erro in resumo.erros[:20]:
+        print(f"❌ Linha {erro['linha']}: {erro['erro']}")
+    print(f"✅ {resumo}")
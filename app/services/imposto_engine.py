@@ -0,0 +1,105 @@
+import sqlite3
+import sys
+from collections import defaultdict
+
+from app.database import ID_CARTEIRA_PRINCIPAL, conexao
+
+# --- APURAÇÃO MENSAL DO IMPOSTO DE RENDA (RENDA VARIÁVEL, OPERAÇÕES COMUNS) ---
+# Lê os resultados realizados que o portfolio_engine já guarda por ativo e mês (apuracao_mensal),
+# então o relatório de uma década de negociações é uma agregação pequena, não um reprocessamento.
+# É uma estimativa para conferência: não separa day trade nem desconta o IRRF retido na fonte.
+
+ALIQUOTAS = {'ACAO': 0.15, 'ETF': 0.15, 'BDR': 0.15, 'FII': 0.20}
+ALIQUOTA_PADRAO = 0.15
+
+# Ações: ganho isento no mês em que o total de vendas de ações não passa de R$ 20 mil
+ISENCAO_VENDAS_ACOES = 20000.0
+
+# Prejuízo só compensa lucro do mesmo grupo: FII separado das demais operações comuns
+GRUPOS_COMPENSACAO = {'FII': 'FII'}
+GRUPO_PADRAO = 'COMUM'
+
+SQL_RESULTADOS_POR_CLASSE = """
+    SELECT m.mes, a.tipo AS classe,
+           SUM(m.vendas) AS vendas, SUM(m.custo_vendas) AS custo, SUM(m.taxas_vendas) AS taxas,
+           SUM(m.resultado) AS resultado
+    FROM apuracao_mensal m
+    JOIN ativos a ON a.id = m.ativo_id
+    WHERE a.carteira_id = ? AND m.vendas > 0
+    GROUP BY m.mes, a.tipo
+    ORDER BY m.mes, resultado
+"""
+
+
+def apurar_meses(db: sqlite3.Connection, carteira_id: int = ID_CARTEIRA_PRINCIPAL) -> list:
+    """
+    Resultado, isenção, compensação de prejuízos e imposto estimado de cada mês com vendas.
+    Percorre o histórico inteiro (o prejuízo acumulado vem de anos anteriores); filtrar por ano é com quem chama.
+    """
+    meses = []
+    prejuizos = defaultdict(float)
+    atual = None
+    # Dentro do mês as classes vêm do menor para o maior resultado: prejuízos entram antes de compensar lucros
+    for mes, classe, vendas, custo, taxas, resultado in db.execute(SQL_RESULTADOS_POR_CLASSE, (carteira_id,)):
+        if atual is None or atual["mes"] != mes:
+            atual = {"mes": mes, "classes": [], "imposto": 0.0}
+            meses.append(atual)
+        atual["classes"].append({
+            "classe": classe, "vendas": vendas, "custo": custo, "taxas": taxas, "resultado": resultado
+        })
+
+    for mes in meses:
+        vendas_acoes = sum(c["vendas"] for c in mes["classes"] if c["classe"] == 'ACAO')
+        for classe in mes["classes"]:
+            grupo = GRUPOS_COMPENSACAO.get(classe["classe"], GRUPO_PADRAO)
+            classe["isento"] = classe["classe"] == 'ACAO' and vendas_acoes <= ISENCAO_VENDAS_ACOES
+            compensado = base = 0.0
+            if classe["resultado"] < 0:
+                prejuizos[grupo] -= classe["resultado"]
+            elif not classe["isento"]:
+                compensado = min(prejuizos[grupo], classe["resultado"])
+                prejuizos[grupo] -= compensado
+                base = classe["resultado"] - compensado
+            classe["prejuizo_compensado"] = round(compensado, 2)
+            classe["base_calculo"] = round(base, 2)
+            classe["imposto"] = round(base * ALIQUOTAS.get(classe["classe"], ALIQUOTA_PADRAO), 2)
+            for campo in ("vendas", "custo", "taxas", "resultado"):
+                classe[campo] = round(classe[campo], 2)
+            mes["imposto"] += classe["imposto"]
+        mes["imposto"] = round(mes["imposto"], 2)
+        mes["prejuizo_a_compensar"] = {grupo: round(valor, 2) for grupo, valor in prejuizos.items()}
+    return meses
+
+
+def resumo_anual(meses: list, ano: int) -> dict:
+    """Recorte de um ano da apuração, com os totais usados na declaração."""
+    prefixo = f"{ano:04d}-"
+    do_ano = [mes for mes in meses if mes["mes"].startswith(prefixo)]
+    anteriores = [mes for mes in meses if mes["mes"] < prefixo]
+    return {
+        "ano": ano,
+        "meses": do_ano,
+        "resultado": round(sum(c["resultado"] for mes in do_ano for c in mes["classes"]), 2),
+        "ganhos_isentos": round(sum(
+            (c["resultado"] for mes in do_ano for c in mes["classes"] if c["isento"] and c["resultado"] > 0), 0.0
+        ), 2),
+        "imposto": round(sum(mes["imposto"] for mes in do_ano), 2),
+        "prejuizo_inicial": anteriores[-1]["prejuizo_a_compensar"] if anteriores else {},
+        "prejuizo_final": do_ano[-1]["prejuizo_a_compensar"] if do_ano else
+                          (anteriores[-1]["prejuizo_a_compensar"] if anteriores else {}),
+    }
+
+
+# Uso: python -m app.services.imposto_engine ANO
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or not sys.argv[1].isdigit():
+        print("Uso: python -m app.services.imposto_engine ANO")
+        sys.exit(2)
+    with conexao() as db:
+        resumo = resumo_anual(apurar_meses(db), int(sys.argv[1]))
+    for mes in resumo["meses"]:
+        for c in mes["classes"]:
+            marcador = 'isento' if c["isento"] else f"DARF R$ {c['imposto']:.2f}"
+            print(f"{mes['mes']}  {c['classe']:<5} vendas R$ {c['vendas']:>12.2f}  resultado R$ {c['resultado']:>11.2f}  {marcador}")
+    print(f"📊 {resumo['ano']}: resultado R$ {resumo['resultado']:.2f} · isentos R$ {resumo['ganhos_isentos']:.2f} "
+          f"· imposto estimado R$ {resumo['imposto']:.2f}")
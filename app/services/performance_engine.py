@@ -0,0 +1,223 @@
+import sqlite3
+from datetime import date
+
+import numpy as np
+
+from app.database import ID_CARTEIRA_PRINCIPAL
+
+DIAS_UTEIS_ANO = 252
+
+# As datas já saem do SQLite como dias desde 1970-01-01, prontas para virar datetime64[D]
+SQL_DIA = "CAST(julianday({}) - 2440587.5 AS INTEGER)"
+
+DTYPE_TRANSACAO = np.dtype([
+    ('ativo_id', 'i8'), ('data', 'i8'), ('sinal', 'i1'),
+    ('quantidade', 'f8'), ('preco', 'f8'), ('taxas', 'f8')
+])
+DTYPE_PRECO = np.dtype([('ativo_id', 'i8'), ('data', 'i8'), ('preco', 'f8')])
+DTYPE_PROVENTO = np.dtype([('data', 'i8'), ('valor', 'f8')])
+
+
+def _ler(db: sqlite3.Connection, sql: str, dtype: np.dtype, parametros=()):
+    """Lê o resultado da consulta direto para um array estruturado, sem criar dicts por linha."""
+    cursor = db.cursor()
+    cursor.row_factory = None  # Tuplas simples são bem mais rápidas que sqlite3.Row aqui
+    cursor.execute(sql, parametros)
+    return np.fromiter(cursor, dtype=dtype)
+
+
+def _datas(dias: np.ndarray) -> np.ndarray:
+    return dias.astype('datetime64[D]')
+
+
+def _preencher_para_frente(matriz: np.ndarray) -> np.ndarray:
+    """Propaga o último valor conhecido de cada coluna para as linhas seguintes (forward fill)."""
+    linhas = np.where(np.isnan(matriz), 0, np.arange(matriz.shape[0])[:, None])
+    np.maximum.accumulate(linhas, axis=0, out=linhas)
+    return matriz[linhas, np.arange(matriz.shape[1])]
+
+
+def _desvio_movel(serie: np.ndarray, janela: int) -> np.ndarray:
+    """Desvio padrão amostral de cada janela móvel; NaN enquanto a janela não completa (como o rolling do pandas)."""
+    desvios = np.full(serie.size, np.nan)
+    if 1 < janela <= serie.size:
+        # Somas acumuladas (série centrada, para não perder precisão): O(n) para qualquer tamanho de janela
+        centrada = serie - serie.mean()
+        acumulada = np.concatenate(([0.0], np.cumsum(centrada)))
+        acumulada_quadrados = np.concatenate(([0.0], np.cumsum(centrada * centrada)))
+        soma = acumulada[janela:] - acumulada[:-janela]
+        soma_quadrados = acumulada_quadrados[janela:] - acumulada_quadrados[:-janela]
+        variancia = (soma_quadrados - soma * soma / janela) / (janela - 1)
+        desvios[janela - 1:] = np.sqrt(np.maximum(variancia, 0.0))
+    return desvios
+
+
+def _taxa_interna(fluxos: np.ndarray, dias: np.ndarray) -> float:
+    """Taxa interna de retorno anual (XIRR) por bisseção, com os fluxos já agregados por dia."""
+    anos = (dias - dias[0]) / 365.0
+
+    def vpl(taxa):
+        return np.sum(fluxos / np.power(1.0 + taxa, anos))
+
+    baixa, alta = -0.9999, 10.0
+    if vpl(baixa) * vpl(alta) > 0:
+        return None
+    for _ in range(200):
+        meio = (baixa + alta) / 2
+        if vpl(baixa) * vpl(meio) <= 0:
+            alta = meio
+        else:
+            baixa = meio
+        if alta - baixa < 1e-10:
+            break
+    return (baixa + alta) / 2
+
+
+def calcular_performance(db: sqlite3.Connection, janela_volatilidade: int = 21, ate: date = None,
+                         carteira_id: int = ID_CARTEIRA_PRINCIPAL) -> dict:
+    """
+    Monta a matriz densa dia útil × ativo (quantidades e preços) e calcula, de forma vetorizada,
+    a série de valor da carteira, retornos TWR e MWR, drawdown máximo e volatilidade móvel.
+    """
+    transacoes = _ler(db, f"""
+        SELECT ativo_id, {SQL_DIA.format("data")},
+               CASE tipo_transacao WHEN 'COMPRA' THEN 1 WHEN 'VENDA' THEN -1 ELSE 0 END,
+               quantidade, preco_unitario, taxas
+        FROM transacoes
+        WHERE carteira_id = ?
+    """, DTYPE_TRANSACAO, (carteira_id,))
+    if transacoes.size == 0:
+        return {"datas": [], "resumo": None}
+
+    inicio = str(_datas(transacoes['data']).min())
+    historico = _ler(db, f"""
+        SELECT ativo_id, {SQL_DIA.format('data')}, preco FROM historico_precos
+        WHERE ativo_id IN (SELECT id FROM ativos WHERE carteira_id = ?) AND data >= ?
+    """, DTYPE_PRECO, (carteira_id, inicio))
+    proventos = _ler(
+        db, f"SELECT {SQL_DIA.format('data')}, valor FROM proventos WHERE carteira_id = ? AND data >= ?",
+        DTYPE_PROVENTO, (carteira_id, inicio)
+    )
+    return _calcular(transacoes, historico, proventos, janela_volatilidade, ate)
+
+
+def calcular_performance_colunar(exportacao, janela_volatilidade: int = 21, ate: date = None,
+                                 carteira_id: int = ID_CARTEIRA_PRINCIPAL) -> dict:
+    """
+    O mesmo cálculo a partir da exportação colunar (ver colunar_engine): os arrays vêm dos .npy em
+    mmap, sem consultar o SQLite. Reflete os dados do momento da última exportação.
+    """
+    transacoes = exportacao.selecionar('transacoes', lambda t: t['carteira_id'] == carteira_id)
+    if transacoes.size == 0:
+        return {"datas": [], "resumo": None}
+
+    inicio = transacoes['data'].min()
+    # Histórico de ativos de outras carteiras é descartado pelo próprio cálculo (ativo fora do eixo)
+    historico = exportacao.selecionar('historico_precos', lambda h: h['data'] >= inicio)
+    proventos = exportacao.selecionar(
+        'proventos', lambda p: (p['carteira_id'] == carteira_id) & (p['data'] >= inicio)
+    )
+    return _calcular(transacoes, historico, proventos, janela_volatilidade, ate)
+
+
+def _calcular(transacoes: np.ndarray, historico: np.ndarray, proventos_raw: np.ndarray,
+              janela_volatilidade: int, ate: date) -> dict:
+    # 1. Eixo de datas: dias úteis entre a primeira transação e hoje
+    datas_tx = _datas(transacoes['data'])
+    inicio = datas_tx.min()
+    fim = np.datetime64(ate or date.today(), 'D')
+    datas = np.arange(inicio, max(fim, datas_tx.max()) + 1, dtype='datetime64[D]')
+    datas = datas[np.is_busday(datas)]
+    n_dias = datas.size
+
+    # 2. Eixo de ativos
+    ativos, col_tx = np.unique(transacoes['ativo_id'], return_inverse=True)
+    n_ativos = ativos.size
+    # Transações em fim de semana/feriado caem no próximo dia útil
+    lin_tx = np.minimum(np.searchsorted(datas, datas_tx), n_dias - 1)
+
+    # 3. Matriz de quantidades: soma das variações de cada dia, acumulada no tempo
+    qtd_assinada = transacoes['sinal'] * transacoes['quantidade']
+    quantidades = np.zeros((n_dias, n_ativos))
+    np.add.at(quantidades, (lin_tx, col_tx), qtd_assinada)
+    np.cumsum(quantidades, axis=0, out=quantidades)
+
+    # 4. Matriz de preços: o preço das transações serve de base e o histórico de fechamentos tem prioridade
+    precos = np.full((n_dias, n_ativos), np.nan)
+    precos[lin_tx, col_tx] = transacoes['preco']
+    if historico.size:
+        col_h = np.searchsorted(ativos, historico['ativo_id'])
+        col_h_valida = np.minimum(col_h, n_ativos - 1)
+        datas_h = _datas(historico['data'])
+        lin_h = np.searchsorted(datas, datas_h)
+        validos = (ativos[col_h_valida] == historico['ativo_id']) & (lin_h < n_dias)
+        validos[validos] &= datas[lin_h[validos]] == datas_h[validos]
+        precos[lin_h[validos], col_h[validos]] = historico['preco'][validos]
+    precos = np.nan_to_num(_preencher_para_frente(precos))
+
+    # 5. Valor diário da carteira, compras e vendas do dia (com as taxas) e proventos recebidos
+    valor = np.einsum('ij,ij->i', quantidades, precos)
+    financeiro = transacoes['quantidade'] * transacoes['preco']
+    venda = transacoes['sinal'] < 0
+    compras = np.bincount(
+        lin_tx, weights=np.where(venda, 0.0, (transacoes['sinal'] > 0) * financeiro + transacoes['taxas']), minlength=n_dias
+    )
+    vendas = np.bincount(
+        lin_tx, weights=np.where(venda, financeiro - transacoes['taxas'], 0.0), minlength=n_dias
+    )
+    aportes = compras - vendas
+    proventos = np.zeros(n_dias)
+    if proventos_raw.size:
+        lin_p = np.searchsorted(datas, _datas(proventos_raw['data']))
+        dentro = lin_p < n_dias
+        proventos = np.bincount(lin_p[dentro], weights=proventos_raw['valor'][dentro], minlength=n_dias)
+
+    # 6. Retorno diário ponderado no tempo: compras entram no início do dia (somam à base) e vendas
+    # saem no fim (o valor recebido conta junto com o valor do dia); proventos são rendimento
+    valor_anterior = np.concatenate(([0.0], valor[:-1]))
+    base = valor_anterior + compras
+    retornos = np.divide(
+        valor + proventos + vendas - base, base, out=np.zeros(n_dias), where=base > 1e-9
+    )
+    indice = np.cumprod(1.0 + retornos)
+    twr = indice[-1] - 1.0
+    anos = max(n_dias / DIAS_UTEIS_ANO, 1e-9)
+    twr_anual = indice[-1] ** (1.0 / anos) - 1.0 if indice[-1] > 0 else -1.0
+
+    # 7. Retorno ponderado pelo dinheiro (TIR): aportes saem do bolso, proventos e valor final voltam
+    fluxos = proventos - aportes
+    fluxos[-1] += valor[-1]
+    com_fluxo = fluxos != 0
+    mwr = _taxa_interna(fluxos[com_fluxo], datas[com_fluxo].astype('int64')) if com_fluxo.sum() > 1 else None
+
+    # 8. Drawdown sobre o índice de retorno e volatilidade móvel anualizada
+    drawdown = indice / np.maximum.accumulate(indice) - 1.0
+    vale = int(np.argmin(drawdown))
+    pico = int(np.argmax(indice[:vale + 1])) if vale > 0 else 0
+    volatilidade = _desvio_movel(retornos, janela_volatilidade) * np.sqrt(DIAS_UTEIS_ANO)
+
+    def _lista(serie, casas=6):
+        return np.round(np.nan_to_num(serie, nan=0.0), casas).tolist()
+
+    return {
+        "resumo": {
+            "data_inicio": str(datas[0]),
+            "data_fim": str(datas[-1]),
+            "valor_final": round(float(valor[-1]), 2),
+            "aportes_liquidos": round(float(aportes.sum()), 2),
+            "proventos_recebidos": round(float(proventos.sum()), 2),
+            "twr": round(float(twr), 6),
+            "twr_anualizado": round(float(twr_anual), 6),
+            "mwr_anualizado": round(float(mwr), 6) if mwr is not None else None,
+            "drawdown_maximo": round(float(drawdown[vale]), 6),
+            "data_pico": str(datas[pico]),
+            "data_vale": str(datas[vale]),
+            "volatilidade_anualizada": round(float(np.nanstd(retornos, ddof=1) * np.sqrt(DIAS_UTEIS_ANO)), 6)
+                                       if n_dias > 1 else 0.0,
+        },
+        "datas": np.datetime_as_string(datas).tolist(),
+        "valor": _lista(valor, 2),
+        "retorno_acumulado": _lista(indice - 1.0),
+        "drawdown": _lista(drawdown),
+        "volatilidade_movel": _lista(volatilidade),
+    }
@@ -0,0 +1,214 @@
+import sqlite3
+import sys
+
+from app.database import conexao
+
+# Diferença máxima aceita entre a tabela materializada e o recálculo completo
+TOLERANCIA = 1e-6
+
+# Linhas acumuladas antes de cada executemany na reconstrução completa
+TAMANHO_LOTE = 5000
+
+# Percorre o índice (ativo_id, data): a ordem sai pronta, sem ordenação em memória
+# (tipo_transacao e taxas já chegam normalizados: restrições da migração 6)
+SQL_TRANSACOES_ORDENADAS = """
+    SELECT ativo_id, data, tipo_transacao, quantidade, preco_unitario, taxas
+    FROM transacoes
+    {filtro}
+    ORDER BY ativo_id, data, id
+"""
+
+SQL_GRAVAR_POSICAO = """
+    INSERT INTO posicoes (ativo_id, quantidade, valor_investido, preco_medio) VALUES (?, ?, ?, ?)
+    ON CONFLICT(ativo_id) DO UPDATE SET
+        quantidade = excluded.quantidade,
+        valor_investido = excluded.valor_investido,
+        preco_medio = excluded.preco_medio
+"""
+
+SQL_GRAVAR_MES = """
+    INSERT INTO apuracao_mensal (ativo_id, mes, quantidade, custo, vendas, custo_vendas, taxas_vendas, resultado)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class _Posicao:
+    """
+    Posição de um ativo pelo custo médio (regra da Receita para renda variável).
+    Compras somam quantidade e custo (com taxas); vendas baixam o custo pelo preço médio do momento
+    e realizam o resultado: valor da venda - taxas - custo das cotas vendidas.
+    """
+    __slots__ = ('quantidade', 'custo', 'mes', 'vendas', 'custo_vendas', 'taxas_vendas', 'resultado')
+
+    def __init__(self, quantidade: float = 0.0, custo: float = 0.0):
+        self.quantidade = quantidade
+        self.custo = custo
+        self.mes = None
+        self._zerar_mes()
+
+    def _zerar_mes(self):
+        self.vendas = self.custo_vendas = self.taxas_vendas = self.resultado = 0.0
+
+    @property
+    def preco_medio(self) -> float:
+        return self.custo / self.quantidade if self.quantidade > TOLERANCIA else 0.0
+
+    def aplicar(self, tipo: str, quantidade: float, preco: float, taxas: float):
+        if tipo == 'COMPRA':
+            self.quantidade += quantidade
+            self.custo += quantidade * preco + taxas
+        elif tipo == 'VENDA':
+            # Vender mais do que se tem não gera custo além do que estava em carteira
+            vendida = min(quantidade, max(self.quantidade, 0.0))
+            custo_vendido = self.preco_medio * vendida
+            self.quantidade -= quantidade
+            self.custo -= custo_vendido
+            if self.quantidade <= TOLERANCIA:
+                self.quantidade, self.custo = max(self.quantidade, 0.0), 0.0
+            self.vendas += quantidade * preco
+            self.custo_vendas += custo_vendido
+            self.taxas_vendas += taxas
+            self.resultado += quantidade * preco - taxas - custo_vendido
+
+    def fechar_mes(self, ativo_id: int) -> tuple:
+        linha = (ativo_id, self.mes, self.quantidade, self.custo,
+                 self.vendas, self.custo_vendas, self.taxas_vendas, self.resultado)
+        self._zerar_mes()
+        return linha
+
+    def linha_posicao(self, ativo_id: int) -> tuple:
+        return ativo_id, self.quantidade, self.custo, self.preco_medio
+
+
+def _processar(transacoes, iniciais: dict = None):
+    """
+    Passada única sobre transações ordenadas por (ativo_id, data). Para cada ativo devolve
+    (ativo_id, posição final, linhas de apuracao_mensal), sem guardar o histórico em memória.
+    `iniciais` traz a posição de partida de cada ativo quando o reprocessamento começa no meio.
+    """
+    iniciais = iniciais or {}
+    atual_id, posicao, meses = None, None, []
+    for ativo_id, data, tipo, quantidade, preco, taxas in transacoes:
+        if ativo_id != atual_id:
+            if atual_id is not None:
+                meses.append(posicao.fechar_mes(atual_id))
+                yield atual_id, posicao, meses
+            atual_id, posicao, meses = ativo_id, _Posicao(*iniciais.get(ativo_id, ())), []
+        mes = data[:7]
+        if mes != posicao.mes:
+            if posicao.mes is not None:
+                meses.append(posicao.fechar_mes(ativo_id))
+            posicao.mes = mes
+        posicao.aplicar(tipo, quantidade, preco, taxas)
+    if atual_id is not None:
+        meses.append(posicao.fechar_mes(atual_id))
+        yield atual_id, posicao, meses
+
+
+def reprocessar_ativo(cursor, ativo_id: int, desde: str = None):
+    """
+    Refaz a posição e a apuração mensal do ativo a partir do mês de `desde` (data da transação
+    incluída, alterada ou removida). Os meses anteriores não mudam e servem de ponto de partida.
+    Deve ser chamada com o mesmo cursor do INSERT/UPDATE/DELETE para ficar na mesma transação.
+    """
+    mes = (desde or '')[:7]
+    inicial = ()
+    if mes:
+        anterior = cursor.execute(
+            "SELECT quantidade, custo FROM apuracao_mensal WHERE ativo_id = ? AND mes < ? ORDER BY mes DESC LIMIT 1",
+            (ativo_id, mes)
+        ).fetchone()
+        inicial = tuple(anterior) if anterior else ()
+    cursor.execute("DELETE FROM apuracao_mensal WHERE ativo_id = ? AND mes >= ?", (ativo_id, mes))
+
+    transacoes = cursor.execute(
+        SQL_TRANSACOES_ORDENADAS.format(filtro="WHERE ativo_id = ? AND data >= ?"), (ativo_id, mes)
+    ).fetchall()
+    posicao = _Posicao(*inicial)
+    for _, posicao, meses in _processar(transacoes, {ativo_id: inicial}):
+        cursor.executemany(SQL_GRAVAR_MES, meses)
+    cursor.execute(SQL_GRAVAR_POSICAO, posicao.linha_posicao(ativo_id))
+
+
+def recalcular_posicoes(cursor, ativos):
+    """
+    Reprocessa os ativos informados (usado após cargas em lote). `ativos` pode ser um dict
+    {ativo_id: menor data alterada} ou só os ids (reprocessa o histórico inteiro).
+    Não faz commit: roda na mesma transação de quem chamou.
+    """
+    desde = ativos if isinstance(ativos, dict) else dict.fromkeys(ativos)
+    for ativo_id, data in desde.items():
+        reprocessar_ativo(cursor, ativo_id, data)
+
+
+def preencher_posicoes(db: sqlite3.Connection) -> int:
+    """
+    Apaga e recalcula 'posicoes' e 'apuracao_mensal' do zero em uma passada. Retorna o número de ativos.
+    Não faz commit (as migrações chamam dentro da própria transação).
+    """
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM posicoes")
+    cursor.execute("DELETE FROM apuracao_mensal")
+
+    # Um cursor lê em streaming enquanto outro grava em lotes
+    leitura = db.execute(SQL_TRANSACOES_ORDENADAS.format(filtro=''))
+    posicoes, meses, total = [], [], 0
+    for ativo_id, posicao, meses_ativo in _processar(leitura):
+        posicoes.append(posicao.linha_posicao(ativo_id))
+        meses.extend(meses_ativo)
+        total += 1
+        if len(meses) >= TAMANHO_LOTE:
+            cursor.executemany(SQL_GRAVAR_POSICAO, posicoes)
+            cursor.executemany(SQL_GRAVAR_MES, meses)
+            posicoes.clear()
+            meses.clear()
+    cursor.executemany(SQL_GRAVAR_POSICAO, posicoes)
+    cursor.executemany(SQL_GRAVAR_MES, meses)
+    return total
+
+
+def reconstruir_posicoes(db: sqlite3.Connection) -> int:
+    total = preencher_posicoes(db)
+    db.commit()
+    return total
+
+
+def verificar_posicoes(db: sqlite3.Connection) -> list:
+    """Compara a tabela 'posicoes' com o recálculo completo e devolve as divergências encontradas."""
+    tabela = {
+        ativo_id: (quantidade, valor_investido)
+        for ativo_id, quantidade, valor_investido in db.execute("SELECT ativo_id, quantidade, valor_investido FROM posicoes")
+    }
+    reais = {
+        ativo_id: (posicao.quantidade, posicao.custo)
+        for ativo_id, posicao, _ in _processar(db.execute(SQL_TRANSACOES_ORDENADAS.format(filtro='')))
+    }
+
+    divergencias = []
+    for ativo_id in sorted(tabela.keys() | reais.keys()):
+        qtd_tabela, valor_tabela = tabela.get(ativo_id, (0.0, 0.0))
+        qtd_real, valor_real = reais.get(ativo_id, (0.0, 0.0))
+        if abs(qtd_tabela - qtd_real) > TOLERANCIA or abs(valor_tabela - valor_real) > TOLERANCIA:
+            divergencias.append({
+                "ativo_id": ativo_id,
+                "quantidade_tabela": qtd_tabela, "quantidade_real": qtd_real,
+                "valor_investido_tabela": valor_tabela, "valor_investido_real": valor_real,
+            })
+    return divergencias
+
+
+# Uso: python -m app.services.portfolio_engine [--verificar]
+if __name__ == '__main__':
+    with conexao() as db:
+        if '--verificar' in sys.argv:
+            divergencias = verificar_posicoes(db)
+            for d in divergencias:
+                print(f"❌ Ativo {d['ativo_id']}: quantidade {d['quantidade_tabela']} (esperado {d['quantidade_real']}), "
+                      f"investido {d['valor_investido_tabela']} (esperado {d['valor_investido_real']})")
+            if divergencias:
+                print(f"⚠️ {len(divergencias)} posição(ões) divergente(s). Rode sem --verificar para reconstruir.")
+                sys.exit(1)
+            print("✅ Tabela de posições confere com o histórico de transações.")
+        else:
+            total = reconstruir_posicoes(db)
+            print(f"✅ Posições reconstruídas: {total} ativo(s).")
@@ -1,45 +1,486 @@
-import yfinance as yf
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import nullcontext
+from dataclasses import dataclass, field, replace
+from datetime import date, timedelta
 
-def buscar_preco_acao(ticker: str) -> float:
+
+def _yfinance():
+    # OTIMIZAÇÃO: yfinance traz pandas, curl_cffi e bs4 (meio segundo de import e dezenas de MB por
+    # processo); só é carregado na primeira busca real, não no import do app ou dos scripts
+    import yfinance
+    return yfinance
+
+
+# --- PROVEDORES DE PREÇO ---
+# Qualquer objeto com o método buscar_lote(tickers) -> {ticker: preco} pode ser usado pelo motor.
+# Provedores que sabem de que pregão é cada preço implementam também
+# buscar_fechamentos(tickers) -> {ticker: (data_iso, preco)}, que o motor prefere (ver ResumoAtualizacao.datas).
+# Para a carga de histórico, o provedor também implementa
+# buscar_historico(tickers, inicio, fim) -> {ticker: [(data_iso, preco), ...]}.
+# Para os proventos anunciados: buscar_proventos(tickers, inicio, fim) -> {ticker: [(data_ex_iso, valor_por_cota), ...]}.
+# Provedores que não aceitam chamadas simultâneas expõem `trava` (uma RLock): buscar_precos a segura
+# só durante cada chamada ao provedor (nunca na espera entre as retentativas), e o prazo do lote só
+# começa a contar quando a primeira chamada dele consegue a trava.
+
+class ProvedorYahoo:
+    """Busca cotações da B3 no Yahoo Finance, várias por requisição."""
+
+    # O yf.download guarda o resultado em estado global, então duas chamadas simultâneas
+    # se atropelam. A concorrência fica dentro de cada chamada (threads=...).
+    trava = threading.RLock()
+
+    def __init__(self, timeout: float = 10.0, threads: int = 8):
+        self.timeout = timeout
+        self.threads = threads
+
+    def buscar_lote(self, tickers: list) -> dict:
+        return {ticker: preco for ticker, (_, preco) in self.buscar_fechamentos(tickers).items()}
+
+    def buscar_fechamentos(self, tickers: list) -> dict:
+        # O Yahoo Finance exige o sufixo '.SA' para ações brasileiras
+        simbolos = {f"{t.upper()}.SA": t for t in tickers}
+
+        with self.trava:
+            dados = _yfinance().download(
+                list(simbolos), period="5d", progress=False,
+                threads=min(self.threads, len(simbolos)), timeout=self.timeout
+            )
+
+        if dados is None or dados.empty:
+            return {}
+
+        # Último fechamento válido de cada ticker e o pregão dele (cobre feriados e dias sem negociação)
+        fechamentos = dados['Close']
+        resultado = {}
+        for simbolo, ticker in simbolos.items():
+            if simbolo not in fechamentos:
+                continue
+            serie = fechamentos[simbolo]
+            serie = serie[serie > 0]  # NaN também fica de fora
+            if not serie.empty:
+                resultado[ticker] = (serie.index[-1].strftime('%Y-%m-%d'), round(float(serie.iloc[-1]), 2))
+        return resultado
+
+    def buscar_historico(self, tickers: list, inicio: date, fim: date) -> dict:
+        simbolos = {f"{t.upper()}.SA": t for t in tickers}
+
+        with self.trava:
+            dados = _yfinance().download(
+                list(simbolos), start=inicio.isoformat(), end=(fim + timedelta(days=1)).isoformat(),
+                progress=False, threads=min(self.threads, len(simbolos)), timeout=self.timeout
+            )
+
+        if dados is None or dados.empty:
+            return {}
+
+        fechamentos = dados['Close']
+        datas = [d.strftime('%Y-%m-%d') for d in fechamentos.index]
+        historico = {}
+        for simbolo, ticker in simbolos.items():
+            if simbolo not in fechamentos:
+                continue
+            serie = [(d, round(float(p), 2)) for d, p in zip(datas, fechamentos[simbolo].to_numpy()) if p == p and p > 0]
+            if serie:
+                historico[ticker] = serie
+        return historico
+
+    def buscar_proventos(self, tickers: list, inicio: date, fim: date) -> dict:
+        simbolos = {f"{t.upper()}.SA": t for t in tickers}
+
+        with self.trava:
+            dados = _yfinance().download(
+                list(simbolos), start=inicio.isoformat(), end=(fim + timedelta(days=1)).isoformat(), actions=True,
+                progress=False, threads=min(self.threads, len(simbolos)), timeout=self.timeout
+            )
+
+        if dados is None or dados.empty or 'Dividends' not in dados:
+            return {}
+
+        # O Yahoo não separa dividendo de JCP: a coluna traz o valor por cota na data ex
+        dividendos = dados['Dividends']
+        datas = [d.strftime('%Y-%m-%d') for d in dividendos.index]
+        proventos = {}
+        for simbolo, ticker in simbolos.items():
+            if simbolo not in dividendos:
+                continue
+            eventos = [(d, round(float(v), 8)) for d, v in zip(datas, dividendos[simbolo].to_numpy()) if v == v and v > 0]
+            if eventos:
+                proventos[ticker] = eventos
+        return proventos
+
+
+class ProvedorFalso:
+    """Provedor local para testes e benchmarks: preços determinísticos com latência simulada."""
+
+    def __init__(self, latencia: float = 0.2, taxa_falha: float = 0.0, semente: int = 42):
+        self.latencia = latencia
+        self.taxa_falha = taxa_falha
+        self._aleatorio = random.Random(semente)
+        self._trava = threading.Lock()
+
+    def buscar_lote(self, tickers: list) -> dict:
+        return {ticker: preco for ticker, (_, preco) in self.buscar_fechamentos(tickers).items()}
+
+    def buscar_fechamentos(self, tickers: list) -> dict:
+        time.sleep(self.latencia)
+        # O último pregão é o dia útil mais recente (hoje, se for dia útil)
+        pregao = date.today()
+        while pregao.weekday() >= 5:
+            pregao -= timedelta(days=1)
+        fechamentos = {}
+        for ticker in tickers:
+            with self._trava:
+                falhou = self._aleatorio.random() < self.taxa_falha
+            if falhou or ticker.upper().startswith('TICKER_FALSO'):
+                continue
+            # Preço estável por ticker, entre R$ 5,00 e R$ 105,00
+            semente = int(hashlib.md5(ticker.upper().encode()).hexdigest()[:8], 16)
+            fechamentos[ticker] = (pregao.isoformat(), round(5 + (semente % 10000) / 100, 2))
+        return fechamentos
+
+    def buscar_historico(self, tickers: list, inicio: date, fim: date) -> dict:
+        time.sleep(self.latencia)
+        historico = {}
+        for ticker in tickers:
+            if ticker.upper().startswith('TICKER_FALSO'):
+                continue
+            # Passeio aleatório determinístico por ticker, apenas em dias úteis
+            semente = int(hashlib.md5(ticker.upper().encode()).hexdigest()[:8], 16)
+            aleatorio = random.Random(semente)
+            preco = 5 + (semente % 10000) / 100
+            serie = []
+            dia = inicio
+            while dia <= fim:
+                if dia.weekday() < 5:
+                    preco = max(0.5, preco * (1 + aleatorio.gauss(0, 0.015)))
+                    serie.append((dia.isoformat(), round(preco, 2)))
+                dia += timedelta(days=1)
+            historico[ticker] = serie
+        return historico
+
+    def buscar_proventos(self, tickers: list, inicio: date, fim: date) -> dict:
+        time.sleep(self.latencia)
+        proventos = {}
+        for ticker in tickers:
+            if ticker.upper().startswith('TICKER_FALSO'):
+                continue
+            # Um provento por trimestre, no dia 15, de cerca de 1,5% do preço base do ticker
+            semente = int(hashlib.md5(ticker.upper().encode()).hexdigest()[:8], 16)
+            valor = round((5 + (semente % 10000) / 100) * 0.015, 4)
+            eventos = []
+            ano, mes = inicio.year, inicio.month
+            while date(ano, mes, 15) <= fim:
+                if (mes + semente) % 3 == 0 and date(ano, mes, 15) >= inicio:
+                    eventos.append((date(ano, mes, 15).isoformat(), valor))
+                ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+            if eventos:
+                proventos[ticker] = eventos
+        return proventos
+
+
+# --- MOTOR DE ATUALIZAÇÃO ---
+
+@dataclass
+class ResumoAtualizacao:
+    """Resultado de uma rodada de busca de preços."""
+    precos: dict = field(default_factory=dict)
+    datas: dict = field(default_factory=dict)  # ticker -> pregão do preço, se o provedor informa (buscar_fechamentos)
+    falhas: dict = field(default_factory=dict)
+    lotes: int = 0
+    requisicoes: int = 0
+    tempo_total: float = 0.0
+
+    def __str__(self):
+        total = len(self.precos) + len(self.falhas)
+        return (f"{len(self.precos)}/{total} preços obtidos, {len(self.falhas)} falha(s), "
+                f"{self.lotes} lote(s), {self.requisicoes} requisição(ões) em {self.tempo_total:.2f}s")
+
+
+def _buscar_lote_com_retentativa(provedor, lote: list, tentativas: int, espera_inicial: float,
+                                 trava=None, comecar=None):
     """
-    Busca o preço de fechamento mais recente de uma ação na B3.
-    O ticker deve ser o padrão da B3 (ex: PETR4, VALE3, KNCR11).
+    Busca um lote e repete apenas os tickers que faltaram, com espera exponencial entre as tentativas.
+    `trava` (a do provedor) é segurada só durante cada chamada: na espera, outros lotes usam o provedor.
+    `comecar` é chamada já com a trava, antes da primeira chamada, e devolve o prazo do lote
+    (perf_counter), ou None se o lote nem deve começar. Sem prazo para uma nova tentativa, o lote para.
     """
-    # O Yahoo Finance exige o sufixo '.SA' para ações brasileiras
-    ticker_yf = f"{ticker.upper()}.SA"
-    
+    precos = {}
+    datas = {}
+    falhas = {}
+    requisicoes = 0
+    pendentes = list(lote)
+    prazo = float('inf')
+    buscar_fechamentos = getattr(provedor, 'buscar_fechamentos', None)
+
+    for tentativa in range(tentativas):
+        if tentativa > 0:
+            # Backoff exponencial com jitter para não martelar o provedor
+            espera = espera_inicial * (2 ** (tentativa - 1)) * (1 + random.random() / 2)
+            if time.perf_counter() + espera >= prazo:
+                break
+            time.sleep(espera)
+        try:
+            with trava or nullcontext():
+                if tentativa == 0 and comecar is not None:
+                    prazo = comecar()
+                    if prazo is None:
+                        return {}, {}, {t: "timeout" for t in lote}, 0
+                requisicoes += 1
+                if buscar_fechamentos is not None:
+                    fechamentos = buscar_fechamentos(pendentes)
+                    obtidos = {ticker: preco for ticker, (_, preco) in fechamentos.items()}
+                    datas.update((ticker, data) for ticker, (data, _) in fechamentos.items())
+                else:
+                    obtidos = provedor.buscar_lote(pendentes)
+        except Exception as e:
+            for ticker in pendentes:
+                falhas[ticker] = str(e)
+            continue
+
+        precos.update(obtidos)
+        pendentes = [t for t in pendentes if t not in obtidos]
+        for ticker in obtidos:
+            falhas.pop(ticker, None)
+        for ticker in pendentes:
+            falhas.setdefault(ticker, "sem dados do provedor")
+        if not pendentes:
+            break
+
+    return precos, datas, falhas, requisicoes
+
+
+def buscar_precos(
+    tickers: list,
+    provedor=None,
+    tamanho_lote: int = 50,
+    max_workers: int = 4,
+    timeout: float = 30.0,
+    tentativas: int = 3,
+    espera_inicial: float = 1.0,
+) -> ResumoAtualizacao:
+    """
+    Busca o preço de vários tickers em lotes, com um pool limitado de threads.
+    O timeout vale para cada lote (com as retentativas), contado de quando o lote começa a ser buscado:
+    com um provedor serializado (que tem `trava`, como o Yahoo), só depois de conseguir a trava, então
+    esperar na fila não consome o prazo. Tickers de um lote que estourar o prazo são marcados como falha.
+    A trava só é segurada durante cada chamada ao provedor: enquanto um lote espera para tentar de novo,
+    os outros lotes do pool buscam.
+    A rodada inteira tem no máximo timeout × levas: levas de max_workers lotes, ou de um lote só quando o
+    provedor é serializado; lotes que nem começaram até lá também viram timeout.
+    """
+    provedor = provedor or ProvedorYahoo()
+    inicio = time.perf_counter()
+    resumo = ResumoAtualizacao()
+
+    tickers = list(dict.fromkeys(t.upper() for t in tickers))  # remove duplicados mantendo a ordem
+    lotes = [tickers[i:i + tamanho_lote] for i in range(0, len(tickers), tamanho_lote)]
+    resumo.lotes = len(lotes)
+    if not lotes:
+        return resumo
+
+    # Um provedor serializado busca um lote por vez, não importa quantas threads estejam esperando
+    trava = getattr(provedor, 'trava', None)
+    levas = -(-len(lotes) // (1 if trava is not None else max_workers))
+    prazo_rodada = inicio + timeout * levas
+    inicios = [None] * len(lotes)
+    comecou = [threading.Event() for _ in lotes]
+
+    def buscar(indice: int, lote: list):
+        def comecar():
+            agora = time.perf_counter()
+            if agora >= prazo_rodada:
+                return None  # A rodada já terminou: não chama o provedor
+            inicios[indice] = agora
+            comecou[indice].set()
+            return agora + timeout
+        return _buscar_lote_com_retentativa(provedor, lote, tentativas, espera_inicial, trava, comecar)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="precos")
     try:
-        # Cria o objeto do ticker
-        ativo = yf.Ticker(ticker_yf)
-        
-        # Busca o histórico do último dia de negociação ('1d')
-        dados = ativo.history(period="1d")
-        
-        # Verifica se retornou vazio (ticker inválido ou erro na API)
-        if dados.empty:
-            print(f"⚠️ Aviso: Nenhum dado encontrado para o ticker '{ticker}'. Verifique se ele existe.")
-            return None
-            
-        # Pega o preço da coluna 'Close' (Fechamento) da primeira linha retornada
-        preco_atual = dados['Close'].iloc[0]
-        
-        # Retorna arredondado para 2 casas decimais
-        return round(preco_atual, 2)
-        
-    except Exception as e:
-        print(f"❌ Erro ao buscar preço para '{ticker}': {e}")
+        futuros = [(lote, executor.submit(buscar, indice, lote)) for indice, lote in enumerate(lotes)]
+        for indice, (lote, futuro) in enumerate(futuros):
+            try:
+                # Primeiro espera o lote começar (fila de threads ou trava do provedor), depois o prazo dele
+                if not comecou[indice].wait(max(0.0, prazo_rodada - time.perf_counter())):
+                    raise FuturesTimeoutError()
+                precos, datas, falhas, requisicoes = futuro.result(
+                    timeout=max(0.0, inicios[indice] + timeout - time.perf_counter())
+                )
+            except FuturesTimeoutError:
+                resumo.falhas.update({t: "timeout" for t in lote})
+                continue
+            except Exception as e:
+                resumo.falhas.update({t: str(e) for t in lote})
+                continue
+            resumo.precos.update(precos)
+            resumo.datas.update(datas)
+            resumo.falhas.update(falhas)
+            resumo.requisicoes += requisicoes
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    resumo.tempo_total = time.perf_counter() - inicio
+    return resumo
+
+
+# --- CACHE DE COTAÇÕES ---
+# Validade de uma cotação em cache (segundos)
+TTL_COTACAO = float(os.environ.get('MASTERFY_COTACAO_TTL', 60))
+
+
+@dataclass
+class Cotacao:
+    preco: float
+    obtida_em: float            # time.time() da busca no provedor
+    desatualizada: bool = False  # True quando o provedor falhou e a cotação antiga foi servida
+
+
+class CacheCotacoes:
+    """
+    Cotações por ticker com validade (TTL).
+    - Tickers pedidos ao mesmo tempo por várias threads geram uma única busca no provedor
+      (quem chega depois espera o resultado de quem já está buscando).
+    - Se o provedor falhar, a última cotação conhecida continua sendo servida, marcada como desatualizada.
+    """
+
+    def __init__(self, provedor=None, ttl: float = TTL_COTACAO, **opcoes_busca):
+        self.provedor = provedor
+        self.ttl = ttl
+        self.opcoes_busca = opcoes_busca
+        self._cotacoes = {}
+        self._em_voo = {}  # ticker -> Event de quem está buscando agora
+        self._trava = threading.Lock()
+
+        # Métricas
+        self.acertos = 0
+        self.falhas = 0
+        self.buscas = 0
+        self.desatualizadas = 0
+
+    def obter(self, tickers: list) -> dict:
+        """Devolve {ticker: Cotacao} para os tickers com cotação (nova ou antiga); os demais ficam de fora."""
+        tickers = list(dict.fromkeys(t.upper() for t in tickers))
+        agora = time.time()
+        resultado = {}
+        esperar = {}
+        buscar = []
+
+        with self._trava:
+            for ticker in tickers:
+                cotacao = self._cotacoes.get(ticker)
+                if cotacao and agora - cotacao.obtida_em < self.ttl:
+                    resultado[ticker] = cotacao
+                    self.acertos += 1
+                    continue
+                self.falhas += 1
+                voo = self._em_voo.get(ticker)
+                if voo is None:
+                    voo = self._em_voo[ticker] = threading.Event()
+                    buscar.append(ticker)
+                esperar[ticker] = voo
+
+        # Esta thread busca, numa só chamada, os tickers que ninguém estava buscando
+        if buscar:
+            try:
+                resumo = buscar_precos(buscar, provedor=self.provedor, **self.opcoes_busca)
+                precos = resumo.precos
+            except Exception as e:
+                print(f"⚠️ Aviso: Falha ao buscar cotações ({e}); servindo as últimas conhecidas.")
+                precos = {}
+            finally:
+                obtida_em = time.time()
+                with self._trava:
+                    self.buscas += 1
+                    for ticker in buscar:
+                        if ticker in precos:
+                            self._cotacoes[ticker] = Cotacao(precos[ticker], obtida_em)
+                        self._em_voo.pop(ticker).set()
+
+        for ticker, voo in esperar.items():
+            voo.wait()
+            with self._trava:
+                cotacao = self._cotacoes.get(ticker)
+                if cotacao is None:
+                    continue
+                if agora - cotacao.obtida_em >= self.ttl:
+                    # A busca não trouxe preço novo: fica a cotação antiga, avisando que está velha
+                    cotacao = replace(cotacao, desatualizada=True)
+                    self.desatualizadas += 1
+            resultado[ticker] = cotacao
+        return resultado
+
+    def estatisticas(self) -> dict:
+        with self._trava:
+            return {
+                "tickers": len(self._cotacoes),
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "buscas": self.buscas,
+                "desatualizadas": self.desatualizadas,
+            }
+
+
+_caches_cotacoes = weakref.WeakKeyDictionary()
+_cache_padrao = None
+_trava_caches = threading.Lock()
+
+
+def cache_cotacoes(provedor=None) -> CacheCotacoes:
+    """Cache de cotações compartilhado por provedor (o padrão usa o Yahoo Finance)."""
+    global _cache_padrao
+    with _trava_caches:
+        if provedor is None:
+            if _cache_padrao is None:
+                _cache_padrao = CacheCotacoes()
+            return _cache_padrao
+        cache = _caches_cotacoes.get(provedor)
+        if cache is None:
+            cache = _caches_cotacoes[provedor] = CacheCotacoes(provedor)
+        return cache
+
+
+def buscar_preco_acao(ticker: str, provedor=None) -> float:
+    """
+    Busca o preço mais recente de uma ação na B3 (passando pelo cache de cotações).
+    O ticker deve ser o padrão da B3 (ex: PETR4, VALE3, KNCR11).
+    """
+    cotacao = cache_cotacoes(provedor).obter([ticker]).get(ticker.upper())
+    if cotacao is None:
+        print(f"⚠️ Aviso: Nenhum dado encontrado para o ticker '{ticker}'. Verifique se ele existe.")
         return None
+    return cotacao.preco
+
 
 # Bloco de teste: só roda se você executar este arquivo diretamente
+# Uso: python -m app.services.price_engine [--falso N]  (benchmark offline com N tickers)
 if __name__ == '__main__':
+    if '--falso' in sys.argv:
+        quantidade = int(sys.argv[sys.argv.index('--falso') + 1])
+        tickers = [f"TST{i:04d}" for i in range(quantidade)]
+        provedor = ProvedorFalso(latencia=0.2, taxa_falha=0.05)
+        print(f"Benchmark offline com {quantidade} tickers (latência simulada de 0.2s por requisição)...\n")
+        for workers in (1, 4, 8):
+            resumo = buscar_precos(tickers, provedor=provedor, max_workers=workers, espera_inicial=0.1)
+            print(f"max_workers={workers}: {resumo}")
+        sys.exit(0)
+
     print("Iniciando motor de preços...\n")
-    
+
     # Vamos testar com uma Ação e um FII
     ativos_para_testar = ["PETR4", "KNCR11", "TICKER_FALSO"]
-    
+
+    resumo = buscar_precos(ativos_para_testar)
     for ativo in ativos_para_testar:
-        preco = buscar_preco_acao(ativo)
+        preco = resumo.precos.get(ativo)
         if preco is not None:
             print(f"✅ {ativo}: R$ {preco}")
         else:
-            print(f"❌ {ativo}: Falha na busca.")
+            print(f"❌ {ativo}: Falha na busca ({resumo.falhas.get(ativo)}).")
+    print(f"\n{resumo}")
@@ -0,0 +1,344 @@
+import os
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from app import carteiras
+from app.cache import chave_ativo, CHAVE_PROVENTOS
+from app.database import ID_CARTEIRA_PRINCIPAL, incrementar_versao_dados
+from app.services.price_engine import ProvedorYahoo
+
+# --- ANÁLISE DE PROVENTOS ---
+# Renda por período, dividend yield e yield on cost dos últimos 12 meses e projeção de renda,
+# calculados no SQLite com agregações e funções de janela (índice idx_proventos_carteira_data).
+# O valor por cota vem dos proventos anunciados (importados do provedor); sem anúncios de um ticker,
+# o valor recebido pela carteira nos últimos 12 meses é usado como aproximação.
+
+# Com MASTERFY_PROVENTOS_LANCAR=1 o job também lança nas carteiras os anúncios já pagos
+# (desligado por padrão: quem lança à mão ou importa o extrato da B3 teria o provento em dobro)
+LANCAR_AUTOMATICO = os.environ.get('MASTERFY_PROVENTOS_LANCAR', '0') == '1'
+
+# Provedores não separam dividendo de JCP: os anúncios importados entram com este tipo
+TIPO_ANUNCIADO = 'Dividendo'
+
+GRUPOS = {
+    'ativo': "a.ticker",
+    'setor': "COALESCE(a.setor, 'Outros')",
+    'tipo': "COALESCE(NULLIF(p.tipo, ''), 'Outros')",
+}
+# Período do lançamento e seu número de ordem (meses ou anos) para a janela móvel de 12 meses
+PERIODOS = {
+    'mes': ("substr(p.data, 1, 7)", "CAST(substr(p.data, 1, 4) AS INTEGER) * 12 + CAST(substr(p.data, 6, 2) AS INTEGER)", 11),
+    'ano': ("substr(p.data, 1, 4)", "CAST(substr(p.data, 1, 4) AS INTEGER)", 0),
+}
+
+SQL_UPSERT_ANUNCIO = """
+    INSERT INTO proventos_anunciados (ticker, data_ex, tipo, valor_por_cota) VALUES (?, ?, ?, ?)
+    ON CONFLICT (ticker, data_ex, tipo) DO UPDATE
+    SET valor_por_cota = excluded.valor_por_cota, atualizado_em = datetime('now')
+    WHERE valor_por_cota != excluded.valor_por_cota
+"""
+
+# Anúncios já pagos viram proventos da carteira: quantidade na véspera da data ex × valor por cota.
+# O índice único (ativo_id, anuncio_id) faz o mesmo anúncio ser ignorado nas próximas vezes.
+SQL_LANCAR_ANUNCIADOS = """
+    INSERT INTO proventos (carteira_id, ativo_id, data, tipo, valor, anuncio_id)
+    SELECT carteira_id, ativo_id, data, tipo, ROUND(valor_por_cota * quantidade, 2), anuncio_id
+    FROM (
+        SELECT a.carteira_id, a.id AS ativo_id, COALESCE(an.data_pagamento, an.data_ex) AS data, an.tipo,
+               an.valor_por_cota, an.id AS anuncio_id,
+               (SELECT TOTAL(CASE t.tipo_transacao WHEN 'COMPRA' THEN t.quantidade ELSE -t.quantidade END)
+                FROM transacoes t WHERE t.ativo_id = a.id AND t.data < an.data_ex) AS quantidade
+        FROM ativos a
+        JOIN proventos_anunciados an ON an.ticker = a.ticker
+        WHERE a.carteira_id = :carteira AND COALESCE(an.data_pagamento, an.data_ex) <= :hoje
+    )
+    WHERE quantidade > 0
+    ON CONFLICT DO NOTHING
+    RETURNING ativo_id
+"""
+
+SQL_RENDIMENTO_12M = """
+    WITH posicao AS (
+        SELECT a.id AS ativo_id, a.ticker, COALESCE(a.setor, 'Outros') AS setor, p.quantidade, p.preco_medio,
+               COALESCE((SELECT h.preco FROM historico_precos h WHERE h.ativo_id = a.id AND h.data <= :hoje
+                         ORDER BY h.data DESC LIMIT 1), a.preco_atual, 0.0) AS preco
+        FROM posicoes p
+        JOIN ativos a ON a.id = p.ativo_id
+        WHERE a.carteira_id = :carteira AND p.quantidade > 0
+    ),
+    recebido AS (
+        SELECT ativo_id, SUM(valor) AS valor FROM proventos
+        WHERE carteira_id = :carteira AND data > date(:hoje, '-12 months') AND data <= :hoje
+        GROUP BY ativo_id
+    ),
+    anunciado AS (
+        SELECT ticker, SUM(valor_por_cota) AS por_cota FROM proventos_anunciados
+        WHERE data_ex > date(:hoje, '-12 months') AND data_ex <= :hoje
+        GROUP BY ticker
+    ),
+    rendimento AS (
+        SELECT po.*, COALESCE(r.valor, 0.0) AS recebido_12m,
+               COALESCE(an.por_cota, r.valor / po.quantidade, 0.0) AS por_cota_12m,
+               an.por_cota IS NOT NULL AS com_anuncios
+        FROM posicao po
+        LEFT JOIN recebido r ON r.ativo_id = po.ativo_id
+        LEFT JOIN anunciado an ON an.ticker = po.ticker
+    )
+    SELECT ativo_id, ticker, setor, quantidade, preco_medio, preco, recebido_12m, por_cota_12m, com_anuncios,
+           por_cota_12m / NULLIF(preco, 0) AS dividend_yield,
+           por_cota_12m / NULLIF(preco_medio, 0) AS yield_on_cost,
+           -- Totais da carteira (ponderados pela posição) em cada linha, sem segunda consulta
+           SUM(por_cota_12m * quantidade) OVER () / NULLIF(SUM(preco * quantidade) OVER (), 0) AS dividend_yield_carteira,
+           SUM(por_cota_12m * quantidade) OVER () / NULLIF(SUM(preco_medio * quantidade) OVER (), 0) AS yield_on_cost_carteira,
+           SUM(por_cota_12m * quantidade) OVER () AS renda_12m_carteira
+    FROM rendimento
+    ORDER BY dividend_yield DESC
+"""
+
+# Dividend yield de 12 meses, mês a mês: fechamento do mês (último pregão) contra a soma móvel dos anúncios
+SQL_SERIE_YIELD = """
+    WITH fechamentos AS (
+        SELECT substr(data, 1, 7) AS mes, preco,
+               ROW_NUMBER() OVER (PARTITION BY substr(data, 1, 7) ORDER BY data DESC) AS ordem
+        FROM historico_precos
+        WHERE ativo_id = :ativo AND data >= :inicio
+    ),
+    meses AS (
+        SELECT mes, preco, NULL AS por_cota FROM fechamentos WHERE ordem = 1
+        UNION ALL
+        SELECT substr(data_ex, 1, 7), NULL, valor_por_cota FROM proventos_anunciados
+        WHERE ticker = :ticker AND data_ex >= date(:inicio, '-12 months')
+    ),
+    por_mes AS (
+        SELECT mes, MAX(preco) AS preco, TOTAL(por_cota) AS por_cota,
+               SUM(TOTAL(por_cota)) OVER (
+                   ORDER BY CAST(substr(mes, 1, 4) AS INTEGER) * 12 + CAST(substr(mes, 6, 2) AS INTEGER)
+                   RANGE BETWEEN 11 PRECEDING AND CURRENT ROW
+               ) AS por_cota_12m
+        FROM meses
+        GROUP BY mes
+    )
+    SELECT mes, preco, por_cota, por_cota_12m, por_cota_12m / NULLIF(preco, 0) AS dividend_yield
+    FROM por_mes
+    WHERE preco IS NOT NULL
+    ORDER BY mes
+"""
+
+# Estimativas de proventos futuros por ativo e mês (usadas pela projeção)
+SQL_ESTIMATIVAS = """
+    WITH RECURSIVE calendario (n, mes) AS (
+        SELECT 1, strftime('%Y-%m', :hoje, 'start of month', '+1 month')
+        UNION ALL
+        SELECT n + 1, strftime('%Y-%m', mes || '-01', '+1 month') FROM calendario WHERE n < :meses
+    ),
+    posicao AS (
+        SELECT a.id AS ativo_id, a.ticker, p.quantidade
+        FROM posicoes p
+        JOIN ativos a ON a.id = p.ativo_id
+        WHERE a.carteira_id = :carteira AND p.quantidade > 0
+    ),
+    estimativas AS (
+        -- Já anunciados e ainda não pagos: valor por cota conhecido
+        SELECT po.ativo_id, strftime('%Y-%m', COALESCE(an.data_pagamento, an.data_ex)) AS mes,
+               an.valor_por_cota * po.quantidade AS valor, 'anunciado' AS origem
+        FROM posicao po
+        JOIN proventos_anunciados an ON an.ticker = po.ticker
+        WHERE COALESCE(an.data_pagamento, an.data_ex) > :hoje
+        UNION ALL
+        -- Sazonalidade: os anúncios dos últimos 12 meses se repetem um ano depois, com a quantidade atual
+        SELECT po.ativo_id, strftime('%Y-%m', COALESCE(an.data_pagamento, an.data_ex), '+12 months'),
+               an.valor_por_cota * po.quantidade, 'historico'
+        FROM posicao po
+        JOIN proventos_anunciados an ON an.ticker = po.ticker
+        WHERE an.data_ex > date(:hoje, '-12 months') AND an.data_ex <= :hoje
+        UNION ALL
+        -- Ativos sem anúncios importados: repete o que a carteira recebeu há um ano
+        SELECT pr.ativo_id, strftime('%Y-%m', pr.data, '+12 months'), pr.valor, 'recebido'
+        FROM proventos pr
+        JOIN posicao po ON po.ativo_id = pr.ativo_id
+        WHERE pr.carteira_id = :carteira AND pr.data > date(:hoje, '-12 months') AND pr.data <= :hoje
+          AND NOT EXISTS (SELECT 1 FROM proventos_anunciados an WHERE an.ticker = po.ticker)
+    ),
+    validas AS (
+        -- Um anúncio conhecido substitui a estimativa sazonal do mesmo ativo no mesmo mês
+        SELECT e.* FROM estimativas e
+        JOIN calendario c ON c.mes = e.mes
+        WHERE e.origem != 'historico' OR NOT EXISTS (
+            SELECT 1 FROM estimativas k WHERE k.origem = 'anunciado' AND k.ativo_id = e.ativo_id AND k.mes = e.mes
+        )
+    )
+"""
+
+SQL_PROJECAO_MESES = SQL_ESTIMATIVAS + """
+    SELECT c.mes, TOTAL(v.valor) AS valor,
+           TOTAL(CASE WHEN v.origem = 'anunciado' THEN v.valor END) AS anunciado,
+           SUM(TOTAL(v.valor)) OVER (ORDER BY c.mes) AS acumulado
+    FROM calendario c
+    LEFT JOIN validas v ON v.mes = c.mes
+    GROUP BY c.mes
+    ORDER BY c.mes
+"""
+
+SQL_PROJECAO_ATIVOS = SQL_ESTIMATIVAS + """
+    SELECT a.id AS ativo_id, a.ticker, SUM(v.valor) AS valor,
+           SUM(v.valor) / SUM(SUM(v.valor)) OVER () AS participacao
+    FROM validas v
+    JOIN ativos a ON a.id = v.ativo_id
+    GROUP BY a.id
+    ORDER BY valor DESC
+"""
+
+
+def _linhas(db: sqlite3.Connection, sql: str, parametros) -> list:
+    return [dict(linha) for linha in db.execute(sql, parametros)]
+
+
+def renda_por_periodo(db: sqlite3.Connection, carteira_id: int = ID_CARTEIRA_PRINCIPAL, periodo: str = 'mes',
+                      grupo: str = 'ativo', inicio: str = None, fim: str = None) -> list:
+    """
+    Renda recebida por mês ou ano e por ativo, setor ou tipo, com o acumulado do grupo, a participação
+    do grupo no período e a renda móvel de 12 meses (funções de janela).
+    """
+    if periodo not in PERIODOS:
+        raise ValueError(f"Período inválido: use {', '.join(PERIODOS)}")
+    if grupo not in GRUPOS:
+        raise ValueError(f"Agrupamento inválido: use {', '.join(GRUPOS)}")
+    expressao_periodo, ordinal, janela = PERIODOS[periodo]
+    return _linhas(db, f"""
+        WITH renda AS (
+            SELECT {expressao_periodo} AS periodo, {ordinal} AS ordinal, {GRUPOS[grupo]} AS grupo,
+                   SUM(p.valor) AS valor, COUNT(*) AS lancamentos
+            FROM proventos p
+            JOIN ativos a ON a.id = p.ativo_id
+            WHERE p.carteira_id = ? AND p.data BETWEEN ? AND ?
+            GROUP BY 1, 3
+        )
+        SELECT periodo, grupo, ROUND(valor, 2) AS valor, lancamentos,
+               ROUND(SUM(valor) OVER (PARTITION BY grupo ORDER BY ordinal), 2) AS acumulado,
+               ROUND(SUM(valor) OVER (PARTITION BY grupo ORDER BY ordinal
+                                      RANGE BETWEEN {janela} PRECEDING AND CURRENT ROW), 2) AS renda_12m,
+               ROUND(valor / SUM(valor) OVER (PARTITION BY periodo), 4) AS participacao
+        FROM renda
+        ORDER BY periodo, valor DESC
+    """, (carteira_id, inicio or '0000-01-01', fim or '9999-12-31'))
+
+
+def rendimento_12m(db: sqlite3.Connection, carteira_id: int = ID_CARTEIRA_PRINCIPAL, hoje: date = None) -> dict:
+    """Dividend yield (sobre o último fechamento) e yield on cost (sobre o preço médio) dos últimos 12 meses."""
+    linhas = _linhas(db, SQL_RENDIMENTO_12M, {"carteira": carteira_id, "hoje": (hoje or date.today()).isoformat()})
+    totais = linhas[0] if linhas else {}
+    campos_carteira = ('dividend_yield_carteira', 'yield_on_cost_carteira', 'renda_12m_carteira')
+    return {
+        "carteira": {
+            "dividend_yield": totais.get('dividend_yield_carteira'),
+            "yield_on_cost": totais.get('yield_on_cost_carteira'),
+            "renda_12m": round(totais.get('renda_12m_carteira') or 0.0, 2),
+        },
+        "ativos": [
+            {**{k: v for k, v in linha.items() if k not in campos_carteira}, "com_anuncios": bool(linha['com_anuncios'])}
+            for linha in linhas
+        ],
+    }
+
+
+def serie_yield(db: sqlite3.Connection, ativo_id: int, ticker: str, anos: int = 5, hoje: date = None) -> list:
+    """Dividend yield de 12 meses ao fim de cada mês, a partir do histórico de preços e dos anúncios."""
+    inicio = (hoje or date.today()).replace(day=1) - timedelta(days=365 * anos)
+    return _linhas(db, SQL_SERIE_YIELD, {"ativo": ativo_id, "ticker": ticker.upper(), "inicio": inicio.isoformat()})
+
+
+def projetar_renda(db: sqlite3.Connection, carteira_id: int = ID_CARTEIRA_PRINCIPAL, meses: int = 12,
+                   hoje: date = None) -> dict:
+    """
+    Renda esperada nos próximos `meses`: anúncios ainda não pagos, mais a repetição sazonal dos
+    últimos 12 meses com a posição atual.
+    """
+    parametros = {"carteira": carteira_id, "hoje": (hoje or date.today()).isoformat(), "meses": meses}
+    por_mes = _linhas(db, SQL_PROJECAO_MESES, parametros)
+    return {
+        "total": round(por_mes[-1]['acumulado'], 2) if por_mes else 0.0,
+        "meses": [{**linha, "valor": round(linha['valor'], 2), "anunciado": round(linha['anunciado'], 2),
+                   "acumulado": round(linha['acumulado'], 2)} for linha in por_mes],
+        "ativos": _linhas(db, SQL_PROJECAO_ATIVOS, parametros),
+    }
+
+
+def lancar_anunciados(db: sqlite3.Connection, carteira_id: int = ID_CARTEIRA_PRINCIPAL, hoje: date = None) -> list:
+    """Lança na carteira os anúncios já pagos que ainda não foram lançados. Devolve os ativos afetados (sem commit)."""
+    cursor = db.execute(SQL_LANCAR_ANUNCIADOS, {"carteira": carteira_id, "hoje": (hoje or date.today()).isoformat()})
+    return [linha[0] for linha in cursor.fetchall()]
+
+
+def importar_anunciados(anos: int = 2, provedor=None, tamanho_lote: int = 20) -> int:
+    """
+    Job: importa do provedor os proventos anunciados de todos os tickers das carteiras.
+    A chave (ticker, data_ex, tipo) deduplica; anúncios já gravados só mudam se o valor mudou.
+    """
+    provedor = provedor or ProvedorYahoo(timeout=30)
+    hoje = date.today()
+    # Alguns anúncios já chegam com a data ex dos próximos meses
+    inicio, fim = hoje - timedelta(days=365 * anos), hoje + timedelta(days=120)
+    inicio_carga = time.perf_counter()
+
+    # O mesmo ticker em várias carteiras (e bancos) é buscado uma vez só
+    bancos_por_ticker = defaultdict(set)
+    for db_path in carteiras.bancos():
+        with carteiras.conexao_banco(db_path) as db:
+            for (ticker,) in db.execute("SELECT DISTINCT ticker FROM ativos"):
+                bancos_por_ticker[ticker.upper()].add(db_path)
+    tickers = list(bancos_por_ticker)
+
+    total = 0
+    for i in range(0, len(tickers), tamanho_lote):
+        lote = tickers[i:i + tamanho_lote]
+        try:
+            proventos = provedor.buscar_proventos(lote, inicio, fim)
+        except Exception as e:
+            print(f"❌ Erro ao buscar proventos de {', '.join(lote)}: {e}")
+            continue
+
+        linhas = defaultdict(list)  # db_path -> linhas
+        for ticker, eventos in proventos.items():
+            for db_path in bancos_por_ticker[ticker.upper()]:
+                linhas[db_path].extend((ticker.upper(), data_ex, TIPO_ANUNCIADO, valor) for data_ex, valor in eventos)
+        for db_path, linhas_banco in linhas.items():
+            with carteiras.conexao_banco(db_path) as db:
+                antes = db.total_changes
+                db.executemany(SQL_UPSERT_ANUNCIO, linhas_banco)
+                total += db.total_changes - antes  # Anúncios repetidos e sem mudança não contam
+                db.commit()
+
+    lancados = _lancar_em_todas() if LANCAR_AUTOMATICO else 0
+    print(f"✅ Proventos anunciados: {total} registro(s) novo(s) ou alterado(s) de {len(tickers)} ticker(s), "
+          f"{lancados} lançado(s) nas carteiras em {time.perf_counter() - inicio_carga:.2f}s")
+    return total
+
+
+def _lancar_em_todas() -> int:
+    lancados = 0
+    for db_path in carteiras.bancos():
+        with carteiras.conexao_banco(db_path) as db:
+            por_carteira = {
+                carteira_id: lancar_anunciados(db, carteira_id)
+                for (carteira_id,) in db.execute("SELECT id FROM carteiras").fetchall()
+            }
+            if any(por_carteira.values()):
+                # Os processos web percebem a gravação pela versão dos dados deste banco
+                incrementar_versao_dados(db.cursor())
+            db.commit()
+        for carteira_id, ativos in por_carteira.items():
+            if ativos:
+                carteiras.invalidar(db_path, carteira_id, CHAVE_PROVENTOS, *map(chave_ativo, set(ativos)))
+            lancados += len(ativos)
+    return lancados
+
+
+# Uso: python -m app.services.proventos_engine [--anos N]
+if __name__ == '__main__':
+    from app.migracoes import migrar
+    migrar()
+    anos = int(sys.argv[sys.argv.index('--anos') + 1]) if '--anos' in sys.argv else 2
+    importar_anunciados(anos=anos)
@@ -0,0 +1,251 @@
+import sqlite3
+
+import numpy as np
+
+from app.database import ID_CARTEIRA_PRINCIPAL
+
+# --- REBALANCEAMENTO POR APORTE ---
+# Metas de alocação (percentual da carteira) por ativo, setor ou tipo e a lista de compras, em lotes
+# inteiros, que mais aproxima a carteira das metas usando só o dinheiro do aporte (nada é vendido).
+# As posições e preços ficam num vetor NumPy em cache (derivado de CHAVE_PORTFOLIO), então cada
+# simulação — outro valor de aporte, choque de preços — é só aritmética sobre arrays.
+
+NIVEIS = ('ativo', 'setor', 'tipo')
+
+# Limite de passadas que gastam a sobra do arredondamento em lotes avulsos
+PASSADAS_SOBRA = 4
+
+SQL_VETOR = """
+    SELECT a.id, a.ticker, COALESCE(a.setor, 'Outros'), a.tipo,
+           COALESCE(p.quantidade, 0), a.preco_atual, COALESCE(p.preco_medio, 0)
+    FROM ativos a
+    LEFT JOIN posicoes p ON p.ativo_id = a.id
+    WHERE a.carteira_id = ?
+    ORDER BY a.id
+"""
+
+
+class VetorCarteira:
+    """Posições e preços de todos os ativos de uma carteira em arrays paralelos (um índice por ativo)."""
+
+    def __init__(self, linhas: list):
+        colunas = list(zip(*linhas)) or [()] * 7
+        self.ativo_id = np.array(colunas[0], dtype=np.int64)
+        self.ticker = np.array(colunas[1], dtype=object)
+        self.quantidade = np.maximum(np.array(colunas[4], dtype=float), 0.0)
+        preco_atual = np.array(colunas[5], dtype=float)
+        # Como no portfolio: sem cotação (ativo novo) vale o preço médio, ou seja, o valor investido
+        self.preco = np.where(preco_atual > 0, preco_atual, np.array(colunas[6], dtype=float))
+        self.indice_ticker = {ticker: i for i, ticker in enumerate(self.ticker)}
+        # Grupos de cada nível: chaves distintas e o código do grupo de cada ativo (para bincount)
+        self.grupos = {'ativo': (self.ticker, np.arange(self.ticker.size))}
+        for nivel, coluna in (('setor', colunas[2]), ('tipo', colunas[3])):
+            chaves, codigos = np.unique(np.array(coluna, dtype=str), return_inverse=True)
+            self.grupos[nivel] = (chaves.astype(object), codigos)
+
+
+def carregar_vetor(db: sqlite3.Connection, carteira_id: int = ID_CARTEIRA_PRINCIPAL) -> VetorCarteira:
+    cursor = db.cursor()
+    cursor.row_factory = None
+    return VetorCarteira(cursor.execute(SQL_VETOR, (carteira_id,)).fetchall())
+
+
+def carregar_metas(db: sqlite3.Connection, carteira_id: int = ID_CARTEIRA_PRINCIPAL) -> list:
+    return [dict(linha) for linha in db.execute(
+        "SELECT id, nivel, chave, percentual FROM metas_alocacao WHERE carteira_id = ? ORDER BY nivel, chave",
+        (carteira_id,)
+    )]
+
+
+def normalizar_chave(nivel: str, chave: str) -> str:
+    chave = (chave or '').strip()
+    # Tickers e tipos são gravados em maiúsculas pelas rotas de ativos; setor fica como foi digitado
+    return chave if nivel == 'setor' else chave.upper()
+
+
+def gravar_meta(db: sqlite3.Connection, carteira_id: int, nivel: str, chave: str, percentual: float) -> int:
+    """Cria ou atualiza a meta (sem commit). A soma das metas de um nível não pode passar de 100%."""
+    if nivel not in NIVEIS:
+        raise ValueError(f"Nível inválido: '{nivel}' (use {', '.join(NIVEIS)})")
+    chave = normalizar_chave(nivel, chave)
+    if not chave:
+        raise ValueError("Informe o ticker, setor ou tipo da meta")
+    if not 0 < percentual <= 100:
+        raise ValueError("O percentual da meta deve ser maior que 0 e no máximo 100")
+    outras = db.execute(
+        "SELECT TOTAL(percentual) FROM metas_alocacao WHERE carteira_id = ? AND nivel = ? AND chave != ?",
+        (carteira_id, nivel, chave)
+    ).fetchone()[0]
+    if outras + percentual > 100 + 1e-9:
+        raise ValueError(f"As metas por {nivel} somariam {outras + percentual:.2f}% (máximo 100%)")
+    return db.execute("""
+        INSERT INTO metas_alocacao (carteira_id, nivel, chave, percentual) VALUES (?, ?, ?, ?)
+        ON CONFLICT (carteira_id, nivel, chave) DO UPDATE SET percentual = excluded.percentual
+        RETURNING id
+    """, (carteira_id, nivel, chave, percentual)).fetchone()[0]
+
+
+def _fatores_choque(vetor: VetorCarteira, choques: dict) -> np.ndarray:
+    """Multiplicador de preço por ativo; o choque do ticker vale sobre o do setor, que vale sobre o do tipo."""
+    fatores = np.ones(vetor.ticker.size)
+    if not choques:
+        return fatores
+    for nivel in ('tipo', 'setor'):
+        chaves, codigos = vetor.grupos[nivel]
+        por_grupo = np.array([choques.get(chave, choques.get(str(chave).upper(), np.nan)) for chave in chaves])
+        if por_grupo.size:
+            aplicar = ~np.isnan(por_grupo[codigos])
+            fatores[aplicar] = 1.0 + por_grupo[codigos][aplicar] / 100.0
+    for chave, variacao in choques.items():
+        i = vetor.indice_ticker.get(str(chave).upper())
+        if i is not None:
+            fatores[i] = 1.0 + variacao / 100.0
+    return np.maximum(fatores, 0.0)
+
+
+def _pesos_alvo(vetor: VetorCarteira, nivel: str, metas: dict, valores: np.ndarray, compravel: np.ndarray):
+    """
+    Meta de cada ativo como fração da carteira. Metas de setor/tipo são repartidas entre os ativos do
+    grupo na proporção do valor atual (em partes iguais entre os compráveis se o grupo ainda está zerado).
+    """
+    chaves, codigos = vetor.grupos[nivel]
+    meta_grupo = np.array([metas.get(chave, 0.0) for chave in chaves]) / 100.0
+    if nivel == 'ativo' or not chaves.size:
+        return meta_grupo if chaves.size else np.zeros(0)
+    n_grupos = chaves.size
+    valor_grupo = np.bincount(codigos, weights=valores, minlength=n_grupos)
+    compraveis_grupo = np.bincount(codigos, weights=compravel, minlength=n_grupos)
+    por_valor = np.divide(valores, valor_grupo[codigos], out=np.zeros_like(valores), where=valor_grupo[codigos] > 0)
+    por_igual = np.divide(compravel, compraveis_grupo[codigos], out=np.zeros_like(valores),
+                          where=compraveis_grupo[codigos] > 0)
+    return meta_grupo[codigos] * np.where(valor_grupo[codigos] > 0, por_valor, por_igual)
+
+
+def _nivelar(valores: np.ndarray, pesos: np.ndarray, aporte: float, total_final: float) -> np.ndarray:
+    """
+    Distribui o aporte elevando a razão valor/meta dos ativos mais abaixo da meta a um nível comum λ
+    (compra_i = max(0, peso_i·λ − valor_i)), o que minimiza o desvio quadrático relativo às metas.
+    λ para no valor final da carteira (todos na meta): com metas que somam menos de 100%, o que
+    passaria disso fica como sobra em vez de estourar as metas.
+    """
+    compras = np.zeros_like(valores)
+    candidatos = np.flatnonzero(pesos > 0)
+    if not candidatos.size or aporte <= 0:
+        return compras
+    razoes = valores[candidatos] / pesos[candidatos]
+    ordem = np.argsort(razoes, kind='stable')
+    razoes, pesos_ord, valores_ord = razoes[ordem], pesos[candidatos][ordem], valores[candidatos][ordem]
+    peso_acumulado = np.cumsum(pesos_ord)
+    valor_acumulado = np.cumsum(valores_ord)
+    # Dinheiro necessário para levar os k primeiros até a razão do k-ésimo: crescente em k
+    necessario = razoes * peso_acumulado - valor_acumulado
+    k = np.searchsorted(necessario, aporte, side='right') - 1
+    nivel = min((aporte + valor_acumulado[k]) / peso_acumulado[k], total_final)
+    compras[candidatos[ordem[:k + 1]]] = pesos_ord[:k + 1] * nivel - valores_ord[:k + 1]
+    return np.maximum(compras, 0.0)
+
+
+def simular(vetor: VetorCarteira, metas: list, aporte: float, nivel: str = None, choques: dict = None,
+            lote: int = 1) -> dict:
+    """
+    Lista de compras para um aporte. `choques` aplica variações percentuais de preço por ticker, setor
+    ou tipo (ex.: {"PETR4": -10, "FII": 5}) antes do cálculo; `lote` é a quantidade mínima negociada.
+    """
+    if aporte < 0:
+        raise ValueError("O aporte não pode ser negativo")
+    if lote < 1:
+        raise ValueError("O lote deve ser de pelo menos 1 unidade")
+    por_nivel = {}
+    for meta in metas:
+        por_nivel.setdefault(meta['nivel'], {})[meta['chave']] = meta['percentual']
+    if nivel is None:
+        nivel = next((candidato for candidato in NIVEIS if candidato in por_nivel), None)
+        if nivel is None:
+            raise ValueError("Nenhuma meta de alocação cadastrada")
+    elif nivel not in NIVEIS:
+        raise ValueError(f"Nível inválido: '{nivel}' (use {', '.join(NIVEIS)})")
+    elif nivel not in por_nivel:
+        raise ValueError(f"Nenhuma meta de alocação por {nivel}")
+    metas_nivel = por_nivel[nivel]
+
+    # 1. Preços (com os choques) e valor atual de cada ativo
+    precos = vetor.preco * _fatores_choque(vetor, choques)
+    valores = vetor.quantidade * precos
+    total = float(valores.sum())
+    total_final = total + aporte
+    custo_lote = precos * lote
+    compravel = (custo_lote > 0).astype(float)
+
+    # 2. Meta de cada ativo e compra ideal (fracionária) pelo nivelamento
+    pesos = _pesos_alvo(vetor, nivel, metas_nivel, valores, compravel) * compravel
+    ideal = _nivelar(valores, pesos, aporte, total_final)
+
+    # 3. Arredonda para lotes inteiros (para baixo) ...
+    lotes = np.floor(np.divide(ideal, custo_lote, out=np.zeros_like(ideal), where=custo_lote > 0) + 1e-9)
+    sobra = aporte - float(lotes @ custo_lote)
+
+    # 4. ... e a sobra compra lotes avulsos, do ativo mais abaixo da meta (relativamente) para o menos,
+    # pulando os que não cabem; cada passada reordena e compra no máximo um lote de cada ativo
+    alvo = pesos * total_final
+    candidatos = np.flatnonzero(pesos > 0)
+    for _ in range(PASSADAS_SOBRA):
+        cabem = candidatos[custo_lote[candidatos] <= sobra + 1e-9]
+        falta = (alvo[cabem] - valores[cabem] - lotes[cabem] * custo_lote[cabem]) / alvo[cabem]
+        # Quem já está na meta fica de fora: melhor guardar o troco do que passar dela
+        cabem, falta = cabem[falta > 0], falta[falta > 0]
+        ordem = cabem[np.argsort(-falta, kind='stable')]
+        comprou = False
+        for i, custo in zip(ordem.tolist(), custo_lote[ordem].tolist()):
+            if custo <= sobra + 1e-9:
+                lotes[i] += 1
+                sobra -= custo
+                comprou = True
+        if not comprou:
+            break
+
+    # 5. Alocação por chave do nível antes e depois, e o desvio total em relação às metas
+    compras = lotes * custo_lote
+    finais = valores + compras
+    chaves, codigos = vetor.grupos[nivel]
+    atual_grupo = np.bincount(codigos, weights=valores, minlength=chaves.size)
+    final_grupo = np.bincount(codigos, weights=finais, minlength=chaves.size)
+    indice_grupo = {chave: i for i, chave in enumerate(chaves)}
+
+    def _percentual(valor, base):
+        return round(float(valor) / base * 100, 2) if base > 0 else 0.0
+
+    alocacao = []
+    desvio_antes = desvio_depois = 0.0
+    for chave, meta in sorted(metas_nivel.items()):
+        i = indice_grupo.get(chave)
+        atual = _percentual(atual_grupo[i], total) if i is not None else 0.0
+        final = _percentual(final_grupo[i], total_final) if i is not None else 0.0
+        desvio_antes += abs(atual - meta)
+        desvio_depois += abs(final - meta)
+        alocacao.append({"chave": chave, "meta": meta, "atual": atual, "final": final, "sem_ativos": i is None})
+
+    comprados = np.flatnonzero(lotes > 0)
+    comprados = comprados[np.argsort(-compras[comprados], kind='stable')]
+    return {
+        "nivel": nivel,
+        "aporte": round(aporte, 2),
+        "lote": lote,
+        "investido": round(float(compras.sum()), 2),
+        "sobra": round(max(sobra, 0.0), 2),
+        "valor_atual": round(total, 2),
+        "valor_final": round(float(finais.sum()), 2),
+        "desvio_antes": round(desvio_antes, 2),
+        "desvio_depois": round(desvio_depois, 2),
+        "compras": [
+            {
+                "ativo_id": int(vetor.ativo_id[i]),
+                "ticker": vetor.ticker[i],
+                "lotes": int(lotes[i]),
+                "quantidade": int(lotes[i]) * lote,
+                "preco": round(float(precos[i]), 2),
+                "valor": round(float(compras[i]), 2),
+            }
+            for i in comprados
+        ],
+        "alocacao": alocacao,
+    }
@@ -1,55 +1,112 @@
-import sqlite3
-import os
-import sys
-from datetime import date
+from collections import defaultdict
 
-# --- HACK PARA O PYTHON ACHAR A PASTA 'app' ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-sys.path.append(os.path.abspath(os.path.join(BASE_DIR, '..', '..')))
+from app import carteiras
+from app.cache import chave_ativo, CHAVE_PORTFOLIO
+from app.database import incrementar_versao_dados
+from app.services.price_engine import buscar_precos, cache_cotacoes
+from app.services.historico_engine import gravar_historico
 
-from app.services.price_engine import buscar_preco_acao
+def _ativos_por_banco(sql: str) -> dict:
+    """Executa a consulta em cada banco com carteiras: {db_path: [linhas]}."""
+    por_banco = {}
+    for db_path in carteiras.bancos():
+        with carteiras.conexao_banco(db_path) as db:
+            por_banco[db_path] = [tuple(linha) for linha in db.execute(sql)]
+    return por_banco
 
-# --- CONFIGURAÇÃO DO CAMINHO DA BASE DE DADOS ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-# Sobe duas pastas (services -> app -> raiz) e entra na pasta data
-DB_PATH = os.path.join(BASE_DIR, '..', '..', 'data', 'masterfy.db')
+def _gravar_precos(db_path: str, atualizacoes: list, fechamentos: list = ()):
+    """
+    Grava (preco, ativo_id, carteira_id) num banco e descarta o cache das carteiras afetadas.
+    `fechamentos`: linhas (ativo_id, data_iso, preco) para a série histórica, com a data do pregão.
+    """
+    with carteiras.conexao_banco(db_path) as db:
+        cursor = db.cursor()
+        cursor.executemany(
+            "UPDATE ativos SET preco_atual = ? WHERE id = ?", [(preco, ativo_id) for preco, ativo_id, _ in atualizacoes]
+        )
+        if fechamentos:
+            gravar_historico(cursor, fechamentos)
+        # Os outros processos (web) percebem a gravação pela versão dos dados deste banco
+        incrementar_versao_dados(cursor)
+        db.commit()
+    # Só o portfólio e os ativos com preço novo saem do cache de cada carteira
+    por_carteira = defaultdict(list)
+    for _, ativo_id, carteira_id in atualizacoes:
+        por_carteira[carteira_id].append(chave_ativo(ativo_id))
+    for carteira_id, chaves in por_carteira.items():
+        carteiras.invalidar(db_path, carteira_id, CHAVE_PORTFOLIO, *chaves)
 
-def atualizar_precos_b3():
+def atualizar_precos_b3(provedor=None):
     """Busca o preço atual de todos os ativos e atualiza a base de dados."""
     print("Iniciando a atualização diária de preços da B3...")
     
-    conexao = sqlite3.connect(DB_PATH)
-    cursor = conexao.cursor()
-    
-    # 1. Puxa todos os ativos registados (apenas o ID e o Ticker)
-    cursor.execute("SELECT id, ticker FROM ativos")
-    ativos = cursor.fetchall()
-    
-    # 2. Faz o loop para buscar e atualizar o preço de cada um
-    atualizacoes = []
-    for ativo in ativos:
-        ativo_id = ativo[0]
-        ticker = ativo[1]
-
-        try:
-            preco_hoje = buscar_preco_acao(ticker)
-            if preco_hoje and preco_hoje > 0:
-                atualizacoes.append((preco_hoje, ativo_id))
-                print(f"✅ {ticker} obtido com sucesso: R$ {preco_hoje:.2f}")
-            else:
-                print(f"⚠️ Aviso: Não foi possível obter o preço para {ticker}.")
-        except Exception as e:
-            print(f"❌ Erro ao processar {ticker}: {e}")
-
-    # 3. Executa todas as atualizações de uma única vez (Batch Update)
-    if atualizacoes:
-        cursor.executemany("UPDATE ativos SET preco_atual = ? WHERE id = ?", atualizacoes)
-
-    # 4. Grava as alterações e fecha a ligação
-    conexao.commit()
-    conexao.close()
-    print("Atualização concluída com sucesso!")
-
-# Permite rodar o script manualmente para testes
+    # 1. Puxa os ativos de todas as carteiras (ID, carteira e Ticker)
+    por_banco = _ativos_por_banco("SELECT id, carteira_id, ticker FROM ativos")
+
+    # 2. Busca os preços em lotes concorrentes (provedor padrão: Yahoo Finance)
+    # OTIMIZAÇÃO: Cada ticker é buscado uma vez, não importa quantas carteiras o tenham
+    # A conexão não fica presa ao pool enquanto esperamos a rede
+    tickers = sorted({ticker.upper() for ativos in por_banco.values() for _, _, ticker in ativos})
+    resumo = buscar_precos(tickers, provedor=provedor)
+    for ticker in tickers:
+        if not (resumo.precos.get(ticker) or 0) > 0:
+            print(f"⚠️ Aviso: Não foi possível obter o preço para {ticker} ({resumo.falhas.get(ticker)}).")
+
+    # 3. Distribui o preço para todas as carteiras, uma gravação em lote (Batch Update) por banco
+    # O fechamento vai para o histórico na data do pregão de onde veio (o último de um download de
+    # 5 dias pode ser de ontem, num feriado ou antes da abertura), nunca na data de hoje
+    for db_path, ativos in por_banco.items():
+        atualizacoes, fechamentos = [], []
+        for ativo_id, carteira_id, ticker in ativos:
+            preco = resumo.precos.get(ticker.upper()) or 0
+            if preco > 0:
+                atualizacoes.append((preco, ativo_id, carteira_id))
+                # Provedor que não informa o pregão: o preço atualiza o ativo, mas não entra no histórico
+                if ticker.upper() in resumo.datas:
+                    fechamentos.append((ativo_id, resumo.datas[ticker.upper()], preco))
+        if atualizacoes:
+            _gravar_precos(db_path, atualizacoes, fechamentos)
+
+    print(f"Atualização concluída: {resumo}")
+    return resumo
+
+def atualizar_precos_intradiario(provedor=None):
+    """
+    Modo intradiário: atualiza durante o pregão apenas os ativos com posição aberta.
+    Passa pelo cache de cotações, então tickers consultados há pouco não geram nova chamada ao provedor.
+    Não grava histórico: o fechamento do dia continua vindo de atualizar_precos_b3.
+    """
+    # 1. Só interessa o que está em alguma carteira
+    por_banco = _ativos_por_banco("""
+        SELECT a.id, a.carteira_id, a.ticker, a.preco_atual
+        FROM posicoes p JOIN ativos a ON a.id = p.ativo_id
+        WHERE p.quantidade > 0
+    """)
+    total_ativos = sum(len(ativos) for ativos in por_banco.values())
+    if not total_ativos:
+        return "Nenhum ativo com posição aberta."
+
+    # 2. Cotações (novas ou, se o provedor falhar, as últimas conhecidas), uma por ticker distinto
+    cotacoes = cache_cotacoes(provedor).obter(
+        sorted({ticker.upper() for ativos in por_banco.values() for _, _, ticker, _ in ativos})
+    )
+
+    # 3. Grava só preços novos e que realmente mudaram (cotação desatualizada não sobrescreve nada)
+    alterados = 0
+    for db_path, ativos in por_banco.items():
+        atualizacoes = []
+        for ativo_id, carteira_id, ticker, preco_atual in ativos:
+            cotacao = cotacoes.get(ticker.upper())
+            if cotacao and not cotacao.desatualizada and cotacao.preco > 0 and cotacao.preco != preco_atual:
+                atualizacoes.append((cotacao.preco, ativo_id, carteira_id))
+        if atualizacoes:
+            _gravar_precos(db_path, atualizacoes)
+            alterados += len(atualizacoes)
+
+    return (f"{alterados} preço(s) alterado(s) de {total_ativos} ativo(s) com posição, "
+            f"{len(cotacoes)} cotação(ões) obtida(s)")
+
+# Permite rodar o script manualmente para testes (fora do agendador e da trava: prefira python -m masterfy precos)
+# Uso: python -m app.services.update_prices
 if __name__ == "__main__":
     atualizar_precos_b3()
@@ -0,0 +1,48 @@
+import signal
+import sys
+
+from app.agendador import JOBS, IDENTIDADE, criar_agendador, executar_job
+from app.carteiras import fechar_carteiras
+from app.database import fechar_pools
+from app.migracoes import migrar
+
+# Processo dedicado aos jobs (atualização de preços, backup e execuções pedidas pela API).
+# Uso: python -m app.worker                 (fica rodando, com o agendador)
+#      python -m app.worker --uma-vez JOB   (executa um job agora, respeitando a trava, e sai)
+# Os processos web devem subir com MASTERFY_AGENDADOR=0 para não disputar os jobs.
+
+
+def main():
+    migrar()
+
+    if '--uma-vez' in sys.argv:
+        job_id = sys.argv[sys.argv.index('--uma-vez') + 1]
+        if job_id not in JOBS:
+            print(f"❌ Job desconhecido: {job_id}. Disponíveis: {', '.join(JOBS)}")
+            sys.exit(2)
+        try:
+            if executar_job(job_id, origem='manual') is None:
+                print(f"⚠️ {job_id} não rodou: outra instância está com a trava.")
+            else:
+                print(f"✅ {job_id} executado.")
+        finally:
+            fechar_carteiras()
+            fechar_pools()
+        return
+
+    agendador = criar_agendador(bloqueante=True)
+    # docker stop / systemd mandam SIGTERM: termina o job em andamento e sai
+    signal.signal(signal.SIGTERM, lambda *_: agendador.shutdown(wait=False))
+    print(f"👷 Worker {IDENTIDADE} iniciado com os jobs: {', '.join(JOBS)}")
+    try:
+        agendador.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        fechar_carteiras()
+        fechar_pools()
+        print("👋 Worker encerrado.")
+
+
+if __name__ == '__main__':
+    main()
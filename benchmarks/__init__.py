@@ -0,0 +1,6 @@
+"""
+Benchmarks do masterfy: gerador de carteiras sintéticas e medição das rotas e serviços mais usados.
+
+Uso: python -m benchmarks --cenario medio --saida resultado.json
+     python -m benchmarks.importacao   (orçamento de tempo de import e memória dos pontos de entrada)
+"""
@@ -0,0 +1,195 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+from benchmarks.gerador import CENARIOS, gerar_banco
+from benchmarks.medicao import medir, formatar
+
+# Uso: python -m benchmarks [--cenario medio | --ativos N --transacoes N] [--saida resultado.json]
+# Cada execução gera um banco novo numa pasta temporária (ou em --pasta) e mede:
+#   - as rotas pelo TestClient do FastAPI, com o cache limpo (frio) e preenchido (quente)
+#   - os serviços chamados direto, sem HTTP
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Benchmarks do masterfy")
+    parser.add_argument('--cenario', choices=CENARIOS, default='pequeno')
+    parser.add_argument('--ativos', type=int, help="Sobrescreve o número de ativos do cenário")
+    parser.add_argument('--transacoes', type=int, help="Sobrescreve o número de transações do cenário")
+    parser.add_argument('--dias-historico', type=int, default=250)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--repeticoes', type=int, default=50)
+    parser.add_argument('--latencia', type=float, default=0.05, help="Latência simulada do provedor de preços (s)")
+    parser.add_argument('--somente', help="Roda apenas os benchmarks cujo nome contém este texto")
+    parser.add_argument('--pasta', help="Pasta do banco gerado (padrão: temporária, apagada no final)")
+    parser.add_argument('--saida', help="Arquivo JSON com o resultado")
+    return parser.parse_args()
+
+
+class _Rodizio:
+    """Percorre os ids de ativos em ordem fixa, para cada chamada pedir um ativo diferente."""
+
+    def __init__(self, ids: list):
+        self.ids = ids
+        self.posicao = 0
+
+    def proximo(self) -> int:
+        ativo_id = self.ids[self.posicao % len(self.ids)]
+        self.posicao += 1
+        return ativo_id
+
+
+def _esperar(status: int):
+    def verificar(resposta):
+        if resposta.status_code != status:
+            raise RuntimeError(f"{resposta.request.method} {resposta.request.url} "
+                               f"respondeu {resposta.status_code}: {resposta.text[:200]}")
+        return resposta
+    return verificar
+
+
+def benchmarks_rotas(cliente, ids: _Rodizio, repeticoes: int, limpar_cache):
+    ok, redirecionou = _esperar(200), _esperar(303)
+    poucas = max(3, repeticoes // 10)
+
+    def nova_transacao():
+        return redirecionou(cliente.post("/web/transacoes/", follow_redirects=False, data={
+            "ativo_id": ids.proximo(), "data": "2025-12-30", "tipo_transacao": "COMPRA",
+            "quantidade": 10, "preco_unitario": 25.5,
+        }))
+
+    return [
+        ("rota.obter_portfolio.frio", lambda: ok(cliente.get("/portfolio/")), repeticoes, limpar_cache),
+        ("rota.obter_portfolio.quente", lambda: ok(cliente.get("/portfolio/")), repeticoes, None),
+        ("rota.dashboard_web.frio", lambda: ok(cliente.get("/")), repeticoes, limpar_cache),
+        ("rota.dashboard_web.quente", lambda: ok(cliente.get("/")), repeticoes, None),
+        ("rota.detalhes_ativo.frio", lambda: ok(cliente.get(f"/ativo/{ids.proximo()}")), repeticoes, limpar_cache),
+        ("rota.detalhes_ativo.quente", lambda: ok(cliente.get(f"/ativo/{ids.ids[0]}")), repeticoes, None),
+        ("rota.listar_transacoes", lambda: ok(cliente.get(f"/ativos/{ids.proximo()}/transacoes")), repeticoes, None),
+        ("rota.obter_historico", lambda: ok(cliente.get(f"/ativos/{ids.proximo()}/historico")), repeticoes, None),
+        ("rota.obter_performance", lambda: ok(cliente.get("/portfolio/performance")), poucas, None),
+        ("rota.registrar_transacao_web", nova_transacao, repeticoes, None),
+    ]
+
+
+def benchmarks_servicos(ids: _Rodizio, repeticoes: int, latencia: float):
+    from app.database import pool_leitura, conexao
+    from app.main import calcular_portfolio, _carregar_detalhes_ativo
+    from app.services.extrato_engine import listar_pagina, resumo_ativo, codificar_cursor
+    from app.services.imposto_engine import apurar_meses
+    from app.services.import_engine import importar_csv
+    from app.services.performance_engine import calcular_performance
+    from app.services.price_engine import ProvedorFalso
+    from app.services.update_prices import atualizar_precos_b3
+
+    poucas = max(3, repeticoes // 10)
+    provedor = ProvedorFalso(latencia=latencia)
+    cursor_antigo = codificar_cursor('2022-01-01', 2 ** 62)  # Página no meio do histórico
+
+    def lendo(funcao):
+        def executar():
+            with pool_leitura().conexao() as db:
+                return funcao(db)
+        return executar
+
+    # CSV fixo de 10 mil linhas reimportado a cada repetição
+    linhas = ["data,ticker,tipo_transacao,quantidade,preco_unitario,taxas"]
+    with pool_leitura().conexao() as db:
+        tickers = [linha[0] for linha in db.execute("SELECT ticker FROM ativos ORDER BY id LIMIT 50")]
+    for i in range(10_000):
+        linhas.append(f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d},{tickers[i % len(tickers)]},"
+                      f"{'VENDA' if i % 5 == 0 else 'COMPRA'},{i % 100 + 1},{10 + i % 50}.25,1.50")
+    csv_importacao = "\n".join(linhas) + "\n"
+
+    def importar():
+        with conexao() as db:
+            return importar_csv(db, io.StringIO(csv_importacao), destino='transacoes')
+
+    def atualizar_precos():
+        with contextlib.redirect_stdout(io.StringIO()):  # O job imprime uma linha por rodada
+            return atualizar_precos_b3(provedor=provedor)
+
+    return [
+        ("servico.calcular_portfolio", lendo(calcular_portfolio), repeticoes, None),
+        ("servico.carregar_detalhes_ativo", lendo(lambda db: _carregar_detalhes_ativo(db, ids.proximo())),
+         repeticoes, None),
+        ("servico.listar_pagina.primeira", lendo(lambda db: listar_pagina(db, 'transacoes', ids.ids[0])),
+         repeticoes, None),
+        ("servico.listar_pagina.profunda",
+         lendo(lambda db: listar_pagina(db, 'transacoes', ids.ids[0], cursor_antigo)), repeticoes, None),
+        ("servico.resumo_ativo", lendo(lambda db: resumo_ativo(db, ids.proximo())), repeticoes, None),
+        ("servico.calcular_performance", lendo(calcular_performance), poucas, None),
+        ("servico.apurar_meses", lendo(apurar_meses), repeticoes, None),
+        ("servico.atualizar_precos_b3", atualizar_precos, poucas, None),
+        ("servico.importar_csv.10k", importar, poucas, None),
+    ]
+
+
+def main():
+    args = _argumentos()
+    ativos, transacoes = CENARIOS[args.cenario]
+    ativos = args.ativos or ativos
+    transacoes = args.transacoes or transacoes
+
+    pasta = args.pasta or tempfile.mkdtemp(prefix='masterfy_bench_')
+    # Precisa estar definida antes do primeiro import de app.*
+    os.environ['MASTERFY_DATA_DIR'] = pasta
+    try:
+        print(f"Gerando banco sintético: {ativos} ativo(s), {transacoes} transação(ões) em {pasta}...")
+        with contextlib.redirect_stdout(io.StringIO()):
+            cenario = gerar_banco(ativos, transacoes, dias_historico=args.dias_historico, semente=args.semente)
+        print(f"✅ Banco gerado: {cenario['tamanho_bytes'] / 1e6:.1f} MB em {sum(cenario['tempos'].values()):.1f}s\n")
+
+        from fastapi.testclient import TestClient
+        from app.carteiras import obter_carteira
+        from app.database import fechar_pools
+        from app.main import app
+
+        # Os ativos mais negociados primeiro (o gerador concentra as operações nos primeiros ids)
+        ids = _Rodizio(list(range(1, min(ativos, 100) + 1)))
+        # Sem `with`: o lifespan (agendador) não sobe durante o benchmark
+        cliente = TestClient(app)
+        casos = benchmarks_rotas(cliente, ids, args.repeticoes, obter_carteira().cache.invalidar_tudo)
+        casos += benchmarks_servicos(ids, args.repeticoes, args.latencia)
+
+        resultados = []
+        for nome, funcao, repeticoes, antes in casos:
+            if args.somente and args.somente not in nome:
+                continue
+            resultado = medir(nome, funcao, repeticoes=repeticoes, antes=antes)
+            resultados.append(resultado)
+            print(formatar(resultado))
+        fechar_pools()
+    finally:
+        if not args.pasta:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+    relatorio = {
+        "ambiente": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "executado_em": datetime.now().isoformat(timespec='seconds'),
+        },
+        "cenario": cenario,
+        "resultados": resultados,
+    }
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+        print(f"\n✅ Resultado salvo em {args.saida}")
+    else:
+        json.dump(relatorio, sys.stdout, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import json
+import sys
+
+# Variação de p50 acima da qual um benchmark é marcado como regressão
+LIMITE_PADRAO = 0.10
+
+
+def comparar(anterior: dict, atual: dict, limite: float = LIMITE_PADRAO) -> list:
+    """Compara dois relatórios de `python -m benchmarks` pelo nome de cada benchmark."""
+    antes = {r['nome']: r for r in anterior['resultados']}
+    linhas = []
+    for resultado in atual['resultados']:
+        base = antes.get(resultado['nome'])
+        if not base or not base['p50']:
+            continue
+        variacao = resultado['p50'] / base['p50'] - 1
+        linhas.append({
+            "nome": resultado['nome'],
+            "p50_anterior": base['p50'],
+            "p50_atual": resultado['p50'],
+            "variacao": round(variacao, 4),
+            "memoria_anterior": base['pico_memoria_bytes'],
+            "memoria_atual": resultado['pico_memoria_bytes'],
+            "regressao": variacao > limite,
+        })
+    return linhas
+
+
+# Uso: python -m benchmarks.comparar ANTERIOR.json ATUAL.json [--limite 0.10]
+# Sai com código 1 se algum benchmark ficou mais lento que o limite.
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Uso: python -m benchmarks.comparar ANTERIOR.json ATUAL.json [--limite 0.10]")
+        sys.exit(2)
+    limite = float(sys.argv[sys.argv.index('--limite') + 1]) if '--limite' in sys.argv else LIMITE_PADRAO
+    with open(sys.argv[1], encoding='utf-8') as a, open(sys.argv[2], encoding='utf-8') as b:
+        linhas = comparar(json.load(a), json.load(b), limite)
+
+    for linha in linhas:
+        marcador = '❌' if linha['regressao'] else ('✅' if linha['variacao'] < -limite else '  ')
+        print(f"{marcador} {linha['nome']:<40} {linha['p50_anterior'] * 1000:9.2f} ms -> "
+              f"{linha['p50_atual'] * 1000:9.2f} ms ({linha['variacao']:+.1%})")
+    regressoes = [l for l in linhas if l['regressao']]
+    if regressoes:
+        print(f"\n⚠️ {len(regressoes)} benchmark(s) acima do limite de {limite:.0%}.")
+        sys.exit(1)
@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import sys
+import time
+from datetime import date
+
+import numpy as np
+
+# Cenários prontos (ativos, transações). Qualquer combinação também pode ser passada na linha de comando.
+CENARIOS = {
+    'minimo': (10, 1_000),
+    'pequeno': (100, 10_000),
+    'medio': (1_000, 100_000),
+    'grande': (1_000, 1_000_000),
+    'enorme': (10_000, 10_000_000),
+}
+
+TAMANHO_BLOCO = 200_000
+DATA_FINAL = date(2025, 12, 31)  # Fixa: o mesmo cenário sempre gera o mesmo banco
+SETORES = ('Financeiro', 'Energia', 'Mineração', 'Varejo', 'Saúde', 'Tecnologia', 'Utilidades')
+TIPOS_PROVENTO = ('Dividendo', 'JCP', 'Rendimento FII')
+
+
+def _tickers(quantidade: int) -> list:
+    """AAAA3, AAAA4, AAAA11, AAAB3... únicos e estáveis para a mesma quantidade."""
+    sufixos = ('3', '4', '11')
+    tickers = []
+    for i in range(quantidade):
+        n = i // len(sufixos)
+        letras = ''
+        for _ in range(4):
+            n, resto = divmod(n, 26)
+            letras = chr(65 + resto) + letras
+        tickers.append(letras + sufixos[i % len(sufixos)])
+    return tickers
+
+
+def _datas_iso(dias: np.ndarray, inicio: np.datetime64) -> list:
+    return np.datetime_as_string(inicio + dias.astype('timedelta64[D]')).tolist()
+
+
+def gerar_banco(ativos: int, transacoes: int, proventos: int = None, dias_historico: int = 250,
+                anos: int = 5, semente: int = 42) -> dict:
+    """
+    Cria em app.database.DB_PATH (pasta de MASTERFY_DATA_DIR) um banco com o schema da aplicação
+    e dados sintéticos determinísticos. O arquivo não pode existir antes.
+    Retorna o cenário gerado e o tempo gasto em cada etapa.
+    """
+    # Importados aqui para respeitar a MASTERFY_DATA_DIR definida por quem chamou
+    from app.database import DB_PATH, conexao
+    if os.path.exists(DB_PATH):
+        raise FileExistsError(f"Já existe um banco em {DB_PATH}; use uma pasta vazia em MASTERFY_DATA_DIR.")
+    from app.migracoes import migrar
+    from app.services.portfolio_engine import reconstruir_posicoes
+
+    proventos = transacoes // 20 if proventos is None else proventos
+    aleatorio = np.random.default_rng(semente)
+    tempos = {}
+
+    # 1. Schema exatamente como a aplicação cria
+    inicio = time.perf_counter()
+    migrar()
+    tempos['schema'] = time.perf_counter() - inicio
+
+    # Conexão própria, sem fsync: o arquivo é descartável até o fim da geração
+    db = sqlite3.connect(DB_PATH)
+    db.execute("PRAGMA synchronous=OFF")
+    cursor = db.cursor()
+
+    # 2. Ativos, com preço base por ativo usado em transações, histórico e preço atual
+    inicio = time.perf_counter()
+    tickers = _tickers(ativos)
+    precos_base = np.round(aleatorio.uniform(5, 120, ativos), 2)
+    setores = aleatorio.integers(0, len(SETORES), ativos)
+    cursor.executemany(
+        "INSERT INTO ativos (id, ticker, nome, tipo, setor, preco_atual) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (i + 1, ticker, f"Empresa {ticker}", 'FII' if ticker.endswith('11') else 'ACAO',
+             'Imobiliário' if ticker.endswith('11') else SETORES[setores[i]], float(precos_base[i]))
+            for i, ticker in enumerate(tickers)
+        ]
+    )
+    db.commit()
+    tempos['ativos'] = time.perf_counter() - inicio
+
+    total_dias = anos * 365
+    primeiro_dia = np.datetime64(DATA_FINAL, 'D') - np.timedelta64(total_dias, 'D')
+
+    # 3. Transações em blocos: memória constante mesmo com 10 milhões de linhas
+    # Uns poucos ativos concentram a maior parte das operações (distribuição de Zipf, como numa carteira real)
+    inicio = time.perf_counter()
+    pesos = 1.0 / np.arange(1, ativos + 1)
+    pesos /= pesos.sum()
+    for deslocamento in range(0, transacoes, TAMANHO_BLOCO):
+        n = min(TAMANHO_BLOCO, transacoes - deslocamento)
+        indices = aleatorio.choice(ativos, size=n, p=pesos)
+        dias = aleatorio.integers(0, total_dias, n)
+        vendas = aleatorio.random(n) < 0.2
+        quantidades = aleatorio.integers(1, 500, n)
+        precos = np.round(precos_base[indices] * aleatorio.lognormal(0, 0.25, n), 2)
+        taxas = np.round(aleatorio.uniform(0, 5, n), 2)
+        cursor.executemany(
+            "INSERT INTO transacoes (ativo_id, data, tipo_transacao, quantidade, preco_unitario, taxas) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            zip((indices + 1).tolist(), _datas_iso(dias, primeiro_dia),
+                np.where(vendas, 'VENDA', 'COMPRA').tolist(), quantidades.astype(float).tolist(),
+                precos.tolist(), taxas.tolist())
+        )
+        db.commit()
+    tempos['transacoes'] = time.perf_counter() - inicio
+
+    # 4. Proventos
+    inicio = time.perf_counter()
+    for deslocamento in range(0, proventos, TAMANHO_BLOCO):
+        n = min(TAMANHO_BLOCO, proventos - deslocamento)
+        indices = aleatorio.choice(ativos, size=n, p=pesos)
+        dias = aleatorio.integers(0, total_dias, n)
+        tipos = aleatorio.integers(0, len(TIPOS_PROVENTO), n)
+        valores = np.round(aleatorio.uniform(1, 500, n), 2)
+        cursor.executemany(
+            "INSERT INTO proventos (ativo_id, data, tipo, valor) VALUES (?, ?, ?, ?)",
+            zip((indices + 1).tolist(), _datas_iso(dias, primeiro_dia),
+                [TIPOS_PROVENTO[t] for t in tipos.tolist()], valores.tolist())
+        )
+        db.commit()
+    tempos['proventos'] = time.perf_counter() - inicio
+
+    # 5. Histórico de fechamentos: passeio aleatório nos últimos dias úteis, para todos os ativos
+    inicio = time.perf_counter()
+    if dias_historico:
+        dias_uteis = np.busday_offset(np.datetime64(DATA_FINAL, 'D'), -np.arange(dias_historico)[::-1], roll='backward')
+        datas = np.datetime_as_string(dias_uteis).tolist()
+        por_bloco = max(1, TAMANHO_BLOCO // dias_historico)
+        for primeiro in range(0, ativos, por_bloco):
+            bloco = range(primeiro, min(ativos, primeiro + por_bloco))
+            retornos = aleatorio.normal(0, 0.015, (len(bloco), dias_historico))
+            series = np.round(precos_base[primeiro:bloco.stop, None] * np.exp(np.cumsum(retornos, axis=1)), 2)
+            cursor.executemany(
+                "INSERT INTO historico_precos (ativo_id, data, preco) VALUES (?, ?, ?)",
+                ((i + 1, datas[d], preco) for linha, i in enumerate(bloco)
+                 for d, preco in enumerate(series[linha].tolist()))
+            )
+            db.commit()
+    tempos['historico'] = time.perf_counter() - inicio
+
+    db.close()
+
+    # 6. Posições consolidadas e estatísticas para o planejador de consultas
+    inicio = time.perf_counter()
+    with conexao() as db:
+        reconstruir_posicoes(db)
+        db.execute("ANALYZE")
+        db.commit()
+    tempos['posicoes'] = time.perf_counter() - inicio
+
+    return {
+        "ativos": ativos,
+        "transacoes": transacoes,
+        "proventos": proventos,
+        "dias_historico": dias_historico,
+        "anos": anos,
+        "semente": semente,
+        "tamanho_bytes": os.path.getsize(DB_PATH),
+        "tempos": {etapa: round(t, 4) for etapa, t in tempos.items()},
+    }
+
+
+# Uso: MASTERFY_DATA_DIR=PASTA python -m benchmarks.gerador {cenario | ATIVOS TRANSACOES}
+if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] in CENARIOS:
+        ativos, transacoes = CENARIOS[sys.argv[1]]
+    elif len(sys.argv) == 3:
+        ativos, transacoes = int(sys.argv[1]), int(sys.argv[2])
+    else:
+        print(f"Uso: python -m benchmarks.gerador {{{'|'.join(CENARIOS)} | ATIVOS TRANSACOES}}")
+        sys.exit(2)
+    resultado = gerar_banco(ativos, transacoes)
+    print(f"✅ Banco sintético gerado: {ativos} ativo(s), {transacoes} transação(ões), "
+          f"{resultado['tamanho_bytes'] / 1e6:.1f} MB em {sum(resultado['tempos'].values()):.1f}s")
@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+
+# Orçamento de partida a frio: tempo de import e memória residente de cada ponto de entrada, medidos em
+# um processo novo, e os módulos pesados que não podem ser carregados só pelo import.
+# Uso: python -m benchmarks.importacao [--repeticoes 5] [--saida resultado.json]
+# Sai com código 1 se algum ponto de entrada estourar o orçamento.
+
+PONTOS_DE_ENTRADA = {
+    # módulo: (orçamento em segundos, módulos proibidos no import)
+    'app.main': (1.0, ('yfinance', 'pandas', 'curl_cffi', 'apscheduler')),
+    'app.worker': (0.5, ('yfinance', 'pandas', 'curl_cffi', 'fastapi')),
+    'masterfy.__main__': (0.1, ('yfinance', 'pandas', 'fastapi', 'apscheduler', 'numpy')),
+}
+
+# Executado em um interpretador novo: o import medido não aproveita nada já carregado por este processo
+_MEDIR = """
+import json, resource, sys, time
+inicio = time.perf_counter()
+__import__({modulo!r})
+duracao = time.perf_counter() - inicio
+print(json.dumps({{
+    "segundos": duracao,
+    "memoria_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modulos": sorted(sys.modules),
+}}))
+"""
+
+
+def medir_import(modulo: str, repeticoes: int = 5) -> dict:
+    """Melhor tempo de import entre as repetições (o mais próximo do custo real, sem ruído da máquina)."""
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ambiente = {**os.environ, 'PYTHONPATH': raiz, 'MASTERFY_AGENDADOR': '0'}
+    medicoes = []
+    for _ in range(repeticoes):
+        saida = subprocess.run(
+            [sys.executable, '-c', _MEDIR.format(modulo=modulo)],
+            capture_output=True, text=True, check=True, cwd=raiz, env=ambiente
+        ).stdout
+        medicoes.append(json.loads(saida.strip().splitlines()[-1]))
+    melhor = min(medicoes, key=lambda m: m['segundos'])
+    return {
+        "modulo": modulo,
+        "segundos": round(melhor['segundos'], 4),
+        "memoria_kb": melhor['memoria_kb'],
+        "modulos_carregados": len(melhor['modulos']),
+        "_modulos": set(melhor['modulos']),
+    }
+
+
+def verificar_orcamento(repeticoes: int = 5) -> list:
+    resultados = []
+    for modulo, (orcamento, proibidos) in PONTOS_DE_ENTRADA.items():
+        medicao = medir_import(modulo, repeticoes)
+        carregados = medicao.pop('_modulos')
+        medicao["orcamento"] = orcamento
+        medicao["proibidos_carregados"] = [m for m in proibidos if m in carregados]
+        medicao["estourou"] = medicao["segundos"] > orcamento or bool(medicao["proibidos_carregados"])
+        resultados.append(medicao)
+    return resultados
+
+
+if __name__ == '__main__':
+    repeticoes = int(sys.argv[sys.argv.index('--repeticoes') + 1]) if '--repeticoes' in sys.argv else 5
+    resultados = verificar_orcamento(repeticoes)
+
+    for r in resultados:
+        marcador = '❌' if r['estourou'] else '✅'
+        print(f"{marcador} {r['modulo']:<20} {r['segundos'] * 1000:>8.1f} ms (orçamento {r['orcamento'] * 1000:.0f} ms)  "
+              f"{r['memoria_kb'] / 1024:>6.1f} MB  {r['modulos_carregados']} módulos")
+        if r['proibidos_carregados']:
+            print(f"   carregou no import: {', '.join(r['proibidos_carregados'])}")
+
+    if '--saida' in sys.argv:
+        with open(sys.argv[sys.argv.index('--saida') + 1], 'w', encoding='utf-8') as arquivo:
+            json.dump(resultados, arquivo, indent=2, ensure_ascii=False)
+    sys.exit(1 if any(r['estourou'] for r in resultados) else 0)
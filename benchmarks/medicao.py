@@ -0,0 +1,60 @@
+import time
+import tracemalloc
+
+import numpy as np
+
+PERCENTIS = (50, 90, 95, 99)
+
+
+def medir(nome: str, funcao, repeticoes: int = 50, aquecimento: int = 3, antes=None) -> dict:
+    """
+    Executa `funcao` várias vezes e devolve vazão, percentis de latência e pico de memória.
+    `antes` roda antes de cada chamada, fora do tempo medido (ex.: limpar o cache para medir a frio).
+    O pico de memória vem de uma execução extra com tracemalloc, para não distorcer as latências.
+    """
+    for _ in range(aquecimento):
+        if antes:
+            antes()
+        funcao()
+
+    latencias = np.empty(repeticoes)
+    for i in range(repeticoes):
+        if antes:
+            antes()
+        inicio = time.perf_counter()
+        funcao()
+        latencias[i] = time.perf_counter() - inicio
+
+    if antes:
+        antes()
+    ja_rastreando = tracemalloc.is_tracing()
+    if not ja_rastreando:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    funcao()
+    _, pico = tracemalloc.get_traced_memory()
+    if not ja_rastreando:
+        tracemalloc.stop()
+
+    total = float(latencias.sum())
+    resultado = {
+        "nome": nome,
+        "repeticoes": repeticoes,
+        "tempo_total": round(total, 6),
+        "vazao_por_segundo": round(repeticoes / total, 2) if total > 0 else None,
+        "latencia_media": round(float(latencias.mean()), 6),
+        "latencia_min": round(float(latencias.min()), 6),
+        "latencia_max": round(float(latencias.max()), 6),
+        "pico_memoria_bytes": int(pico - base),
+    }
+    for p, valor in zip(PERCENTIS, np.percentile(latencias, PERCENTIS)):
+        resultado[f"p{p}"] = round(float(valor), 6)
+    return resultado
+
+
+def formatar(resultado: dict) -> str:
+    return (f"{resultado['nome']:<40} p50 {resultado['p50'] * 1000:9.2f} ms   "
+            f"p99 {resultado['p99'] * 1000:9.2f} ms   "
+            f"{resultado['vazao_por_segundo'] or 0:9.1f}/s   "
+            f"pico {resultado['pico_memoria_bytes'] / 1e6:8.2f} MB")
@@ -0,0 +1,5 @@
+"""
+Linha de comando do masterfy: atualização de preços, backup, importação de CSV e migrações.
+
+Uso: python -m masterfy --help
+"""
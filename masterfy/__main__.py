@@ -0,0 +1,165 @@
+import argparse
+import os
+import sys
+
+# Uso: python -m masterfy precos                     (atualiza os preços agora, respeitando a trava do job)
+#      python -m masterfy backup [completo|incremental|listar|restaurar NOME [--destino ARQUIVO]]
+#      python -m masterfy importar {transacoes|proventos} ARQUIVO.csv [--formato FORMATO] [--carteira NOME]
+#      python -m masterfy migrar [--status]
+#      python -m masterfy job JOB                     (qualquer job do agendador, como o worker --uma-vez)
+# Os comandos também aceitam os nomes em inglês (refresh, import, migrate).
+# OTIMIZAÇÃO: Cada comando importa só os módulos de que precisa, dentro da própria função: o parse dos
+# argumentos não carrega FastAPI, APScheduler nem o motor de preços (yfinance/pandas).
+
+
+def _executar_job(job_id: str) -> int:
+    from app.agendador import JOBS, executar_job
+
+    if job_id not in JOBS:
+        print(f"❌ Job desconhecido: {job_id}. Disponíveis: {', '.join(JOBS)}")
+        return 2
+    if executar_job(job_id, origem='manual') is None:
+        print(f"⚠️ {job_id} não rodou: outra instância está com a trava.")
+        return 1
+    print(f"✅ {job_id} executado.")
+    return 0
+
+
+def comando_precos(argumentos) -> int:
+    return _executar_job('atualizar_precos_b3')
+
+
+def comando_job(argumentos) -> int:
+    return _executar_job(argumentos.job)
+
+
+def comando_backup(argumentos) -> int:
+    from app import carteiras
+    from app.database import DATA_DIR
+    from app.services.backup_engine import realizar_backup, limpar_backups_antigos, listar_backups, restaurar_backup
+
+    if argumentos.acao in ('auto', 'completo', 'incremental'):
+        # Todos os bancos: um só no modo compartilhado, um por carteira no modo 'arquivo'
+        completo = {'completo': True, 'incremental': False}.get(argumentos.acao)
+        for banco in carteiras.bancos():
+            manifesto = realizar_backup(completo=completo, db_path=banco)
+            print(f"✅ Backup {manifesto['tipo']}: {manifesto['arquivo']} {manifesto['metricas']}")
+            limpar_backups_antigos(banco)
+        return 0
+
+    # Listagem e restauração são do banco de uma carteira (padrão: a principal)
+    try:
+        db_path = carteiras.obter_carteira(argumentos.carteira).db_path
+    except (carteiras.CarteiraNaoEncontrada, ValueError):
+        print(f"❌ Carteira não encontrada: {argumentos.carteira}")
+        return 1
+    if argumentos.acao == 'listar':
+        for b in listar_backups(db_path):
+            print(f"{b['nome']}  {b['tipo']:<11}  {b['bytes_arquivo']:>12} bytes  ({b['paginas_gravadas']} páginas)")
+    elif argumentos.acao == 'restaurar':
+        if not argumentos.nome:
+            print("❌ Informe o backup: python -m masterfy backup restaurar NOME [--destino ARQUIVO] [--carteira NOME]")
+            return 2
+        # Por segurança, o padrão é restaurar ao lado do banco; use --destino para substituir (com o app parado)
+        destino = argumentos.destino or os.path.join(
+            DATA_DIR, f"{os.path.splitext(os.path.basename(db_path))[0]}_restaurado.db"
+        )
+        metricas = restaurar_backup(argumentos.nome, destino, db_path)
+        print(f"✅ Backup {argumentos.nome} restaurado e verificado em {destino} ({metricas})")
+    return 0
+
+
+def comando_importar(argumentos) -> int:
+    from app.carteiras import CarteiraNaoEncontrada, obter_carteira
+    from app.migracoes import migrar
+    from app.services.import_engine import importar_csv
+
+    migrar()
+    try:
+        carteira = obter_carteira(argumentos.carteira)
+    except (CarteiraNaoEncontrada, ValueError):
+        print(f"❌ Carteira não encontrada: {argumentos.carteira}")
+        return 1
+    with open(argumentos.arquivo, encoding='utf-8-sig', errors='replace', newline='') as arquivo, \
+            carteira.conexao() as db:
+        resumo = importar_csv(db, arquivo, destino=argumentos.destino, formato=argumentos.formato,
+                              carteira_id=carteira.id)
+    for erro in resumo.erros[:20]:
+        print(f"❌ Linha {erro['linha']}: {erro['erro']}")
+    print(f"✅ {resumo}")
+    return 0
+
+
+def comando_migrar(argumentos) -> int:
+    import sqlite3
+
+    from app import carteiras
+    from app.database import DB_PATH
+    from app.migracoes import MIGRACOES, VERSAO_ESQUEMA, migrar, versao_banco
+
+    if argumentos.status:
+        if not os.path.exists(DB_PATH):
+            print(f"Banco ainda não criado em {DB_PATH}.")
+            return 0
+        with sqlite3.connect(DB_PATH) as db:
+            versao = versao_banco(db)
+        for numero, descricao, _ in MIGRACOES:
+            print(f"{'✅' if numero <= versao else '⏳'} {numero}: {descricao}")
+        return 0
+
+    # O banco principal primeiro (tem a tabela de carteiras); no modo 'arquivo', depois o de cada carteira
+    aplicadas = migrar()
+    for db_path in carteiras.bancos():
+        if db_path != DB_PATH:
+            aplicadas += migrar(db_path)
+    if not aplicadas:
+        print(f"✅ Banco de dados já está na versão {VERSAO_ESQUEMA}.")
+    return 0
+
+
+def _argumentos(args=None):
+    parser = argparse.ArgumentParser(prog='python -m masterfy', description="Tarefas do masterfy pela linha de comando")
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    precos = comandos.add_parser('precos', aliases=['refresh'], help="Atualiza os preços de todos os ativos")
+    precos.set_defaults(executar=comando_precos)
+
+    backup = comandos.add_parser('backup', help="Backup incremental, completo, listagem ou restauração")
+    backup.add_argument('acao', nargs='?', default='auto',
+                        choices=('auto', 'completo', 'incremental', 'listar', 'restaurar'))
+    backup.add_argument('nome', nargs='?', help="Backup a restaurar")
+    backup.add_argument('--destino', help="Arquivo do banco restaurado")
+    backup.add_argument('--carteira', default='principal', help="Carteira cujos backups são listados ou restaurados")
+    backup.set_defaults(executar=comando_backup)
+
+    importar = comandos.add_parser('importar', aliases=['import'], help="Importa transações ou proventos de um CSV")
+    importar.add_argument('destino', choices=('transacoes', 'proventos'))
+    importar.add_argument('arquivo')
+    importar.add_argument('--formato', default='auto')
+    importar.add_argument('--carteira', default='principal')
+    importar.set_defaults(executar=comando_importar)
+
+    migrar = comandos.add_parser('migrar', aliases=['migrate'], help="Aplica as migrações pendentes do esquema")
+    migrar.add_argument('--status', action='store_true', help="Só mostra as migrações aplicadas e pendentes")
+    migrar.set_defaults(executar=comando_migrar)
+
+    job = comandos.add_parser('job', help="Executa um job do agendador agora")
+    job.add_argument('job')
+    job.set_defaults(executar=comando_job)
+    return parser.parse_args(args)
+
+
+def main(args=None) -> int:
+    argumentos = _argumentos(args)
+    try:
+        return argumentos.executar(argumentos)
+    finally:
+        # Só há pools e carteiras abertos se o comando chegou a carregar o app
+        if 'app.carteiras' in sys.modules:
+            sys.modules['app.carteiras'].fechar_carteiras()
+        if 'app.database' in sys.modules:
+            sys.modules['app.database'].fechar_pools()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
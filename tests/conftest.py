@@ -0,0 +1,17 @@
+import os
+import tempfile
+
+# Banco numa pasta temporária e sem agendador, antes de qualquer import do app (DATA_DIR é lido no import)
+os.environ['MASTERFY_DATA_DIR'] = tempfile.mkdtemp(prefix='masterfy_testes_')
+os.environ['MASTERFY_AGENDADOR'] = '0'
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def cliente():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as cliente:
+        yield cliente
@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from app import agendador
+from app.agendador import Job, executar_job
+from app.database import conexao
+from app.migracoes import migrar
+
+_comecou, _liberar = threading.Event(), threading.Event()
+
+
+def _job_lento():
+    _comecou.set()
+    _liberar.wait(5)
+
+
+def _perder_a_trava():
+    # O lease desta execução expirou no meio e outra execução já pegou a trava
+    with conexao() as db:
+        db.execute("UPDATE jobs_travas SET dono = 'outro:1', expira_em = expira_em + 60 WHERE job = 'job_lento'")
+        db.commit()
+
+
+@pytest.fixture
+def job_lento(monkeypatch):
+    migrar()
+    _comecou.clear()
+    _liberar.clear()
+    monkeypatch.setitem(agendador.JOBS, 'job_lento', Job('job_lento', 'tests.test_agendador:_job_lento'))
+    yield 'job_lento'
+    _liberar.set()
+    with conexao() as db:
+        db.execute("DELETE FROM jobs_travas WHERE job = 'job_lento'")
+        db.commit()
+
+
+def _trava(job_id: str):
+    with conexao() as db:
+        linha = db.execute("SELECT dono FROM jobs_travas WHERE job = ?", (job_id,)).fetchone()
+    return linha and linha['dono']
+
+
+def test_lease_do_proprio_processo_barra_a_segunda_execucao(job_lento):
+    primeira = threading.Thread(target=executar_job, args=(job_lento, 'manual'))
+    primeira.start()
+    assert _comecou.wait(5)
+    dono = _trava(job_lento)
+
+    # O cron dispara no mesmo processo enquanto a execução manual ainda roda
+    assert executar_job(job_lento) is None
+    assert _trava(job_lento) == dono
+
+    _liberar.set()
+    primeira.join(5)
+    assert _trava(job_lento) is None
+
+
+def test_execucao_so_apaga_o_proprio_lease(job_lento, monkeypatch):
+    monkeypatch.setitem(agendador.JOBS, job_lento, Job(job_lento, 'tests.test_agendador:_perder_a_trava'))
+    assert executar_job(job_lento, 'manual') is not None
+    assert _trava(job_lento) == 'outro:1'
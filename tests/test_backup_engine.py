@@ -0,0 +1,56 @@
+import os
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from app import carteiras
+from app.migracoes import migrar
+from app.services import backup_engine
+
+
+@pytest.fixture
+def modo_arquivo(monkeypatch):
+    migrar()
+    armazenamento = carteiras.ArmazenamentoPorArquivo()
+    monkeypatch.setattr(carteiras, '_armazenamento', armazenamento)
+    _, caminho = armazenamento.criar('backup_teste')
+    with closing(sqlite3.connect(caminho)) as db, db:
+        db.execute("INSERT INTO ativos (carteira_id, ticker, nome, tipo, setor, preco_atual) "
+                   "VALUES (1, 'BKUP3', 'Backup SA', 'ACAO', 'Outros', 1.0)")
+    yield caminho
+    os.remove(caminho)
+
+
+def test_backup_diario_cobre_os_arquivos_de_carteira(modo_arquivo, tmp_path):
+    backup_engine.realizar_backup_diario()
+
+    # Cadeia e manifestos próprios do arquivo da carteira, separados dos do banco principal
+    backups = backup_engine.listar_backups(modo_arquivo)
+    assert [b['tipo'] for b in backups] == ['completo']
+    assert backups[0]['nome'].startswith('backup_teste_')
+    assert backups[0]['nome'] not in {b['nome'] for b in backup_engine.listar_backups()}
+
+    destino = str(tmp_path / 'restaurado.db')
+    backup_engine.restaurar_backup(backups[0]['nome'], destino, modo_arquivo)
+    with closing(sqlite3.connect(destino)) as db:
+        assert db.execute("SELECT ticker FROM ativos").fetchall() == [('BKUP3',)]
+
+
+def test_falha_no_backup_diario_fica_registrada_como_erro(monkeypatch):
+    from app.agendador import executar_job
+    from app.database import conexao
+
+    migrar()
+
+    def falhar(completo=None, db_path=None):
+        raise OSError("disco cheio")
+    monkeypatch.setattr(backup_engine, 'realizar_backup', falhar)
+
+    with pytest.raises(OSError):
+        executar_job('realizar_backup_diario', 'manual')
+    with conexao() as db:
+        execucao = db.execute(
+            "SELECT status, detalhe FROM jobs_execucoes WHERE job = 'realizar_backup_diario' ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+    assert tuple(execucao) == ('erro', 'OSError: disco cheio')
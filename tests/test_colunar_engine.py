@@ -0,0 +1,93 @@
+from app import main
+from app.services import colunar_engine
+from app.services.colunar_engine import abrir_exportacao, exportar_banco
+
+JSON = {"accept": "application/json"}
+
+
+def _editar(sql: str, parametros: tuple):
+    with main.pool_escrita().conexao() as db:
+        db.execute(sql, parametros)
+        db.commit()
+
+
+def test_editar_so_o_tipo_regrava_o_segmento(cliente):
+    ativo_id = cliente.post(
+        "/web/ativos/", data={"ticker": "COLU3", "nome": "Colunar SA", "tipo": "ACAO"}, headers=JSON
+    ).json()["ativo_id"]
+    transacao_id = cliente.post("/web/transacoes/", data={
+        "ativo_id": ativo_id, "data": "2024-01-02", "tipo_transacao": "COMPRA", "quantidade": 10, "preco_unitario": 5.0
+    }, headers=JSON).json()["transacao_id"]
+    provento_id = cliente.post("/web/proventos/", data={
+        "ativo_id": ativo_id, "data": "2024-02-01", "tipo": "Dividendo", "valor": 2.0
+    }, headers=JSON).json()["provento_id"]
+    exportar_banco()
+
+    # Mesmo tamanho e mesma inicial: só um hash das colunas percebe a troca
+    _editar("UPDATE proventos SET tipo = 'Devolucao' WHERE id = ?", (provento_id,))
+    _editar("UPDATE transacoes SET tipo_transacao = 'VENDA' WHERE id = ?", (transacao_id,))
+    resumo = exportar_banco()['ultima_exportacao']
+    assert resumo['proventos']['regravadas'] > 0
+    assert resumo['transacoes']['regravadas'] > 0
+
+    exportacao = abrir_exportacao()
+    proventos, transacoes = exportacao.tabela('proventos'), exportacao.tabela('transacoes')
+    assert proventos[proventos['id'] == provento_id]['tipo'][0] == 'Devolucao'
+    assert transacoes[transacoes['id'] == transacao_id]['sinal'][0] == -1
+
+    # Sem edição nada é regravado
+    resumo = exportar_banco()['ultima_exportacao']
+    assert resumo['proventos']['regravadas'] == resumo['transacoes']['regravadas'] == 0
+
+
+def _anotadas() -> int:
+    with main.pool_escrita().conexao() as db:
+        return db.execute("SELECT COUNT(*) FROM colunar_alteracoes").fetchone()[0]
+
+
+def test_so_os_segmentos_editados_sao_relidos(cliente, monkeypatch):
+    monkeypatch.setattr(colunar_engine, 'LINHAS_POR_SEGMENTO', 2)
+    monkeypatch.setattr(colunar_engine, 'LIMITE_SEGMENTOS', 1000)
+    ativo_id = cliente.post(
+        "/web/ativos/", data={"ticker": "SEGM3", "nome": "Segmentos SA", "tipo": "ACAO"}, headers=JSON
+    ).json()["ativo_id"]
+    exportar_banco()
+    ids = [cliente.post("/web/transacoes/", data={
+        "ativo_id": ativo_id, "data": f"2024-01-0{dia}", "tipo_transacao": "COMPRA", "quantidade": 1,
+        "preco_unitario": 5.0
+    }, headers=JSON).json()["transacao_id"] for dia in range(2, 8)]
+
+    # Linha ainda não exportada: a edição não é anotada, a linha entra como nova
+    _editar("UPDATE transacoes SET quantidade = 2 WHERE id = ?", (ids[0],))
+    assert _anotadas() == 0
+    resumo = exportar_banco()['ultima_exportacao']['transacoes']
+    assert resumo['novas'] == 6 and resumo['relidas'] == 0
+
+    _editar("UPDATE transacoes SET quantidade = 3 WHERE id = ?", (ids[3],))
+    resumo = exportar_banco()['ultima_exportacao']
+    assert resumo['transacoes']['relidas'] == resumo['transacoes']['regravadas'] == 2
+    assert resumo['proventos']['relidas'] == resumo['historico_precos']['relidas'] == 0
+    assert _anotadas() == 0
+
+    _editar("DELETE FROM transacoes WHERE id = ?", (ids[5],))
+    linhas = abrir_exportacao().manifesto['tabelas']['transacoes']['linhas']
+    resumo = exportar_banco()['ultima_exportacao']['transacoes']
+    assert resumo['relidas'] == 1 and resumo['linhas'] == linhas - 1
+
+    transacoes = abrir_exportacao().tabela('transacoes')
+    minhas = transacoes[transacoes['ativo_id'] == ativo_id]
+    assert minhas['id'].tolist() == ids[:5]
+    assert minhas['quantidade'].tolist() == [2, 1, 1, 3, 1]
+
+    # Sem edição nada é relido
+    resumo = exportar_banco()['ultima_exportacao']
+    assert all(tabela['relidas'] == 0 for nome, tabela in resumo.items() if nome != 'posicoes')
+
+
+def test_selecionar_filtra_cada_segmento(cliente):
+    exportar_banco()
+    exportacao = abrir_exportacao()
+    transacoes = exportacao.tabela('transacoes')
+    assert exportacao.tabela('transacoes') is transacoes
+    compras = exportacao.selecionar('transacoes', lambda t: t['sinal'] == 1)
+    assert compras.tolist() == transacoes[transacoes['sinal'] == 1].tolist()
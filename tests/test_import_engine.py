@@ -0,0 +1,77 @@
+import io
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from app.migracoes import migrar
+from app.services.import_engine import ErroLinha, _numero, importar_csv
+
+
+@pytest.mark.parametrize('texto, valor', [
+    ('R$ 1.234,56', 1234.56),
+    ('1.000,5', 1000.5),
+    ('10,5', 10.5),
+    ('10.5', 10.5),
+    ('0.125', 0.125),
+    ('1234.5678', 1234.5678),
+    ('12.345.678', 12345678.0),
+])
+def test_numero_no_formato_padrao(texto, valor):
+    assert _numero(texto) == valor
+
+
+@pytest.mark.parametrize('texto', ['1.500', '28.150', '-2.500'])
+def test_numero_ambiguo_no_formato_padrao_vira_erro_da_linha(texto):
+    with pytest.raises(ErroLinha, match='ambíguo'):
+        _numero(texto)
+
+
+@pytest.mark.parametrize('texto, valor', [
+    ('1.000', 1000.0),
+    ('12.345.678', 12345678.0),
+    ('-2.500', -2500.0),
+    ('28,15', 28.15),
+    ('0.125', 0.125),
+])
+def test_numero_nos_extratos_da_b3_usa_ponto_de_milhar(texto, valor):
+    assert _numero(texto, decimal_br=True) == valor
+
+
+@pytest.mark.parametrize('texto', ['', '-', 'abc'])
+def test_numero_invalido_vira_erro_da_linha(texto):
+    with pytest.raises(ErroLinha):
+        _numero(texto)
+
+
+@pytest.fixture
+def banco(tmp_path):
+    caminho = str(tmp_path / 'importacao.db')
+    migrar(caminho)
+    with closing(sqlite3.connect(caminho)) as db:
+        yield db
+
+
+def test_importacao_padrao_nao_multiplica_preco_com_ponto(banco):
+    arquivo = io.StringIO(
+        "ticker;data;tipo_transacao;quantidade;preco_unitario\n"
+        "PETR4;2024-01-02;COMPRA;100;28.15\n"
+        "PETR4;2024-01-03;COMPRA;100;28.150\n"
+        "PETR4;2024-01-04;COMPRA;1.000,5;28,15\n"
+    )
+    resumo = importar_csv(banco, arquivo, destino='transacoes', formato='padrao')
+    assert (resumo.inseridas, resumo.total_erros) == (2, 1)
+    assert resumo.erros[0]['linha'] == 3 and 'ambíguo' in resumo.erros[0]['erro']
+    assert banco.execute("SELECT quantidade, preco_unitario FROM transacoes ORDER BY id").fetchall() == [
+        (100.0, 28.15), (1000.5, 28.15)
+    ]
+
+
+def test_importacao_b3_le_ponto_como_milhar(banco):
+    arquivo = io.StringIO(
+        "Data do Negócio;Tipo de Movimentação;Código de Negociação;Quantidade;Preço\n"
+        "02/01/2024;Compra;PETR4F;1.000;28,15\n"
+    )
+    resumo = importar_csv(banco, arquivo, destino='transacoes')
+    assert (resumo.formato, resumo.inseridas) == ('b3_negociacao', 1)
+    assert banco.execute("SELECT quantidade, preco_unitario FROM transacoes").fetchall() == [(1000.0, 28.15)]
@@ -0,0 +1,53 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from app.services.performance_engine import DTYPE_PRECO, DTYPE_PROVENTO, DTYPE_TRANSACAO, _calcular
+
+# Terça e quarta-feira: dois dias úteis seguidos
+DIA_1, DIA_2 = date(2024, 1, 2), date(2024, 1, 3)
+
+
+def _dia(data: date) -> int:
+    return (data - date(1970, 1, 1)).days
+
+
+def _performance(transacoes: list, precos: list) -> dict:
+    """transacoes: (ativo_id, data, sinal, quantidade, preco); precos: (ativo_id, data, fechamento). O resumo sai com 6 casas."""
+    return _calcular(
+        np.array([(a, _dia(d), s, q, p, 0.0) for a, d, s, q, p in transacoes], dtype=DTYPE_TRANSACAO),
+        np.array([(a, _dia(d), p) for a, d, p in precos], dtype=DTYPE_PRECO),
+        np.zeros(0, dtype=DTYPE_PROVENTO),
+        21, DIA_2,
+    )
+
+
+@pytest.mark.parametrize('preco_venda, retorno', [(9.0, -0.10), (11.0, 0.10)])
+def test_venda_total_rende_a_variacao_do_dia(preco_venda, retorno):
+    resultado = _performance(
+        [(1, DIA_1, 1, 100, 10.0), (1, DIA_2, -1, 100, preco_venda)],
+        [(1, DIA_1, 10.0), (1, DIA_2, preco_venda)],
+    )
+    assert resultado['resumo']['twr'] == pytest.approx(retorno, abs=1e-6)
+
+
+@pytest.mark.parametrize('preco_venda', [9.0, 11.0])
+def test_venda_parcial_nao_distorce_o_retorno(preco_venda):
+    # Ativo 1: 100 a R$ 10; ativo 2: 10 a R$ 10, parado. No dia 2 vende todo o ativo 1
+    resultado = _performance(
+        [(1, DIA_1, 1, 100, 10.0), (2, DIA_1, 1, 10, 10.0), (1, DIA_2, -1, 100, preco_venda)],
+        [(1, DIA_1, 10.0), (2, DIA_1, 10.0), (1, DIA_2, preco_venda), (2, DIA_2, 10.0)],
+    )
+    esperado = (100 + 100 * preco_venda) / 1100 - 1  # -9,1% ou +9,1%
+    assert resultado['resumo']['twr'] == pytest.approx(esperado, abs=1e-6)
+
+
+@pytest.mark.parametrize('preco_venda', [9.0, 11.0])
+def test_venda_de_metade_da_posicao(preco_venda):
+    resultado = _performance(
+        [(1, DIA_1, 1, 100, 10.0), (1, DIA_2, -1, 50, preco_venda)],
+        [(1, DIA_1, 10.0), (1, DIA_2, preco_venda)],
+    )
+    assert resultado['resumo']['twr'] == pytest.approx(preco_venda / 10.0 - 1, abs=1e-6)
+    assert resultado['resumo']['aportes_liquidos'] == pytest.approx(1000 - 50 * preco_venda)
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from app.services.price_engine import buscar_precos
+
+
+class ProvedorSerializado:
+    """Como o Yahoo: um lote por vez (trava), cada um levando `latencia` segundos."""
+
+    def __init__(self, latencia: float):
+        self.latencia = latencia
+        self.trava = threading.RLock()
+
+    def buscar_lote(self, tickers: list) -> dict:
+        with self.trava:
+            time.sleep(self.latencia)
+            return {t: 10.0 for t in tickers}
+
+
+def test_espera_pela_trava_nao_consome_o_prazo_do_lote():
+    # 4 lotes de 0,2 s em série: cada um cabe no prazo de 0,5 s, mas a soma (0,8 s) não
+    resumo = buscar_precos(['AAAA3', 'BBBB3', 'CCCC3', 'DDDD3'], provedor=ProvedorSerializado(0.2),
+                           tamanho_lote=1, max_workers=4, timeout=0.5, tentativas=1)
+    assert resumo.falhas == {}
+    assert len(resumo.precos) == 4
+
+
+def test_lote_travado_vira_timeout_sem_segurar_a_rodada():
+    inicio = time.perf_counter()
+    resumo = buscar_precos(['AAAA3', 'BBBB3'], provedor=ProvedorSerializado(1.0),
+                           tamanho_lote=1, max_workers=2, timeout=0.2, tentativas=1)
+    assert resumo.precos == {}
+    assert resumo.falhas == {'AAAA3': 'timeout', 'BBBB3': 'timeout'}
+    # Prazo da rodada: 2 lotes em série × 0,2 s
+    assert time.perf_counter() - inicio < 0.8
+
+
+class ProvedorInstavel(ProvedorSerializado):
+    """Serializado; a primeira chamada com `AAAA3` falha, as outras respondem na hora."""
+
+    def __init__(self):
+        super().__init__(0.0)
+        self.chamadas = []
+
+    def buscar_lote(self, tickers: list) -> dict:
+        with self.trava:
+            self.chamadas.append((time.perf_counter(), tuple(tickers)))
+            if tickers == ['AAAA3'] and len([c for c in self.chamadas if c[1] == ('AAAA3',)]) == 1:
+                raise ConnectionError("instável")
+            return {t: 10.0 for t in tickers}
+
+
+def test_espera_entre_tentativas_nao_segura_a_trava():
+    provedor = ProvedorInstavel()
+    inicio = time.perf_counter()
+    resumo = buscar_precos(['AAAA3', 'BBBB3', 'CCCC3'], provedor=provedor, tamanho_lote=1, max_workers=3,
+                           timeout=2.0, tentativas=2, espera_inicial=0.5)
+    assert resumo.falhas == {}
+    assert len(resumo.precos) == 3
+    # Os outros lotes foram buscados durante a espera de AAAA3, não depois dela
+    outros = [momento - inicio for momento, lote in provedor.chamadas if lote != ('AAAA3',)]
+    assert max(outros) < 0.3
+
+
+def test_lote_nao_tenta_de_novo_depois_do_prazo():
+    provedor = ProvedorInstavel()
+    resumo = buscar_precos(['AAAA3'], provedor=provedor, tamanho_lote=1, max_workers=1,
+                           timeout=0.2, tentativas=3, espera_inicial=0.5)
+    assert resumo.falhas == {'AAAA3': 'instável'}
+    assert len(provedor.chamadas) == 1
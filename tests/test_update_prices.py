@@ -0,0 +1,46 @@
+from app import main
+from app.services.update_prices import atualizar_precos_b3
+
+JSON = {"accept": "application/json"}
+
+
+class ProvedorComPregao:
+    """O último fechamento do download é da sexta: a atualização roda no sábado ou antes da abertura."""
+
+    def buscar_fechamentos(self, tickers: list) -> dict:
+        return {t: ('2024-03-08', 12.34) for t in tickers}
+
+    def buscar_lote(self, tickers: list) -> dict:
+        return {t: preco for t, (_, preco) in self.buscar_fechamentos(tickers).items()}
+
+
+class ProvedorSemPregao:
+    def buscar_lote(self, tickers: list) -> dict:
+        return {t: 56.78 for t in tickers}
+
+
+def _ativo(cliente, ticker: str) -> int:
+    return cliente.post(
+        "/web/ativos/", data={"ticker": ticker, "nome": f"{ticker} SA", "tipo": "ACAO"}, headers=JSON
+    ).json()["ativo_id"]
+
+
+def _historico(ativo_id: int) -> list:
+    with main.pool_escrita().conexao() as db:
+        return [tuple(linha) for linha in db.execute(
+            "SELECT data, preco FROM historico_precos WHERE ativo_id = ? ORDER BY data", (ativo_id,)
+        )]
+
+
+def test_fechamento_vai_para_a_data_do_pregao(cliente):
+    ativo_id = _ativo(cliente, "PREG3")
+    atualizar_precos_b3(provedor=ProvedorComPregao())
+    assert _historico(ativo_id) == [('2024-03-08', 12.34)]
+
+
+def test_preco_sem_pregao_nao_entra_no_historico(cliente):
+    ativo_id = _ativo(cliente, "SPRG3")
+    atualizar_precos_b3(provedor=ProvedorSemPregao())
+    assert _historico(ativo_id) == []
+    with main.pool_escrita().conexao() as db:
+        assert db.execute("SELECT preco_atual FROM ativos WHERE id = ?", (ativo_id,)).fetchone()[0] == 56.78
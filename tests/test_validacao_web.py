@@ -0,0 +1,63 @@
+import pytest
+
+from app import main
+
+JSON = {"accept": "application/json"}
+
+
+@pytest.fixture(scope='module')
+def ativo_id(cliente):
+    return cliente.post(
+        "/web/ativos/", data={"ticker": "VALI3", "nome": "Validacao SA", "tipo": "ACAO"}, headers=JSON
+    ).json()["ativo_id"]
+
+
+@pytest.fixture(scope='module')
+def transacao(cliente, ativo_id):
+    dados = {"ativo_id": ativo_id, "data": "2024-01-02", "tipo_transacao": "COMPRA",
+             "quantidade": 10, "preco_unitario": 20.0}
+    resposta = cliente.post("/web/transacoes/", data=dados, headers=JSON)
+    assert resposta.status_code == 200
+    return {**dados, "id": resposta.json()["transacao_id"]}
+
+
+def _total(tabela: str, ativo_id: int) -> int:
+    with main.pool_leitura().conexao() as db:
+        return db.execute(f"SELECT COUNT(*) FROM {tabela} WHERE ativo_id = ?", (ativo_id,)).fetchone()[0]
+
+
+@pytest.mark.parametrize('campo, valor', [
+    ('data', '02/01/2024'), ('data', '2024-02-30'), ('data', ''), ('tipo_transacao', 'DOACAO'),
+])
+def test_transacao_invalida_responde_422(cliente, transacao, campo, valor):
+    dados = {**transacao, campo: valor}
+    antes = _total('transacoes', transacao['ativo_id'])
+    assert cliente.post("/web/transacoes/", data=dados, headers=JSON).status_code == 422
+    assert cliente.post(f"/web/transacoes/{transacao['id']}/editar", data=dados, headers=JSON).status_code == 422
+    assert _total('transacoes', transacao['ativo_id']) == antes
+
+
+def test_tipo_e_data_sao_normalizados(cliente, transacao):
+    dados = {**transacao, "data": "20240103", "tipo_transacao": " venda "}
+    assert cliente.post(f"/web/transacoes/{transacao['id']}/editar", data=dados, headers=JSON).status_code == 200
+    with main.pool_leitura().conexao() as db:
+        linha = db.execute("SELECT data, tipo_transacao FROM transacoes WHERE id = ?", (transacao['id'],)).fetchone()
+    assert tuple(linha) == ('2024-01-03', 'VENDA')
+
+
+@pytest.mark.parametrize('data', ['2024-13-01', 'ontem'])
+def test_provento_com_data_invalida_responde_422(cliente, ativo_id, data):
+    antes = _total('proventos', ativo_id)
+    resposta = cliente.post("/web/proventos/", data={"ativo_id": ativo_id, "data": data, "tipo": "Dividendo",
+                                                     "valor": 1.0}, headers=JSON)
+    assert resposta.status_code == 422
+    assert _total('proventos', ativo_id) == antes
+
+
+def test_check_do_banco_vira_422(cliente, ativo_id, monkeypatch):
+    # Sem a validação da rota, o CHECK da tabela recusa a data e a resposta continua sendo 422
+    monkeypatch.setattr(main, '_validar_data', lambda data: data)
+    resposta = cliente.post("/web/proventos/", data={"ativo_id": ativo_id, "data": "01/02/2024", "tipo": "Dividendo",
+                                                     "valor": 1.0}, headers=JSON)
+    assert resposta.status_code == 422
+    assert _total('proventos', ativo_id) == 0
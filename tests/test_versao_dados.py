@@ -0,0 +1,79 @@
+from app.cache import CacheCarteira, CHAVE_PORTFOLIO, CHAVE_METAS
+from app.carteiras import NOME_PRINCIPAL, obter_carteira
+from app.database import DB_PATH, ID_CARTEIRA_PRINCIPAL, ler_versao_dados
+from app.services.historico_engine import carregar_historico
+from app.services.price_engine import ProvedorFalso
+
+JSON = {"accept": "application/json"}
+
+
+def _cache_de_outro_worker() -> CacheCarteira:
+    """Cache da mesma carteira num outro processo: só enxerga as gravações daqui pela versão no banco."""
+    cache = CacheCarteira(NOME_PRINCIPAL)
+    cache.sincronizar_com(lambda: ler_versao_dados(DB_PATH, ID_CARTEIRA_PRINCIPAL), intervalo=0)
+    return cache
+
+
+def test_gravacoes_da_web_descartam_o_cache_dos_outros_workers(cliente):
+    ativo_id = cliente.post(
+        "/web/ativos/", data={"ticker": "VERS3", "nome": "Versao SA", "tipo": "ACAO"}, headers=JSON
+    ).json()["ativo_id"]
+    outro = _cache_de_outro_worker()
+    calculos = []
+    outro.obter(CHAVE_PORTFOLIO, lambda: calculos.append(1))
+
+    transacao = {"ativo_id": ativo_id, "data": "2024-01-02", "tipo_transacao": "COMPRA",
+                 "quantidade": 10, "preco_unitario": 20.0}
+    transacao_id = cliente.post("/web/transacoes/", data=transacao, headers=JSON).json()["transacao_id"]
+    outro.obter(CHAVE_PORTFOLIO, lambda: calculos.append(1))
+    assert len(calculos) == 2
+
+    cliente.post(f"/web/transacoes/{transacao_id}/editar", data={**transacao, "quantidade": 5}, headers=JSON)
+    outro.obter(CHAVE_PORTFOLIO, lambda: calculos.append(1))
+    cliente.post(f"/web/transacoes/{transacao_id}/deletar", data={"ativo_id": ativo_id}, headers=JSON)
+    outro.obter(CHAVE_PORTFOLIO, lambda: calculos.append(1))
+    cliente.post("/web/proventos/", data={"ativo_id": ativo_id, "data": "2024-02-01", "tipo": "Dividendo",
+                                          "valor": 3.0}, headers=JSON)
+    outro.obter(CHAVE_PORTFOLIO, lambda: calculos.append(1))
+    assert len(calculos) == 5
+
+    importacao = "ticker;data;tipo_transacao;quantidade;preco_unitario\nVERS3;2024-03-01;COMPRA;1;10\n"
+    resposta = cliente.post("/import/transacoes", files={"arquivo": ("t.csv", importacao)}, headers=JSON)
+    assert resposta.json()["inseridas"] == 1
+    outro.obter(CHAVE_PORTFOLIO, lambda: calculos.append(1))
+    assert len(calculos) == 6
+
+
+def test_gravacao_propria_so_invalida_as_chaves_afetadas(cliente):
+    cache = obter_carteira(NOME_PRINCIPAL).cache
+    cache.conferir_versao_externa(forcar=True)
+    cache.obter(CHAVE_METAS, lambda: 'metas')
+    ativo_id = cliente.post(
+        "/web/ativos/", data={"ticker": "PROP3", "nome": "Propria SA", "tipo": "ACAO"}, headers=JSON
+    ).json()["ativo_id"]
+    cliente.post("/web/transacoes/", data={"ativo_id": ativo_id, "data": "2024-01-02", "tipo_transacao": "COMPRA",
+                                           "quantidade": 1, "preco_unitario": 1.0}, headers=JSON)
+    assert not cache.conferir_versao_externa(forcar=True)
+    assert cache.obter(CHAVE_METAS, lambda: 'recalculado') == 'metas'
+
+
+def test_etag_do_portfolio_vale_em_qualquer_worker(cliente):
+    etag = cliente.get("/portfolio/").headers["etag"]
+    outro = _cache_de_outro_worker()
+    assert outro.etag(CHAVE_PORTFOLIO) == etag
+    assert cliente.get("/portfolio/", headers={"if-none-match": outro.etag(CHAVE_PORTFOLIO)}).status_code == 304
+
+    cliente.post("/web/metas/", data={"nivel": "tipo", "chave": "ACAO", "percentual": 50}, headers=JSON)
+    novo = cliente.get("/portfolio/").headers["etag"]
+    assert novo != etag
+    assert outro.etag(CHAVE_PORTFOLIO) == novo
+
+
+def test_carga_de_historico_descarta_o_cache_dos_outros_workers(cliente):
+    cliente.post("/web/ativos/", data={"ticker": "HIST3", "nome": "Historico SA", "tipo": "ACAO"}, headers=JSON)
+    outro = _cache_de_outro_worker()
+    calculos = []
+    outro.obter(CHAVE_PORTFOLIO, lambda: calculos.append(1))
+    assert carregar_historico(anos=1, provedor=ProvedorFalso(latencia=0)) > 0
+    outro.obter(CHAVE_PORTFOLIO, lambda: calculos.append(1))
+    assert len(calculos) == 2